@@ -0,0 +1,183 @@
+from itertools import accumulate
+import re
+
+
+ANSWER_PREFIX = re.compile(r"^\s*Ответ\s*:\s*", re.IGNORECASE)
+ACCEPTED_PREFIX = re.compile(r"^\s*Зач[её]т\s*:\s*", re.IGNORECASE)
+NON_WORD_CHARACTERS = re.compile(r"[\W_]+")
+MAX_ATTEMPT_LENGTH = 120
+
+
+def strip_answer_prefix(answer: str) -> str:
+    """
+    Removes the "Ответ:" label from the beginning of an answer.
+
+    Unlike str.lstrip, which strips a set of characters, only the label
+    itself is removed, so answers like "Овен" keep their leading letters.
+
+    Args:
+        answer (str): The answer as it appears in the question files.
+
+    Returns:
+        str: The answer without the label.
+    """
+    return ANSWER_PREFIX.sub("", answer, count=1)
+
+
+def normalize_text(text: str) -> str:
+    """
+    Brings a text to the form answers are compared in.
+
+    The text is case folded, "ё" is replaced with "е", and punctuation and
+    runs of whitespace are collapsed to single spaces.
+
+    Args:
+        text (str): Any text, e.g. a user's answer.
+
+    Returns:
+        str: The normalized text.
+    """
+    text = text.casefold().replace("ё", "е")
+    return NON_WORD_CHARACTERS.sub(" ", text).strip()
+
+
+def normalize_answer(answer: str) -> str:
+    """
+    Computes the canonical normalized form of a correct answer.
+
+    Only the first sentence of the answer is used, explanations that follow
+    it are not expected from the user.
+
+    Args:
+        answer (str): The answer as it appears in the question files.
+
+    Returns:
+        str: The normalized canonical answer.
+    """
+    return normalize_text(strip_answer_prefix(answer).split(". ")[0])
+
+
+def parse_accepted_answers(accepted: str) -> list[str]:
+    """
+    Extracts normalized alternative answers from a "Зачёт:" field.
+
+    Alternatives are separated by semicolons, e.g.
+    "Зачёт: Батарейка; аккумулятор.".
+
+    Args:
+        accepted (str): The "Зачёт:" paragraph of a question file.
+
+    Returns:
+        list[str]: Non-empty normalized alternatives.
+    """
+    alternatives = (
+        normalize_text(alternative)
+        for alternative in ACCEPTED_PREFIX.sub("", accepted, count=1).split(
+            ";"
+        )
+    )
+    return [alternative for alternative in alternatives if alternative]
+
+
+def allowed_typos(answer: str) -> int:
+    """
+    Returns how many typos are tolerated in an answer of the given length.
+
+    Short answers have to be exact, otherwise different words would pass.
+    """
+    if len(answer) <= 4:
+        return 0
+    if len(answer) <= 8:
+        return 1
+    return 2
+
+
+def bounded_edit_distance(source: str, target: str, max_distance: int) -> int:
+    """
+    Computes the Levenshtein distance between two strings, giving up as soon
+    as it exceeds max_distance.
+
+    Only the diagonal band of width 2 * max_distance + 1 of the distance
+    matrix can hold values within the bound, so the cost is
+    O(len(source) * max_distance) instead of O(len(source) * len(target)).
+
+    Args:
+        source (str): The first string.
+        target (str): The second string.
+        max_distance (int): The largest distance of interest.
+
+    Returns:
+        int: The distance, or max_distance + 1 if it is larger.
+    """
+    too_far = max_distance + 1
+    if abs(len(source) - len(target)) > max_distance:
+        return too_far
+    previous = list(range(len(target) + 1))
+    for i, source_char in enumerate(source, start=1):
+        current = [too_far] * (len(target) + 1)
+        current[0] = row_min = i
+        for j in range(
+            max(1, i - max_distance), min(len(target), i + max_distance) + 1
+        ):
+            distance = previous[j - 1] + (source_char != target[j - 1])
+            if previous[j] + 1 < distance:
+                distance = previous[j] + 1
+            if current[j - 1] + 1 < distance:
+                distance = current[j - 1] + 1
+            current[j] = distance
+            if distance < row_min:
+                row_min = distance
+        if row_min > max_distance:
+            return too_far
+        previous = current
+    return min(previous[-1], too_far)
+
+
+def is_correct_answer(user_answer: str, accepted_answers: list[str]) -> bool:
+    """
+    Checks the user's answer against the accepted answers.
+
+    An answer is correct if one of the accepted answers appears in the
+    normalized user's answer as whole words, or if a run of the user's words
+    of the same length differs from it by a few typos. Only the first
+    MAX_ATTEMPT_LENGTH characters of the user's answer are checked, which
+    bounds the cost of an attempt whatever the user sends.
+
+    Args:
+        user_answer (str): The text sent by the user.
+        accepted_answers (list[str]): The normalized canonical answer and
+            normalized alternatives.
+
+    Returns:
+        bool: True if the answer is correct.
+    """
+    user_answer = normalize_text(user_answer[:MAX_ATTEMPT_LENGTH])
+    padded_user_answer = f" {user_answer} "
+    accepted_answers = [answer for answer in accepted_answers if answer]
+    for accepted_answer in accepted_answers:
+        if f" {accepted_answer} " in padded_user_answer:
+            return True
+
+    user_words = user_answer.split()
+    words_ends = list(accumulate(len(word) + 1 for word in user_words))
+    for accepted_answer in accepted_answers:
+        max_distance = allowed_typos(accepted_answer)
+        if not max_distance:
+            continue
+        words_count = accepted_answer.count(" ") + 1
+        for start in range(len(user_words) - words_count + 1):
+            end = start + words_count
+            candidate_length = (
+                words_ends[end - 1]
+                - (words_ends[start - 1] if start else 0)
+                - 1
+            )
+            if abs(candidate_length - len(accepted_answer)) > max_distance:
+                continue
+            candidate = " ".join(user_words[start:end])
+            distance = bounded_edit_distance(
+                candidate, accepted_answer, max_distance
+            )
+            if distance <= max_distance:
+                return True
+    return False
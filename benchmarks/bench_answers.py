@@ -0,0 +1,59 @@
+import random
+import time
+
+from answers import MAX_ATTEMPT_LENGTH, is_correct_answer, normalize_answer
+
+
+ATTEMPTS = 2_000
+ANSWERS = [
+    "Ответ:\nБатарея (от battre).",
+    "Ответ:\nПринтер.",
+    "Ответ:\nЗа то, что не объяснила ему правила пользования кранами.",
+    "Ответ:\nАнтуан де Сент-Экзюпери.",
+]
+WORDS = "кот мама рама батарея принтер пушкин кран вода правило туман".split()
+
+
+def make_attempt(length: int) -> str:
+    """Returns a random user's message of roughly the given length."""
+    words = []
+    words_length = 0
+    while words_length < length:
+        words.append(random.choice(WORDS))
+        words_length += len(words[-1]) + 1
+    return " ".join(words)
+
+
+def measure(attempts: list[str], accepted_answers: list[list[str]]) -> float:
+    """Returns the number of checked attempts per second."""
+    started_at = time.perf_counter()
+    for attempt, accepted in zip(attempts, accepted_answers):
+        is_correct_answer(attempt, accepted)
+    return len(attempts) / (time.perf_counter() - started_at)
+
+
+def main() -> None:
+    """
+    Measures answer checking throughput for typical short answers, long
+    messages and huge pasted messages, which are capped at
+    MAX_ATTEMPT_LENGTH characters.
+    """
+    random.seed(1)
+    accepted_answers = [
+        [normalize_answer(random.choice(ANSWERS)), "аккумулятор"]
+        for _ in range(ATTEMPTS)
+    ]
+    for title, length in [
+        ("short", 10),
+        ("long", MAX_ATTEMPT_LENGTH),
+        ("huge", 20_000),
+    ]:
+        attempts = [make_attempt(length) for _ in range(ATTEMPTS)]
+        print(
+            f"{title:>6} answers: "
+            f"{measure(attempts, accepted_answers):,.0f} attempts/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
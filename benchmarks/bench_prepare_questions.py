@@ -0,0 +1,155 @@
+import os
+from pathlib import Path
+import statistics
+import tempfile
+import time
+from typing import Iterator, TextIO
+
+from pack_parser import PACK_ENCODING, detect_file_encoding, parse_pack
+from prepare_questions import build_question_answer_pairs, get_peak_rss_mb
+
+
+FILES = 400
+QUESTIONS_PER_FILE = 36
+
+
+def write_packs(directory: Path) -> list[Path]:
+    """
+    Writes synthetic question packs in the KOI8-R encoding, laid out like
+    the packs of the archive: headers, then questions with all the fields,
+    and lines wrapped at about 70 chars.
+
+    Args:
+        directory (Path): The directory to write the packs to.
+
+    Returns:
+        list[Path]: Paths to the written packs.
+    """
+    line = "Текст вопроса пакета, строка длиной около семидесяти знаков."
+    files = []
+    for file_number in range(FILES):
+        paragraphs = [
+            f"Чемпионат:\nПакет {file_number}",
+            "Дата:\n01-Jan-2000",
+            "Редактор:\nРедактор пакета",
+        ]
+        for number in range(QUESTIONS_PER_FILE):
+            paragraphs.append(
+                f"Вопрос {number}:\n"
+                + "\n".join([line] * 5)
+                + f"\n{file_number}-{number}"
+            )
+            paragraphs.append(f"Ответ:\nОтвет {file_number}-{number}.")
+            if number % 3 == 0:
+                paragraphs.append(f"Зачёт:\nОтвет {number}.")
+            paragraphs.append("Комментарий:\n" + "\n".join([line] * 3))
+            paragraphs.append("Источник:\n" + "\n".join([line] * 2))
+            paragraphs.append("Автор:\nАвтор вопроса")
+        path = directory / f"pack{file_number}.txt"
+        path.write_bytes("\n\n".join(paragraphs).encode("KOI8-R"))
+        files.append(path)
+    return files
+
+
+def iter_line_paragraphs(file: TextIO) -> Iterator[str]:
+    """Splits a file into paragraphs line by line, as zip_pack did."""
+    lines: list[str] = []
+    for line in file:
+        if line == "\n":
+            paragraph = "".join(lines).strip()
+            if paragraph:
+                yield paragraph
+            lines.clear()
+        else:
+            lines.append(line)
+    paragraph = "".join(lines).strip()
+    if paragraph:
+        yield paragraph
+
+
+def zip_pack(
+    filename: Path, encoding: str
+) -> list[tuple[str, tuple[str, str]]]:
+    """
+    The parser the one-pass parser replaced: streams the paragraphs of the
+    file, collects the questions and the answers with their "Зачёт:"
+    paragraphs in two lists and zips them.
+    """
+    questions: list[str] = []
+    answers: list[tuple[str, str]] = []
+    with open(filename, encoding=encoding) as file:
+        for paragraph in iter_line_paragraphs(file):
+            if paragraph.startswith("Вопрос"):
+                questions.append(paragraph)
+            if paragraph.startswith("Ответ"):
+                answers.append((paragraph, ""))
+            if paragraph.startswith(("Зачет", "Зачёт")) and answers:
+                answers[-1] = (answers[-1][0], paragraph)
+    return list(zip(questions, answers))
+
+
+def compare_parsers(files: list[Path], rounds: int = 20) -> None:
+    """
+    Measures both parsers in this process.
+
+    The parsers take turns over the packs, so a slowdown of the machine
+    hits both, and the median ratio of their times is reported.
+    """
+    ratios = []
+    for _ in range(rounds):
+        timings = []
+        for parse in [zip_pack, parse_pack]:
+            started_at = time.perf_counter()
+            for file in files:
+                parse(file, PACK_ENCODING)
+            timings.append(time.perf_counter() - started_at)
+        ratios.append(timings[0] / timings[1])
+    print(
+        f"one-pass parser: {statistics.median(ratios):.2f}x the speed of "
+        "the zip-based one"
+    )
+
+
+def measure_encoding_detection(files: list[Path], rounds: int = 20) -> None:
+    """
+    Measures the time spent on detecting the encodings of the packs as a
+    share of the time spent on parsing them in the detected encodings.
+    """
+    shares = []
+    for _ in range(rounds):
+        started_at = time.perf_counter()
+        encodings = [detect_file_encoding(file) for file in files]
+        detected_at = time.perf_counter()
+        for file, encoding in zip(files, encodings):
+            parse_pack(file, encoding)
+        parsed_at = time.perf_counter()
+        shares.append((detected_at - started_at) / (parsed_at - detected_at))
+    print(
+        f"encoding detection: {statistics.median(shares):.1%} of the "
+        "parsing time"
+    )
+
+
+def main() -> None:
+    """
+    Measures parsing speed of the one-pass parser against the zip-based
+    one, the cost of encoding detection, and the speed of the corpus
+    builder with one worker process and with one worker per CPU.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        files = write_packs(Path(directory))
+        compare_parsers(files)
+        measure_encoding_detection(files)
+        for workers in sorted({1, os.cpu_count() or 1}):
+            started_at = time.perf_counter()
+            questions = build_question_answer_pairs(files, workers=workers)
+            elapsed = time.perf_counter() - started_at
+            print(
+                f"workers={workers}: {len(questions)} questions, "
+                f"{len(files) / elapsed:.0f} files/s"
+            )
+    print(f"peak RSS: {get_peak_rss_mb():.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import json
+from pathlib import Path
+import random
+import tempfile
+import time
+import timeit
+
+from answers import normalize_answer
+from question_bank import MappedQuestionBank, QuestionBank, write_question_bank
+
+CORPUS_SIZES = (1_000, 10_000, 100_000, 500_000)
+REPEATS = 200
+
+
+def build_corpus(size: int) -> dict[str, str]:
+    """
+    Builds a synthetic corpus of questions and answers.
+
+    Args:
+        size (int): The number of questions in the corpus.
+
+    Returns:
+        dict[str, str]: Questions as keys and their answers as values.
+    """
+    return {
+        f"Вопрос {number}:\nТекст вопроса номер {number}": f"Ответ:\n{number}."
+        for number in range(size)
+    }
+
+
+def build_records(
+    questions_and_answers: dict[str, str],
+) -> list[tuple[str, str, str, str]]:
+    """Builds question bank records from questions and answers."""
+    return [
+        (question, answer, normalize_answer(answer), "")
+        for question, answer in questions_and_answers.items()
+    ]
+
+
+def measure(statement, repeats: int = REPEATS) -> float:
+    """Returns the best per-call time of the statement in microseconds."""
+    timings = timeit.repeat(statement, number=repeats, repeat=5)
+    return min(timings) / repeats * 1_000_000
+
+
+def measure_sampling() -> None:
+    """
+    Compares picking a random question from the dictionary keys with
+    sampling from a QuestionBank for growing corpus sizes.
+
+    The dictionary approach copies all keys on every request, so its cost
+    grows linearly with the corpus, while the bank stays flat.
+    """
+    print(
+        f"{'questions':>10} {'dict keys, us':>15} {'bank, us':>10} "
+        f"{'mapped bank, us':>16}"
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        for size in CORPUS_SIZES:
+            questions_and_answers = build_corpus(size)
+            questions = QuestionBank.from_dict(questions_and_answers)
+            bank_path = Path(directory) / f"{size}.bin"
+            write_question_bank(
+                bank_path, build_records(questions_and_answers)
+            )
+            mapped_questions = MappedQuestionBank(bank_path)
+            dict_time = measure(
+                lambda: random.choice(list(questions_and_answers.keys()))
+            )
+            bank_time = measure(
+                lambda: questions.question(questions.random_id())
+            )
+            mapped_time = measure(
+                lambda: mapped_questions.question(mapped_questions.random_id())
+            )
+            print(
+                f"{size:>10} {dict_time:>15.2f} {bank_time:>10.2f} "
+                f"{mapped_time:>16.2f}"
+            )
+            mapped_questions.close()
+
+
+def measure_startup() -> None:
+    """
+    Compares loading the corpus from JSON with mapping a question bank file.
+    """
+    print(f"{'questions':>10} {'json.load, ms':>15} {'mmap, ms':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        for size in CORPUS_SIZES:
+            questions_and_answers = build_corpus(size)
+            json_path = Path(directory) / f"{size}.json"
+            bank_path = Path(directory) / f"{size}.bin"
+            with open(json_path, "w", encoding="utf-8") as json_file:
+                json.dump(questions_and_answers, json_file, ensure_ascii=False)
+            write_question_bank(
+                bank_path, build_records(questions_and_answers)
+            )
+
+            started_at = time.perf_counter()
+            with open(json_path, encoding="utf-8") as json_file:
+                QuestionBank.from_dict(json.load(json_file))
+            json_time = (time.perf_counter() - started_at) * 1000
+            started_at = time.perf_counter()
+            MappedQuestionBank(bank_path).close()
+            mmap_time = (time.perf_counter() - started_at) * 1000
+            print(f"{size:>10} {json_time:>15.1f} {mmap_time:>10.3f}")
+
+
+def main() -> None:
+    measure_sampling()
+    print()
+    measure_startup()
+
+
+if __name__ == "__main__":
+    main()
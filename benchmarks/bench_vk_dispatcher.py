@@ -0,0 +1,85 @@
+import random
+import time
+from unittest.mock import Mock
+
+import fakeredis
+
+from dispatcher import OrderedWorkerPool
+from question_bank import QuestionBank
+from sessions import VK_PLATFORM
+from storage import QuizStore
+from vk_bot import handle_event, set_keyboard
+from vk_replies import ReplySender
+
+
+EVENTS = 400
+USERS = 100
+API_LATENCY = 0.005
+
+
+def make_vk_api() -> Mock:
+    """Returns a fake VK API whose every method takes API_LATENCY."""
+    vk_api = Mock()
+    vk_api.messages.send.side_effect = lambda **params: time.sleep(API_LATENCY)
+    vk_api.execute.side_effect = lambda **params: time.sleep(API_LATENCY)
+    return vk_api
+
+
+def measure(
+    workers: int, questions: QuestionBank
+) -> tuple[float, float, float]:
+    """
+    Returns handled events per second, API calls and Redis round trips per
+    event.
+    """
+    vk_api = make_vk_api()
+    store = QuizStore(fakeredis.FakeRedis(), questions, VK_PLATFORM)
+    keyboard = set_keyboard()
+    events = [
+        Mock(
+            user_id=random.randrange(USERS),
+            text=random.choice(["Сдаться", "Новый вопрос"]),
+        )
+        for _ in range(EVENTS)
+    ]
+    started_at = time.perf_counter()
+    with ReplySender(vk_api) as replies, OrderedWorkerPool(workers) as pool:
+        for event in events:
+            pool.submit(
+                event.user_id,
+                handle_event,
+                event,
+                replies,
+                questions,
+                store,
+                keyboard,
+            )
+    events_per_second = EVENTS / (time.perf_counter() - started_at)
+    api_calls = vk_api.messages.send.call_count + vk_api.execute.call_count
+    round_trips = store.round_trips["handle_event"]
+    return events_per_second, api_calls / EVENTS, round_trips / EVENTS
+
+
+def main() -> None:
+    """
+    Measures how the VK bot throughput scales with the number of workers
+    when every API call takes API_LATENCY seconds, and how many API calls
+    an event costs in API calls and Redis round trips.
+    """
+    random.seed(1)
+    questions = QuestionBank.from_dict(
+        {f"Вопрос {number}": f"Ответ {number}" for number in range(1000)}
+    )
+    for workers in [1, 4, 16, 64]:
+        events_per_second, calls_per_event, round_trips = measure(
+            workers, questions
+        )
+        print(
+            f"{workers:>3} workers: {events_per_second:8.0f} events/s, "
+            f"{calls_per_event:.2f} API calls/event, "
+            f"{round_trips:.2f} Redis round trips/event"
+        )
+
+
+if __name__ == "__main__":
+    main()
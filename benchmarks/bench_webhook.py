@@ -0,0 +1,126 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http.client import HTTPConnection
+import json
+from queue import Queue
+import statistics
+import threading
+import time
+
+import fakeredis
+from telegram import Bot, User
+from telegram.ext import Dispatcher
+
+from question_bank import QuestionBank
+from sessions import TG_PLATFORM
+from storage import QuizStore
+from tg_bot import make_conversation_handler, queue_update
+from webhook import SECRET_TOKEN_HEADER, WebhookServer
+
+
+CHATS = 50
+ROUNDS = 10
+SECRET_TOKEN = "benchmark"
+
+
+class LatencyBot(Bot):
+    """Bot that records when replies are sent instead of sending them."""
+
+    def __init__(self) -> None:
+        super().__init__("123:token")
+        self._bot = User(123, "Бот", is_bot=True, username="quiz_bot")
+        self.replies: dict[int, Queue] = {
+            chat_id: Queue() for chat_id in range(1, CHATS + 1)
+        }
+
+    def send_message(self, chat_id, text, *args, **kwargs) -> None:
+        self.replies[chat_id].put(time.perf_counter())
+
+
+def make_update(update_id: int, chat_id: int, text: str) -> bytes:
+    message = {
+        "message_id": update_id,
+        "date": 0,
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": "Игрок"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [
+            {"type": "bot_command", "offset": 0, "length": len(text)}
+        ]
+    return json.dumps({"update_id": update_id, "message": message}).encode()
+
+
+def play(server: WebhookServer, bot: LatencyBot, chat_id: int) -> list[float]:
+    """
+    Plays ROUNDS rounds of the quiz in one chat and returns the latencies
+    from posting an update to the first reply, in milliseconds.
+    """
+    connection = HTTPConnection(*server.server_address)
+    latencies = []
+    texts = ["/start"] + ["Новый вопрос", "Сдаться"] * ROUNDS
+    replies_per_text = {"/start": 1, "Новый вопрос": 1, "Сдаться": 2}
+    for number, text in enumerate(texts):
+        update_id = chat_id * 1000 + number
+        started_at = time.perf_counter()
+        connection.request(
+            "POST",
+            "/tg",
+            body=make_update(update_id, chat_id, text),
+            headers={SECRET_TOKEN_HEADER: SECRET_TOKEN},
+        )
+        connection.getresponse().read()
+        replied_at = bot.replies[chat_id].get(timeout=10)
+        for _ in range(replies_per_text[text] - 1):
+            bot.replies[chat_id].get(timeout=10)
+        latencies.append((replied_at - started_at) * 1000)
+    connection.close()
+    return latencies
+
+
+def main() -> None:
+    """
+    Measures the end-to-end latency of the webhook mode: CHATS users play
+    the quiz at the same time, posting synthetic updates to a local webhook
+    server that feeds the bot's ConversationHandler.
+    """
+    questions = QuestionBank.from_dict(
+        {f"Вопрос {number}": f"Ответ {number}" for number in range(1000)}
+    )
+    bot = LatencyBot()
+    dispatcher = Dispatcher(bot, Queue(), workers=1)
+    store = QuizStore(fakeredis.FakeRedis(), questions, TG_PLATFORM)
+    dispatcher.add_handler(make_conversation_handler(questions, store))
+    threading.Thread(target=dispatcher.start, daemon=True).start()
+    server = WebhookServer(
+        ("127.0.0.1", 0),
+        "/tg",
+        SECRET_TOKEN,
+        partial(queue_update, dispatcher),
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(CHATS) as executor:
+        latencies = [
+            latency
+            for chat_latencies in executor.map(
+                partial(play, server, bot), range(1, CHATS + 1)
+            )
+            for latency in chat_latencies
+        ]
+    elapsed = time.perf_counter() - started_at
+    server.shutdown()
+    dispatcher.stop()
+
+    percentiles = statistics.quantiles(latencies, n=100)
+    print(f"updates: {len(latencies)}, {len(latencies) / elapsed:.0f}/s")
+    print(
+        f"latency ms: p50 {percentiles[49]:.1f}, p95 {percentiles[94]:.1f}, "
+        f"p99 {percentiles[98]:.1f}, max {max(latencies):.1f}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,552 @@
+import argparse
+import asyncio
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+import json
+import queue
+import random
+import statistics
+import sys
+import threading
+import time
+
+import aiohttp
+from aiohttp import web
+import fakeredis
+from telegram.ext import Updater
+from telegram.utils.request import Request
+from vk_api.longpoll import VkEventType
+
+from metrics import BotMetrics
+from outbound import (
+    ChatBuckets,
+    OutboundScheduler,
+    TokenBucket,
+    get_telegram_retry_after,
+)
+from persistence import RedisPersistence
+from question_bank import QuestionBank
+from quiz import GIVE_UP_TEXT, NEW_QUESTION_TEXT
+from sessions import TG_PLATFORM, VK_PLATFORM
+from storage import QuizStore
+from tg_bot import OUTBOUND_SENDERS, ScheduledBot, make_conversation_handler
+from tg_bot_async import AsyncQuizBot, TelegramApi
+from vk_bot import serve_events
+
+
+BOTS = ["tg", "tg-async", "vk"]
+USERS = 1000
+ROUNDS = 3
+QUESTIONS = 1000
+CORRECT_SHARE = 0.5
+TOKEN = "123:load-test"
+REPLY_TIMEOUT = 30.0
+# The platforms' rate limits are lifted, otherwise the harness would
+# measure the limits instead of the bots.
+UNLIMITED_RATE = 1e9
+VK_WORKERS = 8
+TG_POLLING_TIMEOUT = 1
+
+
+@dataclass
+class LoadReport:
+    bot: str
+    users: int
+    elapsed: float
+    latencies: list[float] = field(default_factory=list)
+    timeouts: int = 0
+
+    @property
+    def messages(self) -> int:
+        return len(self.latencies)
+
+    @property
+    def messages_per_second(self) -> float:
+        return self.messages / self.elapsed if self.elapsed else 0.0
+
+    def percentile(self, percent: int) -> float:
+        """Returns a percentile of the latencies in seconds."""
+        if len(self.latencies) < 2:
+            return self.latencies[0] if self.latencies else 0.0
+        return statistics.quantiles(self.latencies, n=100)[percent - 1]
+
+    def format(self) -> str:
+        return (
+            f"{self.bot}: {self.users} users, {self.messages} messages in "
+            f"{self.elapsed:.1f} s, {self.messages_per_second:.0f} "
+            f"messages/s, latency ms: p50 {self.percentile(50) * 1000:.1f}, "
+            f"p99 {self.percentile(99) * 1000:.1f}, timeouts {self.timeouts}"
+        )
+
+
+class Inboxes:
+    """
+    The messages the bot sent to every simulated user, with the time they
+    reached the fake platform. Bots running in other threads deliver them
+    through the event loop of the users.
+    """
+
+    def __init__(self, users: int) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.queues = {user_id: asyncio.Queue() for user_id in range(users)}
+
+    def deliver(self, user_id: int, text: str) -> None:
+        self.loop.call_soon_threadsafe(
+            self.queues[user_id].put_nowait, (time.perf_counter(), text)
+        )
+
+
+class FakeTelegramServer:
+    """
+    Local stand-in for the Telegram Bot API.
+
+    Users' messages are handed to the bot by getUpdates, which waits for
+    them like long polling does. Every sendMessage is delivered to the
+    user's inbox; other methods succeed without doing anything.
+    """
+
+    def __init__(self, inboxes: Inboxes, api_latency: float) -> None:
+        self.inboxes = inboxes
+        self.api_latency = api_latency
+        self.updates: list[dict] = []
+        self.update_id = 0
+        self.arrived = asyncio.Event()
+        self.runner: web.AppRunner | None = None
+        self.url = ""
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = site._server.sockets[0].getsockname()[:2]
+        self.url = f"http://{host}:{port}"
+
+    async def close(self) -> None:
+        await self.runner.cleanup()
+
+    async def send(self, user_id: int, text: str) -> None:
+        self.update_id += 1
+        message = {
+            "message_id": self.update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Игрок"},
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [
+                {"type": "bot_command", "offset": 0, "length": len(text)}
+            ]
+        self.updates.append({"update_id": self.update_id, "message": message})
+        self.arrived.set()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        method = request.match_info["method"]
+        if method == "getUpdates":
+            result = await self.get_updates(params)
+        elif method == "sendMessage":
+            result = await self.send_message(params)
+        elif method == "getMe":
+            result = {
+                "id": int(TOKEN.split(":")[0]),
+                "is_bot": True,
+                "first_name": "Бот",
+                "username": "quiz_bot",
+            }
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def get_updates(self, params: dict) -> list[dict]:
+        offset = int(params.get("offset", 0))
+        self.updates = [
+            update for update in self.updates if update["update_id"] >= offset
+        ]
+        if not self.updates:
+            self.arrived.clear()
+            try:
+                await asyncio.wait_for(
+                    self.arrived.wait(), float(params.get("timeout", 0))
+                )
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[: int(params.get("limit", 100))]
+
+    async def send_message(self, params: dict) -> dict:
+        chat_id = int(params["chat_id"])
+        self.inboxes.deliver(chat_id, params["text"])
+        await asyncio.sleep(self.api_latency)
+        return {
+            "message_id": 1,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": params["text"],
+        }
+
+
+@dataclass
+class FakeVkEvent:
+    user_id: int
+    text: str
+    type: VkEventType = VkEventType.MESSAGE_NEW
+    to_me: bool = True
+
+
+class FakeVkLongPoll:
+    """Local stand-in for VK long poll, listen ends after close."""
+
+    def __init__(self) -> None:
+        self.events: queue.Queue = queue.Queue()
+
+    async def send(self, user_id: int, text: str) -> None:
+        self.events.put(FakeVkEvent(user_id, text))
+
+    def close(self) -> None:
+        self.events.put(None)
+
+    def listen(self):
+        while (event := self.events.get()) is not None:
+            yield event
+
+
+class FakeVkMessages:
+    def __init__(self, api: "FakeVkApi") -> None:
+        self.api = api
+
+    def send(self, **params) -> int:
+        self.api.deliver([params])
+        return 1
+
+
+class FakeVkApi:
+    """
+    Local stand-in for the VK API methods the bot calls: messages.send and
+    execute with the batches of replies.
+    """
+
+    def __init__(self, inboxes: Inboxes, api_latency: float) -> None:
+        self.inboxes = inboxes
+        self.api_latency = api_latency
+        self.messages = FakeVkMessages(self)
+
+    def execute(self, code: str) -> list[int]:
+        # The replies are compiled into the code as a JSON array.
+        start = code.index("[", code.index("replies"))
+        replies, _ = json.JSONDecoder().raw_decode(code, start)
+        self.deliver(replies)
+        return [1] * len(replies)
+
+    def deliver(self, replies: list[dict]) -> None:
+        for params in replies:
+            self.inboxes.deliver(params["user_id"], params["message"])
+        time.sleep(self.api_latency)
+
+
+@dataclass
+class Script:
+    """What a simulated user says and how many replies each message gets."""
+
+    start: list[str]
+    attempt_replies: int
+    start_replies: int = 1
+
+
+SCRIPTS = {
+    "tg": Script(["/start"], attempt_replies=2),
+    "tg-async": Script(["/start"], attempt_replies=2),
+    "vk": Script([], attempt_replies=1),
+}
+
+
+async def play(
+    user_id: int,
+    send: Callable[[int, str], Awaitable[None]],
+    inbox: asyncio.Queue,
+    questions: QuestionBank,
+    script: Script,
+    rounds: int,
+    report: LoadReport,
+) -> None:
+    """
+    Plays the quiz as one user: start, then rounds of a new question and an
+    answer, correct or given up. Every message waits for the replies of the
+    previous one, the latency is measured until the first reply.
+    """
+    rng = random.Random(user_id)
+
+    async def say(text: str, replies: int) -> list[str]:
+        sent_at = time.perf_counter()
+        await send(user_id, text)
+        texts = []
+        for _ in range(replies):
+            replied_at, reply = await asyncio.wait_for(
+                inbox.get(), REPLY_TIMEOUT
+            )
+            if not texts:
+                report.latencies.append(replied_at - sent_at)
+            texts.append(reply)
+        return texts
+
+    try:
+        for text in script.start:
+            await say(text, script.start_replies)
+        for _ in range(rounds):
+            question = (await say(NEW_QUESTION_TEXT, 1))[0]
+            answer = GIVE_UP_TEXT
+            if rng.random() < CORRECT_SHARE:
+                answer = questions.answer(questions.find_id(question))
+            await say(answer, script.attempt_replies)
+    except asyncio.TimeoutError:
+        report.timeouts += 1
+
+
+async def run_users(
+    bot: str,
+    users: int,
+    rounds: int,
+    questions: QuestionBank,
+    inboxes: Inboxes,
+    send: Callable[[int, str], Awaitable[None]],
+) -> LoadReport:
+    report = LoadReport(bot, users, 0.0)
+    started_at = time.perf_counter()
+    await asyncio.gather(
+        *(
+            play(
+                user_id,
+                send,
+                inboxes.queues[user_id],
+                questions,
+                SCRIPTS[bot],
+                rounds,
+                report,
+            )
+            for user_id in range(users)
+        )
+    )
+    report.elapsed = time.perf_counter() - started_at
+    return report
+
+
+async def load_tg(
+    users: int, rounds: int, questions: QuestionBank, api_latency: float
+) -> LoadReport:
+    """Runs tg_bot with long polling against a fake Bot API."""
+    inboxes = Inboxes(users)
+    server = FakeTelegramServer(inboxes, api_latency)
+    await server.start()
+    redis_db = fakeredis.FakeRedis()
+    bot_metrics = BotMetrics()
+    scheduler = OutboundScheduler(
+        UNLIMITED_RATE,
+        UNLIMITED_RATE,
+        UNLIMITED_RATE,
+        get_telegram_retry_after,
+        senders=OUTBOUND_SENDERS,
+        bot_metrics=bot_metrics,
+    )
+    bot = ScheduledBot(
+        TOKEN,
+        scheduler,
+        base_url=f"{server.url}/bot",
+        # The fake API shares the process with the bot and may answer late
+        # under load, which must not drop the message.
+        request=Request(
+            con_pool_size=OUTBOUND_SENDERS + 8, read_timeout=REPLY_TIMEOUT
+        ),
+    )
+    updater = Updater(bot=bot, persistence=RedisPersistence(redis_db))
+    store = QuizStore(
+        redis_db, questions, TG_PLATFORM, bot_metrics=bot_metrics
+    )
+    updater.dispatcher.add_handler(
+        make_conversation_handler(
+            questions, store, persistent=True, bot_metrics=bot_metrics
+        )
+    )
+    # The updater calls the fake API while starting, the loop must serve it.
+    await asyncio.to_thread(
+        updater.start_polling, poll_interval=0, timeout=TG_POLLING_TIMEOUT
+    )
+    try:
+        return await run_users(
+            "tg", users, rounds, questions, inboxes, server.send
+        )
+    finally:
+        await asyncio.to_thread(updater.stop)
+        await asyncio.to_thread(scheduler.close)
+        await server.close()
+
+
+def run_async_bot(
+    url: str, questions: QuestionBank, stop: threading.Event
+) -> None:
+    """Runs tg_bot_async in its own event loop until stop is set."""
+
+    async def run() -> None:
+        async with aiohttp.ClientSession() as session:
+            api = TelegramApi(TOKEN, session, base_url=url)
+            api.bucket = TokenBucket(UNLIMITED_RATE, UNLIMITED_RATE)
+            api.chat_buckets = ChatBuckets(UNLIMITED_RATE, UNLIMITED_RATE)
+            bot = AsyncQuizBot(api, questions, fakeredis.FakeAsyncRedis())
+            polling = asyncio.create_task(bot.run_polling())
+            await asyncio.to_thread(stop.wait)
+            polling.cancel()
+            await bot.drain()
+
+    asyncio.run(run())
+
+
+async def load_tg_async(
+    users: int, rounds: int, questions: QuestionBank, api_latency: float
+) -> LoadReport:
+    """Runs tg_bot_async against a fake Bot API."""
+    inboxes = Inboxes(users)
+    server = FakeTelegramServer(inboxes, api_latency)
+    await server.start()
+    stop = threading.Event()
+    thread = threading.Thread(
+        target=run_async_bot, args=(server.url, questions, stop)
+    )
+    thread.start()
+    try:
+        return await run_users(
+            "tg-async", users, rounds, questions, inboxes, server.send
+        )
+    finally:
+        stop.set()
+        # Wakes the polling request, which is cancelled with the bot.
+        server.arrived.set()
+        await asyncio.to_thread(thread.join)
+        await server.close()
+
+
+async def load_vk(
+    users: int, rounds: int, questions: QuestionBank, api_latency: float
+) -> LoadReport:
+    """Runs the event loop of vk_bot against a fake long poll and API."""
+    inboxes = Inboxes(users)
+    longpoll = FakeVkLongPoll()
+    store = QuizStore(fakeredis.FakeRedis(), questions, VK_PLATFORM)
+    thread = threading.Thread(
+        target=serve_events,
+        args=(
+            longpoll.listen(),
+            FakeVkApi(inboxes, api_latency),
+            questions,
+            store,
+            VK_WORKERS,
+            BotMetrics(),
+            UNLIMITED_RATE,
+        ),
+    )
+    thread.start()
+    try:
+        return await run_users(
+            "vk", users, rounds, questions, inboxes, longpoll.send
+        )
+    finally:
+        longpoll.close()
+        await asyncio.to_thread(thread.join)
+
+
+LOADS = {"tg": load_tg, "tg-async": load_tg_async, "vk": load_vk}
+
+
+def run_load(
+    bot: str,
+    users: int = USERS,
+    rounds: int = ROUNDS,
+    api_latency: float = 0.0,
+    questions: QuestionBank | None = None,
+) -> LoadReport:
+    """
+    Simulates users playing the quiz with one of the bots.
+
+    Args:
+        bot (str): "tg", "tg-async" or "vk".
+        users (int): How many users play at the same time.
+        rounds (int): How many questions every user answers.
+        api_latency (float): How long every call to the fake platform API
+            takes, in seconds.
+        questions (QuestionBank | None): The questions, QUESTIONS synthetic
+            questions if not given.
+
+    Returns:
+        LoadReport: The latencies and the throughput of the bot.
+    """
+    if questions is None:
+        questions = QuestionBank.from_dict(
+            {
+                f"Вопрос {number}": f"Ответ {number}"
+                for number in range(QUESTIONS)
+            }
+        )
+    return asyncio.run(LOADS[bot](users, rounds, questions, api_latency))
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Нагрузочный тест ботов на локальных заглушках "
+        "Telegram, VK и Redis"
+    )
+    parser.add_argument(
+        "--bots", nargs="+", choices=BOTS, default=BOTS, help="Какие боты"
+    )
+    parser.add_argument(
+        "--users", type=int, default=USERS, help="Число пользователей"
+    )
+    parser.add_argument(
+        "--rounds", type=int, default=ROUNDS, help="Вопросов на пользователя"
+    )
+    parser.add_argument(
+        "--api-latency",
+        type=float,
+        default=0.0,
+        help="Задержка ответа API платформы, секунд",
+    )
+    parser.add_argument(
+        "--max-p99",
+        type=float,
+        help="Допустимый p99 задержки, мс; при превышении код выхода 1",
+    )
+    parser.add_argument(
+        "--min-rate",
+        type=float,
+        help="Минимальная пропускная способность, сообщений в секунду",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    """
+    Runs the load test of the chosen bots and prints p50 and p99 latencies
+    and the throughput. Exits with code 1 if a bot misses a threshold or
+    leaves a user without a reply, so the test can gate a deploy.
+    """
+    args = parse_args()
+    failed = False
+    for bot in args.bots:
+        report = run_load(bot, args.users, args.rounds, args.api_latency)
+        print(report.format())
+        if (
+            report.timeouts
+            or args.max_p99 is not None
+            and report.percentile(99) * 1000 > args.max_p99
+            or args.min_rate is not None
+            and report.messages_per_second < args.min_rate
+        ):
+            print(f"{bot}: FAILED")
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
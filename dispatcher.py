@@ -0,0 +1,92 @@
+from collections.abc import Callable, Hashable
+import logging
+import queue
+import threading
+
+
+_STOP = object()
+
+
+class OrderedWorkerPool:
+    """
+    Runs tasks on a fixed pool of worker threads, keeping the order of the
+    tasks with the same key.
+
+    Every key is bound to one worker by its hash, so the tasks of one user
+    run one after another in the order they were submitted, while the tasks
+    of different users run in parallel. Blocking calls to the messaging API
+    and Redis release the GIL, so the throughput grows with the number of
+    workers.
+    """
+
+    def __init__(self, workers: int, max_queued: int = 0) -> None:
+        """
+        Initializes an OrderedWorkerPool instance and starts its workers.
+
+        Args:
+            workers (int): The number of worker threads.
+            max_queued (int): How many tasks may wait in the queue of one
+                worker before submit blocks, 0 for no limit.
+
+        Returns:
+            None
+
+        Raises:
+            ValueError: If the number of workers is not positive.
+        """
+        if workers < 1:
+            raise ValueError("workers must be positive")
+        self._queues = [queue.Queue(max_queued) for _ in range(workers)]
+        self._threads = [
+            threading.Thread(
+                target=self._work, args=(task_queue,), daemon=True
+            )
+            for task_queue in self._queues
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, key: Hashable, task: Callable, *args, **kwargs) -> None:
+        """
+        Schedules task(*args, **kwargs) on the worker bound to the key.
+
+        Args:
+            key (Hashable): The ordering key, e.g. the id of the user.
+            task (Callable): The function to call.
+            *args: Positional arguments of the function.
+            **kwargs: Keyword arguments of the function.
+
+        Returns:
+            None
+        """
+        task_queue = self._queues[hash(key) % len(self._queues)]
+        task_queue.put((task, args, kwargs))
+
+    def queued(self) -> int:
+        """Returns how many tasks are waiting for the workers."""
+        return sum(task_queue.qsize() for task_queue in self._queues)
+
+    def close(self) -> None:
+        """Waits until all submitted tasks are done and stops the workers."""
+        for task_queue in self._queues:
+            task_queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+
+    def __enter__(self) -> "OrderedWorkerPool":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    @staticmethod
+    def _work(task_queue: queue.Queue) -> None:
+        while True:
+            item = task_queue.get()
+            if item is _STOP:
+                return
+            task, args, kwargs = item
+            try:
+                task(*args, **kwargs)
+            except Exception:
+                logging.exception(f"Ошибка в задаче {task!r}")
@@ -0,0 +1,127 @@
+from hashlib import blake2b
+from pathlib import Path
+import re
+from typing import Iterable, TextIO
+
+from facets import FacetIndexBuilder
+from pack_parser import QuestionRecord
+
+
+QUESTION_LABEL = re.compile(r"^\s*Вопрос\s*\d*", re.IGNORECASE)
+# Questions are normalized as windows-1251 bytes, where folding the case
+# and turning everything but letters and digits into spaces is one
+# bytes.translate, several times faster than a regular expression over the
+# text. Characters beyond windows-1251 are kept as their codes.
+KEY_ENCODING = "cp1251"
+# A collision of 16-byte digests is negligible even for billions of
+# questions, and the digests of the whole archive take a few megabytes.
+DIGEST_SIZE = 16
+
+
+def make_key_table() -> bytes:
+    """
+    Returns the translation table of bytes.translate that folds the case
+    of the letters of KEY_ENCODING and "ё" to "е", and turns all but
+    letters and digits into spaces.
+    """
+    table = bytearray(b" " * 256)
+    for byte in range(256):
+        try:
+            char = bytes([byte]).decode(KEY_ENCODING)
+        except UnicodeDecodeError:
+            continue
+        if char.isalnum():
+            folded = char.lower().replace("ё", "е").encode(KEY_ENCODING)
+            table[byte] = folded[0] if len(folded) == 1 else byte
+    return bytes(table)
+
+
+KEY_TABLE = make_key_table()
+
+
+def normalize_question(question: str) -> bytes:
+    """
+    Brings a question to the form its duplicates are found in.
+
+    The "Вопрос 12:" label is dropped, as the same question has different
+    numbers in different packs, and so are case, "ё", punctuation and
+    whitespace.
+
+    Args:
+        question (str): The question paragraph of a pack.
+
+    Returns:
+        bytes: The lowercase words of the question in KEY_ENCODING,
+            separated by single spaces.
+    """
+    question = QUESTION_LABEL.sub("", question, count=1)
+    words = (
+        question.encode(KEY_ENCODING, "xmlcharrefreplace")
+        .translate(KEY_TABLE)
+        .split()
+    )
+    return b" ".join(words)
+
+
+def question_digest(question: str) -> str:
+    """Returns the hex digest of the normalized question."""
+    return blake2b(
+        normalize_question(question), digest_size=DIGEST_SIZE
+    ).hexdigest()
+
+
+def merge_duplicates(
+    file_records: Iterable[tuple[Path, list[QuestionRecord]]],
+    report: TextIO | None = None,
+    facets: FacetIndexBuilder | None = None,
+) -> tuple[dict[str, tuple[str, str]], int]:
+    """
+    Collects the questions and answers of all files, merging duplicates.
+
+    Questions are told apart by the digests of their normalized texts,
+    which the records have to carry. A duplicate replaces the question it
+    repeats together with its answer, but takes its place in the corpus,
+    like a repeated question always did. Besides the corpus itself, only
+    the digest and the location of each question are held in memory, and
+    the merged duplicates are written to the report as they are found.
+
+    Args:
+        file_records: Each file with its question records, in file order.
+        report: A text file a line "<file>:<line> повторяет <file>:<line>"
+            is written to for each merged duplicate.
+        facets: Collects the tournaments and years of the questions under
+            their ids, the positions in the corpus. A merged question
+            belongs to those of all its occurrences.
+
+    Returns:
+        The questions with their answers and "Зачёт:" paragraphs, and the
+        number of merged duplicates.
+    """
+    kept: dict[str, tuple[str, tuple[str, str], Path, int, int]] = {}
+    merged = 0
+    for file, records in file_records:
+        for record in records:
+            previous = kept.get(record.digest)
+            if previous is None:
+                question_id = len(kept)
+            else:
+                question_id = previous[4]
+                merged += 1
+                if report is not None:
+                    report.write(
+                        f"{file}:{record.line} повторяет "
+                        f"{previous[2]}:{previous[3]}\n"
+                    )
+            kept[record.digest] = (
+                record.question,
+                (record.answer, record.accepted),
+                file,
+                record.line,
+                question_id,
+            )
+            if facets is not None:
+                facets.add(question_id, record)
+    questions_and_answers = {
+        question: answer for question, answer, *_ in kept.values()
+    }
+    return questions_and_answers, merged
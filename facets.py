@@ -0,0 +1,294 @@
+from array import array
+from collections import defaultdict
+import logging
+import mmap
+import os
+from pathlib import Path
+import random
+import re
+import struct
+import sys
+import threading
+
+from pack_parser import QuestionRecord
+
+
+# Layout of a facet index file, all integers are little-endian:
+#   header: magic, fingerprint of the question bank, selection count,
+#           length of the selection names
+#   selection names: UTF-8 "<facet>\t<value>", separated by newlines,
+#                    zero-padded to 8 bytes
+#   offsets: selection count + 1 unsigned 64-bit offsets into the ids,
+#            selection i spans ids offsets[i] .. offsets[i + 1]
+#   ids: unsigned 32-bit question ids, ascending within a selection
+FACETS_MAGIC = b"QFACET\x00\x02"
+FACETS_HEADER = struct.Struct("<8s8sII")
+FACETS_OFFSET = struct.Struct("<Q")
+FACETS_SPAN = struct.Struct("<QQ")
+FACETS_ID = struct.Struct("<I")
+TOURNAMENT_FACET = "tournament"
+YEAR_FACET = "year"
+YEAR = re.compile(r"\b(?:1[89]|20)\d\d\b")
+
+
+def get_selection_key(platform: str, user_id: int) -> str:
+    """
+    Returns the key of the selection the user gets questions from.
+
+    The value of the key is "<facet>\\t<value>", e.g. "year\\t2005". A user
+    without the key gets questions from the whole bank.
+
+    Args:
+        platform (str): TG_PLATFORM or VK_PLATFORM.
+        user_id (int): The id of the user on the messaging platform.
+
+    Returns:
+        str: The key, e.g. "selection:tg:42".
+    """
+    return f"selection:{platform}:{user_id}"
+
+
+def get_record_facets(record: QuestionRecord) -> list[tuple[str, str]]:
+    """
+    Returns the facets of a question record with their values: the
+    championship with its whitespace collapsed, and the year of the date.
+    """
+    facets = []
+    tournament = " ".join(record.championship.split())
+    if tournament:
+        facets.append((TOURNAMENT_FACET, tournament))
+    year = YEAR.search(record.date)
+    if year:
+        facets.append((YEAR_FACET, year.group()))
+    return facets
+
+
+class FacetIndexBuilder:
+    """
+    Collects the question ids of every tournament and year during the
+    corpus build.
+
+    The ids are kept in compact arrays, four bytes per id. A question merged
+    from several packs belongs to the tournaments and years of all of them.
+    """
+
+    def __init__(self) -> None:
+        self.ids: defaultdict[tuple[str, str], array] = defaultdict(
+            lambda: array("I")
+        )
+
+    def add(self, question_id: int, record: QuestionRecord) -> None:
+        """Adds the question with the given id to the facets of a record."""
+        for facet in get_record_facets(record):
+            ids = self.ids[facet]
+            if not ids or ids[-1] != question_id:
+                ids.append(question_id)
+
+    def count(self, facet: str) -> int:
+        """Returns the number of values of a facet."""
+        return sum(name == facet for name, _ in self.ids)
+
+
+def write_facet_index(
+    path: str | Path, builder: FacetIndexBuilder, fingerprint: str
+) -> None:
+    """
+    Writes the collected facets to a facet index file that FacetIndex can
+    map.
+
+    The file is written next to the target and then moved over it, like
+    the question bank.
+
+    Args:
+        path (str | Path): Path to the facet index file.
+        builder (FacetIndexBuilder): The collected facets.
+        fingerprint (str): The fingerprint of the question bank the ids
+            point to, as returned by write_question_bank.
+
+    Returns:
+        None
+    """
+    selections = sorted(builder.ids)
+    names = "\n".join(
+        f"{facet}\t{value}" for facet, value in selections
+    ).encode("utf-8")
+    names_end = FACETS_HEADER.size + len(names)
+    offsets_start = names_end + (-names_end % 8)
+    ids_start = offsets_start + (len(selections) + 1) * FACETS_OFFSET.size
+
+    temporary_path = f"{path}.tmp"
+    offsets = array("Q", [0])
+    with open(temporary_path, "wb") as file:
+        file.write(
+            FACETS_HEADER.pack(
+                FACETS_MAGIC,
+                bytes.fromhex(fingerprint),
+                len(selections),
+                len(names),
+            )
+        )
+        file.write(names)
+        file.seek(ids_start)
+        for selection in selections:
+            ids = array("I", sorted(set(builder.ids[selection])))
+            if sys.byteorder == "big":
+                ids.byteswap()
+            file.write(ids.tobytes())
+            offsets.append(offsets[-1] + len(ids))
+        if sys.byteorder == "big":
+            offsets.byteswap()
+        file.seek(offsets_start)
+        file.write(offsets.tobytes())
+    os.replace(temporary_path, path)
+
+
+class FacetIndex:
+    """
+    The question ids of every tournament and year, backed by a
+    memory-mapped facet index file.
+
+    The file is mapped together with the question bank, when the bot
+    starts, and only if it carries the fingerprint of that bank. A rebuild
+    replaces the files, so the bot keeps reading the versions it mapped. A
+    file that doesn't match the bank, or is missing, is checked again
+    once it changes, as a bot may start between the writes of the bank
+    and the index. Bot processes on one host share the mapped pages
+    through the page cache. A random question of a selection is one read
+    from the map, whatever the size of the selection.
+    """
+
+    def __init__(self, path: str | Path, fingerprint: str) -> None:
+        """
+        Initializes a FacetIndex instance by mapping the file.
+
+        Args:
+            path (str | Path): Path to a file written by write_facet_index.
+            fingerprint (str): The fingerprint of the question bank the bot
+                serves. A file built for another bank is ignored.
+
+        Returns:
+            None
+        """
+        self.path = Path(path)
+        self.fingerprint = fingerprint
+        self._lock = threading.Lock()
+        self._mmap: mmap.mmap | None = None
+        self._selections: dict[str, dict[str, int]] = {}
+        self._checked_file: tuple[int, int] | None = None
+        self._load()
+        if self._checked_file is None:
+            logging.warning(
+                f"{self.path}: подборок вопросов нет, пересоберите вопросы"
+            )
+
+    def _get_file_identity(self) -> tuple[int, int] | None:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _load(self) -> dict[str, dict[str, int]]:
+        if self._mmap is not None:
+            return self._selections
+        identity = self._get_file_identity()
+        if identity is None or identity == self._checked_file:
+            return self._selections
+        with self._lock:
+            if self._mmap is None and identity != self._checked_file:
+                self._checked_file = identity
+                self._selections = self._map()
+        return self._selections
+
+    def _map(self) -> dict[str, dict[str, int]]:
+        try:
+            with open(self.path, "rb") as file:
+                index = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return {}
+        if (
+            len(index) < FACETS_HEADER.size
+            or index[: len(FACETS_MAGIC)] != FACETS_MAGIC
+        ):
+            index.close()
+            logging.warning(
+                f"{self.path}: файл подборок старого формата, "
+                "пересоберите вопросы"
+            )
+            return {}
+        _, fingerprint, count, names_length = FACETS_HEADER.unpack_from(index)
+        if fingerprint.hex() != self.fingerprint:
+            index.close()
+            logging.warning(
+                f"{self.path}: подборки собраны для другой сборки вопросов"
+            )
+            return {}
+        names_end = FACETS_HEADER.size + names_length
+        names = index[FACETS_HEADER.size : names_end].decode("utf-8")
+        self._offsets_start = names_end + (-names_end % 8)
+        self._ids_start = (
+            self._offsets_start + (count + 1) * FACETS_OFFSET.size
+        )
+        self._mmap = index
+        selections: dict[str, dict[str, int]] = defaultdict(dict)
+        for position, name in enumerate(names.split("\n") if count else []):
+            facet, _, value = name.partition("\t")
+            selections[facet][value] = position
+        return dict(selections)
+
+    def _span(self, facet: str, value: str) -> tuple[int, int]:
+        position = self._load().get(facet, {}).get(value)
+        if position is None:
+            return 0, 0
+        return FACETS_SPAN.unpack_from(
+            self._mmap, self._offsets_start + position * FACETS_OFFSET.size
+        )
+
+    def values(self, facet: str) -> list[str]:
+        """Returns the values of a facet in ascending order."""
+        return list(self._load().get(facet, {}))
+
+    def find_values(self, facet: str, text: str) -> list[str]:
+        """
+        Finds the values of a facet containing the text, ignoring case.
+
+        Args:
+            facet (str): TOURNAMENT_FACET or YEAR_FACET.
+            text (str): A part of the value.
+
+        Returns:
+            list[str]: The value equal to the text if there is one,
+                otherwise all the values containing it.
+        """
+        text = " ".join(text.split()).casefold()
+        matches = []
+        for value in self.values(facet):
+            folded = value.casefold()
+            if folded == text:
+                return [value]
+            if text in folded:
+                matches.append(value)
+        return matches
+
+    def count(self, facet: str, value: str) -> int:
+        """Returns the number of questions with a value of a facet."""
+        start, end = self._span(facet, value)
+        return end - start
+
+    def random_id(self, facet: str, value: str) -> int | None:
+        """
+        Returns the id of a uniformly chosen random question with a value
+        of a facet, or None if there are no such questions.
+        """
+        start, end = self._span(facet, value)
+        if start == end:
+            return None
+        position = (
+            self._ids_start + random.randrange(start, end) * FACETS_ID.size
+        )
+        return FACETS_ID.unpack_from(self._mmap, position)[0]
+
+    def close(self) -> None:
+        """Unmaps the facet index file if it was mapped."""
+        if self._mmap is not None:
+            self._mmap.close()
@@ -0,0 +1,464 @@
+from bisect import bisect_left
+from collections.abc import Callable
+from functools import wraps
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import threading
+import time
+
+
+# Seconds, from a cached Redis read to a slow Bot API call.
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+)
+METRICS_PATH = "/metrics"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(
+        f'{name}="{escape_label(value)}"' for name, value in labels.items()
+    )
+    return "{" + pairs + "}"
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A counter with an optional label, e.g. the name of a handler."""
+
+    def __init__(self, name: str, help: str, label: str | None = None):
+        """
+        Initializes a Counter instance.
+
+        Args:
+            name (str): The name of the metric.
+            help (str): The description of the metric.
+            label (str | None): The name of the label, None if the counter
+                is not labelled.
+
+        Returns:
+            None
+        """
+        self.name = name
+        self.help = help
+        self.label = label
+        self._values: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_value: str = "", amount: float = 1) -> None:
+        with self._lock:
+            self._values[label_value] = (
+                self._values.get(label_value, 0) + amount
+            )
+
+    def get(self, label_value: str = "") -> float:
+        with self._lock:
+            return self._values.get(label_value, 0)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = dict(self._values)
+        lines = [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} counter",
+        ]
+        for label_value, value in sorted(values.items()):
+            labels = {self.label: label_value} if self.label else {}
+            lines.append(
+                f"{self.name}{format_labels(labels)} {format_value(value)}"
+            )
+        return lines
+
+
+class Histogram:
+    """
+    A histogram of durations with an optional label.
+
+    An observation costs a bisect and two additions under a lock, the
+    buckets are accumulated only when the metrics are rendered.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        label: str | None = None,
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> None:
+        """
+        Initializes a Histogram instance.
+
+        Args:
+            name (str): The name of the metric.
+            help (str): The description of the metric.
+            label (str | None): The name of the label, None if the
+                histogram is not labelled.
+            buckets (tuple[float, ...]): The sorted upper bounds of the
+                buckets, without +Inf.
+
+        Returns:
+            None
+        """
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        # label value -> [count per bucket and +Inf, sum]
+        self._series: dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value: str, value: float) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = [[0] * (len(self.buckets) + 1), 0.0]
+                self._series[label_value] = series
+            series[0][index] += 1
+            series[1] += value
+
+    def count(self, label_value: str = "") -> int:
+        with self._lock:
+            series = self._series.get(label_value)
+            return sum(series[0]) if series else 0
+
+    def render(self) -> list[str]:
+        with self._lock:
+            series = {
+                label_value: (list(counts), total)
+                for label_value, (counts, total) in self._series.items()
+            }
+        lines = [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} histogram",
+        ]
+        bounds = [*self.buckets, float("inf")]
+        for label_value, (counts, total) in sorted(series.items()):
+            labels = {self.label: label_value} if self.label else {}
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                bucket_labels = format_labels(
+                    {**labels, "le": format_value(bound)}
+                )
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(
+                f"{self.name}_sum{format_labels(labels)} {format_value(total)}"
+            )
+            lines.append(
+                f"{self.name}_count{format_labels(labels)} {cumulative}"
+            )
+        return lines
+
+
+class Gauge:
+    """
+    A metric read from its source when the metrics are rendered, so it costs
+    nothing between scrapes.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        collect: Callable[[], dict[str, float]] | Callable[[], float],
+        label: str | None = None,
+        kind: str = "gauge",
+    ) -> None:
+        """
+        Initializes a Gauge instance.
+
+        Args:
+            name (str): The name of the metric.
+            help (str): The description of the metric.
+            collect (Callable): Returns the value, or the values by label
+                if the gauge is labelled.
+            label (str | None): The name of the label.
+            kind (str): The Prometheus type, "gauge" or "counter" for
+                totals kept by the source.
+
+        Returns:
+            None
+        """
+        self.name = name
+        self.help = help
+        self.collect = collect
+        self.label = label
+        self.kind = kind
+
+    def render(self) -> list[str]:
+        values = self.collect()
+        if self.label is None:
+            values = {"": values}
+        lines = [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for label_value, value in sorted(values.items()):
+            labels = {self.label: label_value} if self.label else {}
+            lines.append(
+                f"{self.name}{format_labels(labels)} {format_value(value)}"
+            )
+        return lines
+
+
+class MetricsRegistry:
+    """
+    The metrics of a process, rendered in the Prometheus text format.
+
+    Registering a metric under a taken name replaces it, so a bot can point
+    a gauge at the queue of a reconnected client.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: dict[str, Counter | Histogram | Gauge] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Counter | Histogram | Gauge):
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """
+        Returns all the metrics in the Prometheus text format.
+
+        A gauge whose source fails is skipped, the other metrics are still
+        served.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception:
+                logging.exception(f"Не удалось собрать метрику {metric.name}")
+        return "\n".join(lines) + "\n"
+
+
+class BotMetrics:
+    """
+    The metrics of a bot process.
+
+    The handlers, the Redis round trips and the outbound API calls are
+    timed on the hot path. Queue depths, the corpus size and the totals the
+    components already count are read only when the metrics are scraped.
+    Updates per second are rate(quiz_updates_total) in Prometheus.
+    """
+
+    def __init__(self, registry: MetricsRegistry | None = None) -> None:
+        """
+        Initializes a BotMetrics instance and registers its metrics.
+
+        Args:
+            registry (MetricsRegistry | None): The registry to register the
+                metrics in, a new one if not given.
+
+        Returns:
+            None
+        """
+        self.registry = registry or MetricsRegistry()
+        self.updates = self.registry.register(
+            Counter("quiz_updates_total", "Updates received by the bot.")
+        )
+        self.handler_seconds = self.registry.register(
+            Histogram(
+                "quiz_handler_seconds",
+                "Time spent handling an update.",
+                "handler",
+            )
+        )
+        self.redis_seconds = self.registry.register(
+            Histogram(
+                "quiz_redis_round_trip_seconds",
+                "Time of a round trip to Redis.",
+                "handler",
+            )
+        )
+        self.outbound_seconds = self.registry.register(
+            Histogram(
+                "quiz_outbound_request_seconds",
+                "Time of a request to the messaging platform API.",
+            )
+        )
+        self.outbound_errors = self.registry.register(
+            Counter(
+                "quiz_outbound_errors_total",
+                "Failed requests to the messaging platform API, retried "
+                "after flood control or dropped.",
+                "outcome",
+            )
+        )
+        self._queues: dict[str, Callable[[], int]] = {}
+        self.registry.register(
+            Gauge(
+                "quiz_queue_depth",
+                "Items waiting in the queues of the bot.",
+                lambda: {
+                    name: depth() for name, depth in self._queues.items()
+                },
+                "queue",
+            )
+        )
+
+    def instrument(self, name: str, handler: Callable) -> Callable:
+        """
+        Wraps a handler to observe its duration under the given name.
+
+        Args:
+            name (str): The name of the handler in the metrics.
+            handler (Callable): The handler.
+
+        Returns:
+            Callable: The handler observing its duration.
+        """
+        histogram = self.handler_seconds
+
+        @wraps(handler)
+        def timed(*args, **kwargs):
+            started_at = time.perf_counter()
+            try:
+                return handler(*args, **kwargs)
+            finally:
+                histogram.observe(name, time.perf_counter() - started_at)
+
+        return timed
+
+    def observe_request(
+        self, seconds: float, error: Exception | None, retried: bool
+    ) -> None:
+        """
+        Observes a request to the messaging platform API.
+
+        Args:
+            seconds (float): The duration of the request.
+            error (Exception | None): The error of the request, if any.
+            retried (bool): Whether the request is retried after the error.
+
+        Returns:
+            None
+        """
+        self.outbound_seconds.observe("", seconds)
+        if error is not None:
+            self.outbound_errors.inc("retried" if retried else "failed")
+
+    def watch_queue(self, name: str, depth: Callable[[], int]) -> None:
+        """Reports the depth of a queue, replacing a queue of that name."""
+        self._queues[name] = depth
+
+    def watch_corpus(self, size: Callable[[], int]) -> None:
+        self.registry.register(
+            Gauge("quiz_questions", "Questions in the question bank.", size)
+        )
+
+    def watch_cache(self, metrics: Callable) -> None:
+        """Reports the metrics of a SessionCache, given its metrics method."""
+        for field, help in [
+            ("hits", "Sessions served from the cache."),
+            ("misses", "Sessions read from Redis."),
+            ("evictions", "Sessions evicted from the full cache."),
+            ("expirations", "Sessions expired in the cache."),
+            ("invalidations", "Sessions changed by other replicas."),
+        ]:
+            self.registry.register(
+                Gauge(
+                    f"quiz_session_cache_{field}_total",
+                    help,
+                    lambda field=field: getattr(metrics(), field),
+                    kind="counter",
+                )
+            )
+        self.registry.register(
+            Gauge(
+                "quiz_session_cache_size",
+                "Sessions in the cache.",
+                lambda: metrics().size,
+            )
+        )
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    server: "MetricsServer"
+
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] != METRICS_PATH:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        body = self.server.registry.render().encode("utf-8")
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        logging.debug(f"{self.address_string()} {format % args}")
+
+
+class MetricsServer(ThreadingHTTPServer):
+    """HTTP server serving the metrics of the process on /metrics."""
+
+    daemon_threads = True
+
+    def __init__(
+        self, address: tuple[str, int], registry: MetricsRegistry
+    ) -> None:
+        """
+        Initializes a MetricsServer instance and binds it to the address.
+
+        Args:
+            address (tuple[str, int]): The host and port to listen on.
+            registry (MetricsRegistry): The metrics to serve.
+
+        Returns:
+            None
+        """
+        super().__init__(address, MetricsRequestHandler)
+        self.registry = registry
+
+
+def start_metrics_server(
+    registry: MetricsRegistry, listen: str, port: int
+) -> MetricsServer | None:
+    """
+    Serves the metrics from a background thread.
+
+    Args:
+        registry (MetricsRegistry): The metrics to serve.
+        listen (str): The address to listen on.
+        port (int): The port to listen on, 0 disables the server.
+
+    Returns:
+        MetricsServer | None: The server, or None if it is disabled.
+    """
+    if not port:
+        return None
+    server = MetricsServer((listen, port), registry)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info(f"Метрики доступны на http://{listen}:{port}{METRICS_PATH}")
+    return server
@@ -0,0 +1,387 @@
+from collections import deque
+from collections.abc import Callable, Hashable
+from dataclasses import dataclass, replace
+from enum import IntEnum
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+import telegram
+from vk_api.exceptions import ApiError
+
+from metrics import BotMetrics
+
+
+# Telegram allows about 30 messages per second in total and about one
+# message per second in a chat, with short bursts.
+TELEGRAM_RATE = 30
+TELEGRAM_CHAT_RATE = 1
+TELEGRAM_CHAT_BURST = 3
+# VK allows 20 requests per second with a community token.
+VK_RATE = 20
+# VK reports flood errors without a retry delay.
+VK_FLOOD_ERROR_CODES = (6, 9)
+VK_RETRY_AFTER = 1.0
+MAX_QUEUED_MESSAGES = 10_000
+CHAT_BUCKETS_SWEEP = 1024
+
+
+class Priority(IntEnum):
+    ANSWER = 0
+    KEYBOARD = 1
+    LOG = 2
+
+
+class TokenBucket:
+    """
+    Allows events at a sustained rate with bursts of up to capacity events.
+
+    The bucket is not thread-safe; its owner serializes the calls.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: float,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """
+        Initializes a full TokenBucket.
+
+        Args:
+            rate (float): The number of tokens added per second.
+            capacity (float): The maximum number of tokens.
+            clock (Callable[[], float]): Returns the current time in seconds.
+
+        Returns:
+            None
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated_at = clock()
+
+    def _refill(self) -> float:
+        now = self.clock()
+        elapsed = now - self.updated_at
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated_at = now
+        return now
+
+    def delay(self) -> float:
+        """Returns how many seconds are left until a token is available."""
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def is_full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+    def reserve(self) -> float:
+        """
+        Takes a token, possibly in advance.
+
+        Returns:
+            float: How many seconds to wait before using the token.
+        """
+        delay = self.delay()
+        self.tokens -= 1
+        return delay
+
+
+class ChatBuckets:
+    """
+    Token buckets of chats, created on demand.
+
+    A full bucket behaves exactly like a new one, so once there are many
+    buckets the full ones are dropped, which keeps memory proportional to
+    the number of recently active chats.
+    """
+
+    def __init__(
+        self, rate: float, burst: float, sweep_size: int = CHAT_BUCKETS_SWEEP
+    ) -> None:
+        """
+        Initializes a ChatBuckets instance.
+
+        Args:
+            rate (float): Messages per second allowed in one chat.
+            burst (float): How many messages a chat may send at once.
+            sweep_size (int): How many buckets are kept before full ones
+                are dropped.
+
+        Returns:
+            None
+        """
+        self.rate = rate
+        self.burst = burst
+        self.sweep_size = sweep_size
+        self._buckets: dict[Hashable, TokenBucket] = {}
+        self._sweep_at = sweep_size
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def get(self, chat_id: Hashable) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) >= self._sweep_at:
+                self._buckets = {
+                    chat_id: bucket
+                    for chat_id, bucket in self._buckets.items()
+                    if not bucket.is_full()
+                }
+                self._sweep_at = max(self.sweep_size, 2 * len(self._buckets))
+            bucket = TokenBucket(self.rate, self.burst)
+            self._buckets[chat_id] = bucket
+        return bucket
+
+
+@dataclass
+class OutboundMetrics:
+    submitted: int = 0
+    sent: int = 0
+    retried: int = 0
+    failed: int = 0
+    queued: int = 0
+    max_queued: int = 0
+    total_delay: float = 0.0
+    max_delay: float = 0.0
+
+    @property
+    def average_delay(self) -> float:
+        """The average time a sent message has waited in the queue."""
+        return self.total_delay / self.sent if self.sent else 0.0
+
+
+@dataclass
+class _Message:
+    chat_id: Hashable
+    send: Callable[[], object]
+    priority: Priority
+    order: int
+    submitted_at: float
+
+
+class OutboundScheduler:
+    """
+    Sends outbound messages of one platform at the rate the platform allows.
+
+    A global token bucket limits the rate of the whole bot, a token bucket
+    per chat limits the rate of every chat. Messages of a chat are sent in
+    the order they were submitted. When several chats may send, the message
+    with the highest priority goes first, so answers are not delayed by
+    keyboards and logs.
+
+    If the platform asks to slow down, e.g. with a 429 response, sending is
+    paused for the requested time and the message is retried. submit blocks
+    while max_queued messages are waiting, which pushes back on the handlers
+    instead of growing the queue without bound.
+
+    With BotMetrics the duration and the errors of every API call are
+    observed.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        chat_rate: float,
+        chat_burst: float = 1,
+        get_retry_after: Callable[[Exception], float | None] = (
+            lambda error: None
+        ),
+        senders: int = 1,
+        max_queued: int = MAX_QUEUED_MESSAGES,
+        bot_metrics: BotMetrics | None = None,
+    ) -> None:
+        """
+        Initializes an OutboundScheduler instance and starts its senders.
+
+        Args:
+            rate (float): Messages per second allowed in total.
+            chat_rate (float): Messages per second allowed in one chat.
+            chat_burst (float): How many messages a chat may send at once.
+            get_retry_after (Callable[[Exception], float | None]): Returns
+                how many seconds to wait before retrying after an error, or
+                None if the message must not be retried.
+            senders (int): The number of threads calling the platform API.
+            max_queued (int): How many messages may wait to be sent.
+            bot_metrics (BotMetrics | None): The metrics of the bot.
+
+        Returns:
+            None
+        """
+        self.get_retry_after = get_retry_after
+        self.max_queued = max_queued
+        self.bot_metrics = bot_metrics
+        self._bucket = TokenBucket(rate, rate)
+        self._chat_buckets = ChatBuckets(chat_rate, chat_burst)
+        self._chats: dict[Hashable, deque[_Message]] = {}
+        self._ready: list[tuple[int, int, Hashable]] = []
+        self._waiting: list[tuple[float, int, Hashable]] = []
+        self._paused_until = 0.0
+        self._order = itertools.count()
+        self._metrics = OutboundMetrics()
+        self._closing = False
+        self._condition = threading.Condition()
+        self._senders = [
+            threading.Thread(target=self._send_forever, daemon=True)
+            for _ in range(senders)
+        ]
+        for sender in self._senders:
+            sender.start()
+
+    def submit(
+        self,
+        chat_id: Hashable,
+        send: Callable[[], object],
+        priority: Priority = Priority.ANSWER,
+    ) -> None:
+        """
+        Queues a message to be sent.
+
+        Args:
+            chat_id (Hashable): The chat the message is sent to.
+            send (Callable[[], object]): Sends the message.
+            priority (Priority): The priority of the message.
+
+        Returns:
+            None
+        """
+        with self._condition:
+            while self._metrics.queued >= self.max_queued:
+                self._condition.wait()
+            message = _Message(
+                chat_id, send, priority, next(self._order), time.monotonic()
+            )
+            chat = self._chats.setdefault(chat_id, deque())
+            chat.append(message)
+            if len(chat) == 1:
+                self._schedule_chat(chat_id)
+            self._metrics.submitted += 1
+            self._metrics.queued += 1
+            self._metrics.max_queued = max(
+                self._metrics.max_queued, self._metrics.queued
+            )
+            self._condition.notify_all()
+
+    def metrics(self) -> OutboundMetrics:
+        """Returns a snapshot of the metrics."""
+        with self._condition:
+            return replace(self._metrics)
+
+    def close(self) -> None:
+        """Sends the queued messages and stops the senders."""
+        with self._condition:
+            self._closing = True
+            self._condition.notify_all()
+        for sender in self._senders:
+            sender.join()
+
+    def __enter__(self) -> "OutboundScheduler":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _schedule_chat(self, chat_id: Hashable) -> None:
+        head = self._chats[chat_id][0]
+        delay = self._chat_buckets.get(chat_id).delay()
+        if delay > 0:
+            ready_at = time.monotonic() + delay
+            heapq.heappush(self._waiting, (ready_at, head.order, chat_id))
+        else:
+            heapq.heappush(self._ready, (head.priority, head.order, chat_id))
+
+    def _next_message(self) -> _Message | None:
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                while self._waiting and self._waiting[0][0] <= now:
+                    _, _, chat_id = heapq.heappop(self._waiting)
+                    self._schedule_chat(chat_id)
+                if self._closing and not self._metrics.queued:
+                    return None
+                timeout = None
+                if self._paused_until > now:
+                    timeout = self._paused_until - now
+                elif self._ready:
+                    timeout = self._bucket.delay()
+                    if not timeout:
+                        _, _, chat_id = heapq.heappop(self._ready)
+                        self._bucket.reserve()
+                        self._chat_buckets.get(chat_id).reserve()
+                        return self._chats[chat_id][0]
+                elif self._waiting:
+                    timeout = self._waiting[0][0] - now
+                self._condition.wait(timeout)
+
+    def _send_forever(self) -> None:
+        while True:
+            message = self._next_message()
+            if message is None:
+                return
+            started_at = time.perf_counter()
+            try:
+                message.send()
+            except Exception as error:
+                self._finish(message, error, started_at)
+            else:
+                self._finish(message, None, started_at)
+
+    def _finish(
+        self, message: _Message, error: Exception | None, started_at: float
+    ) -> None:
+        retry_after = None if error is None else self.get_retry_after(error)
+        if self.bot_metrics is not None:
+            self.bot_metrics.observe_request(
+                time.perf_counter() - started_at,
+                error,
+                retry_after is not None,
+            )
+        with self._condition:
+            now = time.monotonic()
+            if retry_after is not None:
+                self._paused_until = max(self._paused_until, now + retry_after)
+                heapq.heappush(
+                    self._waiting,
+                    (now + retry_after, message.order, message.chat_id),
+                )
+                self._metrics.retried += 1
+                logging.warning(
+                    f"Отправка приостановлена на {retry_after} с: {error}"
+                )
+                self._condition.notify_all()
+                return
+
+            chat = self._chats[message.chat_id]
+            chat.popleft()
+            if chat:
+                self._schedule_chat(message.chat_id)
+            else:
+                del self._chats[message.chat_id]
+            self._metrics.queued -= 1
+            if error is None:
+                delay = now - message.submitted_at
+                self._metrics.sent += 1
+                self._metrics.total_delay += delay
+                self._metrics.max_delay = max(self._metrics.max_delay, delay)
+            else:
+                self._metrics.failed += 1
+                logging.error(f"Не удалось отправить сообщение: {error}")
+            self._condition.notify_all()
+
+
+def get_telegram_retry_after(error: Exception) -> float | None:
+    if isinstance(error, telegram.error.RetryAfter):
+        return error.retry_after
+    return None
+
+
+def get_vk_retry_after(error: Exception) -> float | None:
+    if isinstance(error, ApiError) and error.code in VK_FLOOD_ERROR_CODES:
+        return VK_RETRY_AFTER
+    return None
@@ -0,0 +1,310 @@
+import codecs
+from dataclasses import dataclass
+import logging
+from pathlib import Path
+from typing import Iterator, TextIO
+
+import chardet
+
+
+# The encoding of most packs of the archive, and the one assumed when the
+# encoding of a pack can't be detected.
+PACK_ENCODING = "koi8-r"
+BLOCK_SIZE = 1 << 20
+# The prefix of a pack checked for valid UTF-8, and the part of it whose
+# letters tell a single-byte encoding. The latter is all chardet gets, as
+# it takes milliseconds per kilobyte.
+SAMPLE_SIZE = 1 << 16
+LETTERS_SAMPLE_SIZE = 1 << 12
+# UTF-32 marks go first, as the UTF-32-LE one starts with the UTF-16-LE one.
+BYTE_ORDER_MARKS = (
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+ASCII_BYTES = bytes(range(0x80))
+# KOI8-R and windows-1251 both keep the Russian letters in the upper
+# quarter of the byte range, with the lowercase ones in opposite halves of
+# it. Only "ё" and punctuation are below it.
+BELOW_LETTER_BYTES = bytes(range(0x80, 0xC0))
+KOI8_LOWERCASE_BYTES = bytes(range(0xC0, 0xE0))
+MIN_LETTER_BYTES = 64
+MIN_LETTER_SHARE = 0.9
+MIN_LOWERCASE_RATIO = 3
+# The labels a paragraph starts with, by the field of the record it fills.
+# The paragraphs of a question are kept whole, as the bots show them; the
+# text after the label is kept for the headers.
+LABELS = {
+    "question": ("Вопрос",),
+    "answer": ("Ответ",),
+    "accepted": ("Зачёт", "Зачет"),
+    "comment": ("Комментарий:", "Комментарии:"),
+    "source": ("Источник:", "Источники:", "Источник(и):"),
+    "author": ("Автор:", "Авторы:", "Автор(ы):"),
+    # Headers of the pack, applied to the questions that follow them.
+    "championship": ("Чемпионат:",),
+    "tour": ("Тур:",),
+    "date": ("Дата:",),
+}
+HEADER_FIELDS = ("championship", "tour", "date")
+# The labels differ in their first letters, so a paragraph of plain text
+# is told apart from a labelled one with a single lookup.
+PREFIX_LENGTH = 3
+FIELD_PREFIXES = {
+    label[:PREFIX_LENGTH]: field
+    for field, labels in LABELS.items()
+    for label in labels
+}
+
+
+@dataclass(slots=True)
+class QuestionRecord:
+    """
+    A question of a pack with all its fields.
+
+    The fields of the question are whole paragraphs, e.g. "Ответ:\\nДа.",
+    empty if the question has no such paragraph. championship, tour and
+    date hold the text of the headers. line is the line of the question in
+    the pack, counted from 1. digest identifies the question among its
+    duplicates, it is left to the corpus build, see duplicates.py.
+    """
+
+    question: str
+    answer: str
+    line: int
+    accepted: str = ""
+    comment: str = ""
+    source: str = ""
+    author: str = ""
+    championship: str = ""
+    tour: str = ""
+    date: str = ""
+    digest: str = ""
+
+
+@dataclass
+class ParseIssue:
+    line: int
+    message: str
+
+
+def detect_encoding(sample: bytes) -> str:
+    """
+    Detects the encoding of a pack from a prefix of its contents.
+
+    A byte order mark or valid UTF-8 settle it at once. Russian text in
+    KOI8-R or windows-1251 is told apart by the case of its letters, as
+    most letters of any text are lowercase. Anything else is left to
+    chardet, which is a hundred times slower.
+
+    Args:
+        sample: The first bytes of the pack, a multibyte character may be
+            cut off at its end.
+
+    Returns:
+        The name of the codec, PACK_ENCODING if chardet can't tell either.
+    """
+    for byte_order_mark, encoding in BYTE_ORDER_MARKS:
+        if sample.startswith(byte_order_mark):
+            return encoding
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(sample)
+    except UnicodeDecodeError:
+        pass
+    else:
+        return "utf-8"
+
+    sample = sample[:LETTERS_SAMPLE_SIZE]
+    non_ascii = sample.translate(None, ASCII_BYTES)
+    letters = non_ascii.translate(None, BELOW_LETTER_BYTES)
+    if (
+        len(letters) >= MIN_LETTER_BYTES
+        and len(letters) >= len(non_ascii) * MIN_LETTER_SHARE
+    ):
+        upper_half = len(letters.translate(None, KOI8_LOWERCASE_BYTES))
+        lower_half = len(letters) - upper_half
+        if lower_half >= upper_half * MIN_LOWERCASE_RATIO:
+            return PACK_ENCODING
+        if upper_half >= lower_half * MIN_LOWERCASE_RATIO:
+            return "cp1251"
+
+    encoding = chardet.detect(sample)["encoding"]
+    try:
+        return codecs.lookup(encoding).name
+    except (LookupError, TypeError):
+        return PACK_ENCODING
+
+
+def detect_file_encoding(filename: str | Path) -> str:
+    """Detects the encoding of a pack file from its first bytes."""
+    with open(filename, "rb") as file:
+        return detect_encoding(file.read(SAMPLE_SIZE))
+
+
+def iter_paragraph_blocks(
+    file: TextIO, block_size: int = BLOCK_SIZE
+) -> Iterator[list[str]]:
+    """
+    Lazily splits a text file into paragraphs separated by empty lines.
+
+    The file is read in blocks and each block is split with one call, so
+    only a block and the paragraph it ends in are kept in memory.
+
+    Args:
+        file: A text file opened for reading.
+        block_size: The number of characters read at a time.
+
+    Yields:
+        The paragraphs of each block, in file order. Each paragraph but the
+        last one is followed by one empty line, so the paragraphs are not
+        stripped and may be empty.
+    """
+    tail = ""
+    for block in iter(lambda: file.read(block_size), ""):
+        paragraphs = (tail + block).split("\n\n")
+        tail = paragraphs.pop()
+        yield paragraphs
+    yield [tail]
+
+
+def iter_records(
+    file: TextIO, issues: list[ParseIssue] | None = None
+) -> Iterator[QuestionRecord]:
+    """
+    Parses a question pack in one pass.
+
+    The parser is a state machine over paragraphs: a "Вопрос" paragraph
+    starts a record, the "Ответ" paragraph completes it, and the paragraphs
+    after the answer fill the other fields until the next question. The
+    "Чемпионат:", "Тур:" and "Дата:" headers apply to all the questions
+    after them. A record is yielded as soon as it can no longer change, so a problem
+    in one question never shifts the answers of the others.
+
+    Args:
+        file: A pack opened for reading.
+        issues: Collects the problems found in the pack, with their lines.
+            A question without an answer and an answer without a question
+            are skipped.
+
+    Yields:
+        The complete question records, in file order.
+    """
+    championship = tour = date = ""
+    record: QuestionRecord | None = None
+    answered = False
+
+    def report(line: int, message: str) -> None:
+        if issues is not None:
+            issues.append(ParseIssue(line, message))
+
+    # Lines are counted only for the paragraphs that need them, from the
+    # last counted paragraph of the block.
+    paragraphs: list[str] = []
+    counted = 0
+    counted_line = 1
+
+    def line_of(index: int) -> int:
+        nonlocal counted, counted_line
+        if index > counted:
+            skipped = "\n\n".join(paragraphs[counted:index])
+            counted_line += skipped.count("\n") + 2
+            counted = index
+        paragraph = paragraphs[index]
+        if not paragraph[:1].isspace():
+            return counted_line
+        text_start = len(paragraph) - len(paragraph.lstrip())
+        return counted_line + paragraph.count("\n", 0, text_start)
+
+    get_field = FIELD_PREFIXES.get
+    for paragraphs in iter_paragraph_blocks(file):
+        counted = 0
+        for index, paragraph in enumerate(paragraphs):
+            field = get_field(paragraph[:PREFIX_LENGTH])
+            if field is None:
+                if not paragraph[:1].isspace():
+                    continue
+                paragraph = paragraph.lstrip()
+                field = get_field(paragraph[:PREFIX_LENGTH])
+                if field is None:
+                    continue
+            if not paragraph.startswith(LABELS[field]):
+                continue
+            paragraph = paragraph.rstrip()
+            if field == "question":
+                if record is not None:
+                    if answered:
+                        yield record
+                    else:
+                        report(record.line, "вопрос без ответа")
+                record = QuestionRecord(paragraph, "", line_of(index))
+                record.championship = championship
+                record.tour = tour
+                record.date = date
+                answered = False
+            elif field == "answer":
+                if record is None or answered:
+                    report(line_of(index), "ответ без вопроса")
+                    continue
+                record.answer = paragraph
+                answered = True
+            elif field in HEADER_FIELDS:
+                if record is not None:
+                    if answered:
+                        yield record
+                    else:
+                        report(record.line, "вопрос без ответа")
+                    record = None
+                    answered = False
+                text = paragraph.partition(":")[2].strip()
+                if field == "championship":
+                    championship = text
+                elif field == "tour":
+                    tour = text
+                else:
+                    date = text
+            elif answered:
+                setattr(record, field, paragraph)
+        if paragraphs:
+            # The paragraphs of a block are all followed by an empty line.
+            skipped = "\n\n".join(paragraphs[counted:])
+            counted_line += skipped.count("\n") + 2
+    if record is not None:
+        if answered:
+            yield record
+        else:
+            report(record.line, "вопрос без ответа")
+
+
+def parse_pack(
+    filename: str | Path, encoding: str | None = None
+) -> list[QuestionRecord]:
+    """
+    Parses a question pack file, logging the problems found in it.
+
+    A pack that can't be decoded is skipped as a whole, so no garbled
+    questions get into the corpus.
+
+    Args:
+        filename: A path to the pack.
+        encoding: The encoding of the pack, detected from the file if None.
+
+    Returns:
+        The question records of the pack, in file order.
+    """
+    if encoding is None:
+        encoding = detect_file_encoding(filename)
+    issues: list[ParseIssue] = []
+    try:
+        with open(filename, encoding=encoding) as file:
+            records = list(iter_records(file, issues))
+    except UnicodeDecodeError as error:
+        logging.error(
+            f"{filename}: файл пропущен, его не прочитать в кодировке "
+            f"{encoding}: {error}"
+        )
+        return []
+    for issue in issues:
+        logging.warning(f"{filename}:{issue.line}: {issue.message}")
+    return records
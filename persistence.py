@@ -0,0 +1,216 @@
+from collections.abc import Hashable, Iterator, MutableMapping
+import logging
+import threading
+
+import redis
+from telegram.ext import BasePersistence
+
+
+CONVERSATION_NAME = "quiz"
+FLUSH_INTERVAL = 0.02
+
+
+def get_conversations_key(name: str) -> str:
+    return f"conversations:{name}"
+
+
+def get_conversation_field(key: Hashable) -> str:
+    """
+    Returns the hash field of a conversation.
+
+    Args:
+        key (Hashable): The key of the conversation in ConversationHandler,
+            a tuple of the chat id and the user id.
+
+    Returns:
+        str: The ids joined with colons, e.g. "42:42".
+    """
+    return ":".join(str(part) for part in key)
+
+
+class RedisConversations(MutableMapping):
+    """
+    Conversation states of a ConversationHandler stored in a Redis hash.
+
+    Reads go to Redis every time, so all replicas of the bot see the same
+    state. Writes are buffered and sent by a background thread in one
+    pipeline every flush_interval seconds; several writes to a conversation
+    in between are coalesced into the last one. Until a write has reached
+    Redis this replica reads it from the buffer. A user's next message comes long
+    after the bot's reply, so other replicas read the flushed state.
+    """
+
+    def __init__(
+        self,
+        redis_db: redis.Redis,
+        name: str,
+        flush_interval: float = FLUSH_INTERVAL,
+    ) -> None:
+        """
+        Initializes a RedisConversations instance and starts its flusher.
+
+        Args:
+            redis_db (Redis): A Redis database client object.
+            name (str): The name of the ConversationHandler.
+            flush_interval (float): How often buffered writes are sent, in
+                seconds.
+
+        Returns:
+            None
+        """
+        self.redis_db = redis_db
+        self.key = get_conversations_key(name)
+        self.flush_interval = flush_interval
+        self._pending: dict[str, int | None] = {}
+        # The writes of the pipeline being sent, still read from here.
+        self._flushing: dict[str, int | None] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(
+            target=self._flush_forever, daemon=True
+        )
+        self._flusher.start()
+
+    def __getitem__(self, key: Hashable) -> int:
+        field = get_conversation_field(key)
+        with self._lock:
+            for buffer in (self._pending, self._flushing):
+                if field in buffer:
+                    state = buffer[field]
+                    if state is None:
+                        raise KeyError(key)
+                    return state
+        state = self.redis_db.hget(self.key, field)
+        if state is None:
+            raise KeyError(key)
+        return int(state)
+
+    def __setitem__(self, key: Hashable, state: int) -> None:
+        with self._lock:
+            self._pending[get_conversation_field(key)] = state
+
+    def __delitem__(self, key: Hashable) -> None:
+        with self._lock:
+            self._pending[get_conversation_field(key)] = None
+
+    def __iter__(self) -> Iterator[tuple[int, ...]]:
+        self.flush()
+        for field in self.redis_db.hkeys(self.key):
+            yield tuple(int(part) for part in field.decode().split(":"))
+
+    def __len__(self) -> int:
+        self.flush()
+        return self.redis_db.hlen(self.key)
+
+    def flush(self) -> None:
+        """Sends the buffered writes to Redis in one pipeline."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._flushing = pending
+            if not pending:
+                return
+            updated = {
+                field: state
+                for field, state in pending.items()
+                if state is not None
+            }
+            deleted = [
+                field for field, state in pending.items() if state is None
+            ]
+            pipeline = self.redis_db.pipeline(transaction=False)
+            if updated:
+                pipeline.hset(self.key, mapping=updated)
+            if deleted:
+                pipeline.hdel(self.key, *deleted)
+            try:
+                pipeline.execute()
+            except redis.RedisError:
+                with self._lock:
+                    self._pending = {**pending, **self._pending}
+                raise
+            finally:
+                with self._lock:
+                    self._flushing = {}
+
+    def close(self) -> None:
+        """Flushes the buffered writes and stops the flusher."""
+        self._closed.set()
+        self._flusher.join()
+        self.flush()
+
+    def _flush_forever(self) -> None:
+        while not self._closed.wait(self.flush_interval):
+            try:
+                self.flush()
+            except redis.RedisError:
+                logging.exception("Не удалось сохранить состояния диалогов")
+
+
+class RedisPersistence(BasePersistence):
+    """
+    Persistence that keeps only conversation states, in Redis.
+
+    User, chat and bot data are not used by the bot and are not stored.
+    """
+
+    def __init__(
+        self, redis_db: redis.Redis, flush_interval: float = FLUSH_INTERVAL
+    ) -> None:
+        """
+        Initializes a RedisPersistence instance.
+
+        Args:
+            redis_db (Redis): A Redis database client object.
+            flush_interval (float): How often buffered state writes are sent,
+                in seconds.
+
+        Returns:
+            None
+        """
+        super().__init__(
+            store_user_data=False,
+            store_chat_data=False,
+            store_bot_data=False,
+        )
+        self.redis_db = redis_db
+        self.flush_interval = flush_interval
+        self.conversations: dict[str, RedisConversations] = {}
+
+    def get_conversations(self, name: str) -> RedisConversations:
+        if name not in self.conversations:
+            self.conversations[name] = RedisConversations(
+                self.redis_db, name, self.flush_interval
+            )
+        return self.conversations[name]
+
+    def update_conversation(
+        self, name: str, key: Hashable, new_state: int | None
+    ) -> None:
+        # ConversationHandler has already written the state to the mapping
+        # returned by get_conversations.
+        pass
+
+    def get_user_data(self) -> dict:
+        return {}
+
+    def get_chat_data(self) -> dict:
+        return {}
+
+    def get_bot_data(self) -> dict:
+        return {}
+
+    def update_user_data(self, user_id: int, data: dict) -> None:
+        pass
+
+    def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    def update_bot_data(self, data: dict) -> None:
+        pass
+
+    def flush(self) -> None:
+        """Saves the buffered states, called when the bot stops."""
+        for conversations in self.conversations.values():
+            conversations.flush()
@@ -1,66 +1,377 @@
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from dataclasses import asdict
+import hashlib
+from itertools import repeat
 import json
+import logging
+import os
 from pathlib import Path
+import shutil
+import time
+from typing import Iterable, Iterator, TextIO
 
-import chardet
+from answers import normalize_answer, parse_accepted_answers
+from duplicates import merge_duplicates, question_digest
+from facets import (
+    TOURNAMENT_FACET,
+    YEAR_FACET,
+    FacetIndexBuilder,
+    write_facet_index,
+)
+from pack_parser import (
+    SAMPLE_SIZE,
+    QuestionRecord,
+    detect_encoding,
+    parse_pack,
+)
+from question_bank import write_question_bank
+from settings import setup_settings
 
-from settings import settings
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
 
 
-def build_question_answer_pairs(files: list[str]) -> dict[str, str]:
+# An answer paragraph and the "Зачёт:" paragraph that follows it, if any.
+Answer = tuple[str, str]
+
+# Bumped whenever parse_file changes, so cached parse results are rebuilt.
+PARSER_VERSION = 6
+
+
+def parse_file(
+    filename: str | Path, encoding: str | None = None
+) -> list[QuestionRecord]:
+    """
+    Collects the question records of a single file.
+
+    The digests duplicates are found by are computed here, so that they are
+    computed in parallel and cached with the records.
+
+    Args:
+        filename: A path to the file to be processed.
+        encoding: The encoding of the file, detected from it if None.
+
+    Returns:
+        The records of the file with their digests, in file order.
+    """
+    records = parse_pack(filename, encoding)
+    for record in records:
+        record.digest = question_digest(record.question)
+    return records
+
+
+def parse_files(
+    files: Iterable[str | Path],
+    workers: int = 1,
+    encodings: Iterable[str | None] | None = None,
+) -> Iterator[list[QuestionRecord]]:
+    """
+    Parses files on a process pool.
+
+    Files are parsed in parallel, but their results are yielded in the
+    order of the files.
+
+    Args:
+        files: Paths to the files to be processed.
+        workers: The number of worker processes, 1 parses in this process.
+        encodings: The encodings of the files, each file is detected if
+            None.
+
+    Yields:
+        The question records of each file.
+    """
+    if encodings is None:
+        encodings = repeat(None)
+    if workers == 1:
+        yield from map(parse_file, files, encodings)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(parse_file, files, encodings, chunksize=8)
+
+
+def build_question_answer_pairs(
+    files: list[str | Path],
+    workers: int = 1,
+    report: TextIO | None = None,
+    facets: FacetIndexBuilder | None = None,
+) -> dict[str, Answer]:
     """
     Creates a dictionary of questions and answers from a list of files.
 
-    The function reads each file, splits its content into paragraphs, and
-    then checks if each paragraph starts with "Вопрос" or "Ответ". If it
-    does, the function adds the paragraph to the list of questions or
-    answers, respectively. After all files have been processed, the function
-    creates a dictionary where each key is a question and its value is the
-    corresponding answer.
+    Each file is parsed in one pass into question records, see
+    pack_parser.iter_records. Every record holds the answer of its own
+    question, so a question without an answer never shifts the answers of
+    the others. A question repeated up to numbering, case, punctuation and
+    whitespace is merged and keeps its last occurrence, see
+    duplicates.merge_duplicates. Each answer comes with the "Зачёт:"
+    paragraph that follows it, or an empty string.
 
     Args:
         files: A list of paths to the files to be processed.
+        workers: The number of worker processes used for parsing.
+        report: A text file the merged duplicates are listed in.
+        facets: Collects the questions of each tournament and year.
 
     Returns:
         A dictionary of questions and answers.
     """
-    questions: list[str] = []
-    answers: list[str] = []
-    for filename in files:
-        with open(f"{filename}", encoding="KOI8-R") as file:
-            text: str = file.read()
-        text_splitted: list[str] = [
-            paragraph.strip()
-            for paragraph in text.split("\n\n")
-            if paragraph.strip()
-        ]
-        for line in text_splitted:
-            if line.startswith("Вопрос"):
-                questions.append(line)
-            if line.startswith("Ответ"):
-                answers.append(line)
-    questions_and_answers: dict[str, str] = {
-        question: answer for question, answer in zip(questions, answers)
-    }
+    questions_and_answers, _ = merge_duplicates(
+        zip(files, parse_files(files, workers)), report, facets
+    )
     return questions_and_answers
 
 
+def inspect_file(filename: str | Path) -> tuple[str, str]:
+    """
+    Returns the SHA-256 hex digest of the file contents and the encoding
+    detected from their first bytes, reading the file once.
+    """
+    digest = hashlib.sha256()
+    with open(filename, "rb") as file:
+        first_block = file.read(1 << 20)
+        digest.update(first_block)
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest(), detect_encoding(first_block[:SAMPLE_SIZE])
+
+
+def write_atomically(path: str | Path, data: object, **json_options) -> None:
+    """
+    Writes data as JSON to a temporary file and moves it over the target, so
+    readers never see a partially written file.
+    """
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w", encoding="utf-8") as json_file:
+        json.dump(data, json_file, ensure_ascii=False, **json_options)
+    os.replace(temporary_path, path)
+
+
+class BuildCache:
+    """
+    Cache of per-file parse results for incremental corpus rebuilds.
+
+    The manifest maps each source file path to its size, modification time,
+    content hash and encoding. Parse results are stored in files named after
+    the content hash, so a file that was only touched or renamed is not
+    parsed again.
+    """
+
+    MANIFEST_NAME = "manifest.json"
+
+    def __init__(self, cache_path: str | Path) -> None:
+        """
+        Initializes a BuildCache instance and loads its manifest.
+
+        Args:
+            cache_path (str | Path): The directory holding the cache.
+
+        Returns:
+            None
+        """
+        self.cache_path = Path(cache_path)
+        self.cache_path.mkdir(parents=True, exist_ok=True)
+        self.manifest_path = self.cache_path / self.MANIFEST_NAME
+        try:
+            with open(self.manifest_path, encoding="utf-8") as manifest_file:
+                self.manifest: dict[str, dict] = json.load(manifest_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.manifest = {}
+
+    def result_path(self, content_hash: str) -> Path:
+        return self.cache_path / f"{content_hash}.v{PARSER_VERSION}.json"
+
+    def refresh(self, files: list[Path]) -> list[Path]:
+        """
+        Updates the manifest for the current set of source files.
+
+        Files whose size and modification time match the manifest are trusted
+        without reading them. Other files are hashed and their encoding is
+        detected, and only those whose content has no cached parse result
+        are reported as stale. Entries of deleted files are dropped.
+
+        Args:
+            files (list[Path]): Paths to the current source files.
+
+        Returns:
+            list[Path]: Files that have to be parsed.
+        """
+        manifest: dict[str, dict] = {}
+        stale_files: list[Path] = []
+        for file in files:
+            stat = file.stat()
+            entry = self.manifest.get(str(file))
+            if (
+                entry is None
+                or entry["size"] != stat.st_size
+                or entry["mtime_ns"] != stat.st_mtime_ns
+                or "encoding" not in entry
+            ):
+                content_hash, encoding = inspect_file(file)
+                entry = {
+                    "size": stat.st_size,
+                    "mtime_ns": stat.st_mtime_ns,
+                    "sha256": content_hash,
+                    "encoding": encoding,
+                }
+            if not self.result_path(entry["sha256"]).exists():
+                stale_files.append(file)
+            manifest[str(file)] = entry
+        self.manifest = manifest
+        return stale_files
+
+    def store(self, file: Path, records: list[QuestionRecord]) -> None:
+        """Caches the parse result of a file listed in the manifest."""
+        content_hash = self.manifest[str(file)]["sha256"]
+        write_atomically(
+            self.result_path(content_hash),
+            [asdict(record) for record in records],
+        )
+
+    def load(self, file: Path) -> list[QuestionRecord]:
+        """Returns the cached parse result of a file listed in the manifest."""
+        content_hash = self.manifest[str(file)]["sha256"]
+        with open(self.result_path(content_hash), encoding="utf-8") as result:
+            return [QuestionRecord(**record) for record in json.load(result)]
+
+    def save(self) -> None:
+        """
+        Writes the manifest and removes parse results that no source file
+        refers to anymore.
+        """
+        write_atomically(self.manifest_path, self.manifest)
+        used_results = {
+            self.result_path(entry["sha256"])
+            for entry in self.manifest.values()
+        }
+        used_results.add(self.manifest_path)
+        for result_path in self.cache_path.glob("*.json"):
+            if result_path not in used_results:
+                result_path.unlink()
+
+
+def build_question_answer_pairs_incrementally(
+    files: list[Path],
+    cache: BuildCache,
+    workers: int = 1,
+    report: TextIO | None = None,
+    facets: FacetIndexBuilder | None = None,
+) -> tuple[dict[str, Answer], int, int]:
+    """
+    Creates a dictionary of questions and answers, parsing only the files
+    that changed since the previous build.
+
+    New and changed files are parsed on a process pool in the encodings
+    recorded in the manifest, and their results are cached. The corpus is
+    then merged from the cached results of all current files in path
+    order, so questions of deleted files are dropped and duplicates are
+    merged across all packs, old and new.
+
+    Args:
+        files: Paths to the source files.
+        cache: The cache of per-file parse results.
+        workers: The number of worker processes used for parsing.
+        report: A text file the merged duplicates are listed in.
+        facets: Collects the questions of each tournament and year.
+
+    Returns:
+        The dictionary of questions and answers, the number of parsed files
+        and the number of merged duplicates.
+    """
+    files = sorted(files)
+    stale_files = cache.refresh(files)
+    encodings = [cache.manifest[str(file)]["encoding"] for file in stale_files]
+    parse_results = parse_files(stale_files, workers, encodings)
+    for file, records in zip(stale_files, parse_results):
+        cache.store(file, records)
+    cache.save()
+    questions_and_answers, merged = merge_duplicates(
+        zip(files, map(cache.load, files)), report, facets
+    )
+    return questions_and_answers, len(stale_files), merged
+
+
+def get_peak_rss_mb() -> float | None:
+    """
+    Returns the peak resident set size of this process and its finished
+    worker processes in megabytes, or None if the platform can't tell.
+    """
+    if resource is None:
+        return None
+    peak_kb = (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    )
+    return peak_kb / 1024
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Собирает вопросы и ответы для ботов в JSON файл"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="число процессов для разбора файлов",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="разобрать все файлы заново, не используя кэш",
+    )
+    parser.add_argument(
+        "--export-json",
+        action="store_true",
+        help="дополнительно выгрузить вопросы и ответы в JSON файл",
+    )
+    parser.add_argument(
+        "--duplicates-report",
+        type=Path,
+        help="файл, в который выписываются объединённые повторы вопросов",
+    )
+    return parser.parse_args()
+
+
 def main() -> None:
     """
     Main function for preparing questions and answers for the quiz bot.
 
     This function reads all files in the directory specified by the
-    RAW_QUESTIONS_PATH setting, extracts questions and answers from them,
-    and writes the data to a JSON file named "questions.json".
+    RAW_QUESTIONS_PATH setting, extracts questions and answers from them
+    on a pool of worker processes, and writes them to the binary question
+    bank file that the bots memory-map, together with the normalized
+    canonical answers and the alternatives from "Зачёт:" paragraphs used for
+    answer checking. The ids of the questions of each tournament and year
+    are written to the facet index file next to it, see facets.py. With
+    the --export-json
+    flag the questions and answers are also written to the JSON file
+    specified by the QUESTIONS_JSON setting.
+
+    The encoding of each file is detected from its first bytes and cached
+    with its parse results, so a rebuild only parses files that were added
+    or changed since the previous run. The --full flag drops the
+    cache and parses everything again.
 
     The JSON file is formatted as a dictionary with questions as keys and
-    their corresponding answers as values.
+    their corresponding answers as values. json.dump encodes and writes it
+    chunk by chunk, so no second copy of the corpus is built as a string.
+    All files are replaced atomically, so running bots never read half of
+    them.
 
-    It assumes that the questions and answers are separated by
-    empty lines and that the questions start with the keyword "Вопрос"
-    and the answers start with the keyword "Ответ".
+    It assumes that the paragraphs of the packs are separated by blank
+    lines, that the questions start with the keyword "Вопрос" and the
+    answers start with the keyword "Ответ". Questions without an answer and
+    answers without a question are skipped and logged with their lines.
+    Questions repeated in several packs are merged, and with the
+    --duplicates-report flag the merged ones are listed in the given file.
 
-    The function does not perform any error checking, so it will crash if
-    the files are not in the correct format.
+    When the build is done, the parsing speed in files per second and the
+    peak memory usage are logged.
 
     Args:
         None
@@ -68,15 +379,79 @@ def main() -> None:
     Returns:
         None
     """
-    directory_path: Path = Path(settings.raw_questions_path)
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    settings = setup_settings()
+    directory_path: Path = Path(settings["raw_questions_path"])
     files: list[Path] = [
         file for file in directory_path.iterdir() if file.is_file()
     ]
-    questions_and_answers: dict[str, str] = build_question_answer_pairs(files)
-    with open("questions.json", "w", encoding="utf-8") as json_file:
-        json.dump(
-            questions_and_answers, json_file, ensure_ascii=False, indent=4
+
+    started_at = time.perf_counter()
+    cache_path = Path(settings["questions_cache_path"])
+    if args.full:
+        shutil.rmtree(cache_path, ignore_errors=True)
+    cache = BuildCache(cache_path)
+    report_file = (
+        open(args.duplicates_report, "w", encoding="utf-8")
+        if args.duplicates_report
+        else nullcontext()
+    )
+    facets = FacetIndexBuilder()
+    with report_file as report:
+        (
+            questions_and_answers,
+            parsed_files,
+            merged_duplicates,
+        ) = build_question_answer_pairs_incrementally(
+            files, cache, workers=args.workers, report=report, facets=facets
+        )
+    fingerprint = write_question_bank(
+        settings["questions_bank"],
+        [
+            (
+                question,
+                answer,
+                normalize_answer(answer),
+                "\n".join(parse_accepted_answers(accepted)),
+            )
+            for question, (answer, accepted) in questions_and_answers.items()
+        ],
+    )
+    write_facet_index(settings["questions_facets"], facets, fingerprint)
+    if args.export_json:
+        write_atomically(
+            settings["questions_json"],
+            {
+                question: answer
+                for question, (answer, _) in questions_and_answers.items()
+            },
+            indent=4,
+        )
+    elapsed = time.perf_counter() - started_at
+
+    files_per_second = len(files) / elapsed if elapsed else float("inf")
+    logging.info(
+        f"Собрано {len(questions_and_answers)} вопросов из {len(files)} "
+        f"файлов за {elapsed:.2f} с ({files_per_second:.1f} файлов/с), "
+        f"заново разобрано файлов: {parsed_files}, "
+        f"объединено повторов вопросов: {merged_duplicates}"
+    )
+    encodings = Counter(entry["encoding"] for entry in cache.manifest.values())
+    logging.info(
+        "Кодировки файлов: "
+        + ", ".join(
+            f"{encoding} - {count}"
+            for encoding, count in encodings.most_common()
         )
+    )
+    logging.info(
+        f"Подборки: турниров - {facets.count(TOURNAMENT_FACET)}, "
+        f"лет - {facets.count(YEAR_FACET)}"
+    )
+    peak_rss_mb = get_peak_rss_mb()
+    if peak_rss_mb is not None:
+        logging.info(f"Пиковое потребление памяти: {peak_rss_mb:.1f} МБ")
 
 
 if __name__ == "__main__":
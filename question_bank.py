@@ -0,0 +1,344 @@
+from array import array
+from hashlib import blake2b
+import mmap
+import os
+from pathlib import Path
+import random
+import struct
+import sys
+from typing import Collection, Iterable
+
+from answers import normalize_answer
+
+
+# Layout of a question bank file, all integers are little-endian:
+#   header: magic, record count, field count, length of the field names,
+#           fingerprint of the questions
+#   field names: UTF-8, separated by newlines, zero-padded to 8 bytes
+#   offsets: record count * field count + 1 unsigned 64-bit offsets into
+#            the blob, field j of record i spans
+#            offsets[i * field count + j] .. offsets[i * field count + j + 1]
+#   blob: UTF-8 encoded field values
+BANK_MAGIC = b"QBANK\x00\x02\x00"
+BANK_HEADER = struct.Struct("<8sIII8s")
+# Files written before the fingerprint was stored, it is computed from
+# their questions when first needed.
+BANK_MAGIC_V1 = b"QBANK\x00\x01\x00"
+BANK_HEADER_V1 = struct.Struct("<8sIII")
+FINGERPRINT_SIZE = 8
+BANK_OFFSET = struct.Struct("<Q")
+BANK_SPAN = struct.Struct("<QQ")
+BANK_FIELDS = ("question", "answer", "normalized_answer", "accepted_answers")
+
+
+def fingerprint_questions(questions: Iterable[str]) -> str:
+    """
+    Returns the fingerprint of a bank: the hash of its questions in the
+    order of their ids.
+
+    A question id means the same question only in banks with the same
+    fingerprint, so sessions store it along with the id. A rebuild that
+    keeps all the questions in place keeps the fingerprint too.
+
+    Args:
+        questions (Iterable[str]): The question texts in id order.
+
+    Returns:
+        str: The hex digest, 2 * FINGERPRINT_SIZE characters.
+    """
+    digest = blake2b(digest_size=FINGERPRINT_SIZE)
+    for question in questions:
+        digest.update(question.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class QuestionBank:
+    """
+    Integer-indexed storage of quiz questions and their answers.
+
+    Questions are kept in plain lists, so picking a random question, looking
+    one up by its id and getting the size of the bank are O(1) regardless of
+    the corpus size. The id of a question is its position in the bank.
+    """
+
+    def __init__(
+        self,
+        questions: list[str],
+        answers: list[str],
+        normalized_answers: list[str] | None = None,
+    ) -> None:
+        """
+        Initializes a QuestionBank instance.
+
+        Args:
+            questions (list[str]): Question texts.
+            answers (list[str]): Answers, aligned with the questions by index.
+            normalized_answers (list[str] | None): Normalized canonical
+                answers, computed from the answers if not given.
+
+        Returns:
+            None
+
+        Raises:
+            ValueError: If the lists have different lengths.
+        """
+        if normalized_answers is None:
+            normalized_answers = [
+                normalize_answer(answer) for answer in answers
+            ]
+        if not len(questions) == len(answers) == len(normalized_answers):
+            raise ValueError("questions and answers must have the same length")
+        self._questions = questions
+        self._answers = answers
+        self._normalized_answers = normalized_answers
+        self._ids_by_question: dict[str, int] | None = None
+        self._fingerprint: str | None = None
+
+    @classmethod
+    def from_dict(
+        cls, questions_and_answers: dict[str, str]
+    ) -> "QuestionBank":
+        """
+        Builds a QuestionBank from a dictionary of questions and answers.
+
+        Args:
+            questions_and_answers (dict[str, str]): Questions as keys and
+                their corresponding answers as values.
+
+        Returns:
+            QuestionBank: A bank holding the same questions in dictionary order.
+        """
+        return cls(
+            list(questions_and_answers.keys()),
+            list(questions_and_answers.values()),
+        )
+
+    def __len__(self) -> int:
+        return len(self._questions)
+
+    def random_id(self) -> int:
+        """
+        Returns the id of a uniformly chosen random question.
+
+        Raises:
+            IndexError: If the bank is empty.
+        """
+        if not len(self):
+            raise IndexError("question bank is empty")
+        return random.randrange(len(self))
+
+    def question(self, question_id: int) -> str:
+        """Returns the text of the question with the given id."""
+        return self._questions[question_id]
+
+    def answer(self, question_id: int) -> str:
+        """Returns the answer to the question with the given id."""
+        return self._answers[question_id]
+
+    def normalized_answer(self, question_id: int) -> str:
+        """Returns the normalized canonical answer to the question."""
+        return self._normalized_answers[question_id]
+
+    def accepted_answers(self, question_id: int) -> list[str]:
+        """
+        Returns the normalized answers accepted as correct: the canonical
+        answer followed by its alternatives.
+        """
+        return [self.normalized_answer(question_id)]
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        The fingerprint of the bank, see fingerprint_questions. Computed on
+        first use unless the bank file stores it.
+        """
+        if self._fingerprint is None:
+            self._fingerprint = fingerprint_questions(
+                self.question(question_id) for question_id in range(len(self))
+            )
+        return self._fingerprint
+
+    def find_id(self, question: str) -> int | None:
+        """
+        Finds the id of a question by its text.
+
+        The reverse index is built on the first call, so banks that are only
+        sampled by id never pay for it.
+
+        Args:
+            question (str): The exact question text.
+
+        Returns:
+            int | None: The id of the question, or None if it is not in the bank.
+        """
+        if self._ids_by_question is None:
+            self._ids_by_question = {
+                self.question(question_id): question_id
+                for question_id in range(len(self))
+            }
+        return self._ids_by_question.get(question)
+
+
+class MappedQuestionBank(QuestionBank):
+    """
+    QuestionBank backed by a memory-mapped question bank file.
+
+    Opening the bank only maps the file, so startup time does not depend on
+    the corpus size. A question or an answer is decoded only when it is
+    requested, and bot processes on one host share the mapped pages through
+    the page cache.
+    """
+
+    def __init__(self, path: str | Path) -> None:
+        """
+        Initializes a MappedQuestionBank instance by mapping the file.
+
+        Args:
+            path (str | Path): Path to a file written by write_question_bank.
+
+        Returns:
+            None
+
+        Raises:
+            ValueError: If the file is not a question bank file.
+        """
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic = self._mmap[: len(BANK_MAGIC)]
+        header = BANK_HEADER if magic == BANK_MAGIC else BANK_HEADER_V1
+        if len(self._mmap) < header.size or magic not in (
+            BANK_MAGIC,
+            BANK_MAGIC_V1,
+        ):
+            self._mmap.close()
+            raise ValueError(f"{path} is not a question bank file")
+        self._fingerprint = None
+        (
+            _,
+            self._count,
+            self._field_count,
+            names_length,
+            *fingerprint,
+        ) = header.unpack_from(self._mmap)
+        if fingerprint:
+            self._fingerprint = fingerprint[0].hex()
+        names_end = header.size + names_length
+        field_names = self._mmap[header.size : names_end].decode("utf-8")
+        self._field_indexes = {
+            name: index for index, name in enumerate(field_names.split("\n"))
+        }
+        self._offsets_start = names_end + (-names_end % 8)
+        offsets_count = self._count * self._field_count + 1
+        self._blob_start = (
+            self._offsets_start + offsets_count * BANK_OFFSET.size
+        )
+        self._ids_by_question = None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _field(self, question_id: int, field: str) -> str:
+        if not 0 <= question_id < self._count:
+            raise IndexError("question id out of range")
+        slot = question_id * self._field_count + self._field_indexes[field]
+        start, end = BANK_SPAN.unpack_from(
+            self._mmap, self._offsets_start + slot * BANK_OFFSET.size
+        )
+        value = self._mmap[self._blob_start + start : self._blob_start + end]
+        return value.decode("utf-8")
+
+    def question(self, question_id: int) -> str:
+        """Returns the text of the question with the given id."""
+        return self._field(question_id, "question")
+
+    def answer(self, question_id: int) -> str:
+        """Returns the answer to the question with the given id."""
+        return self._field(question_id, "answer")
+
+    def normalized_answer(self, question_id: int) -> str:
+        """
+        Returns the normalized canonical answer to the question.
+
+        Files written before normalized answers were stored get them
+        computed on the fly.
+        """
+        if "normalized_answer" not in self._field_indexes:
+            return normalize_answer(self.answer(question_id))
+        return self._field(question_id, "normalized_answer")
+
+    def accepted_answers(self, question_id: int) -> list[str]:
+        """
+        Returns the normalized answers accepted as correct: the canonical
+        answer followed by the alternatives stored in the file.
+        """
+        accepted_answers = [self.normalized_answer(question_id)]
+        if "accepted_answers" in self._field_indexes:
+            alternatives = self._field(question_id, "accepted_answers")
+            if alternatives:
+                accepted_answers.extend(alternatives.split("\n"))
+        return accepted_answers
+
+    def close(self) -> None:
+        """Unmaps the question bank file."""
+        self._mmap.close()
+
+
+def write_question_bank(
+    path: str | Path, records: Collection[tuple[str, ...]]
+) -> str:
+    """
+    Writes records to a question bank file that MappedQuestionBank can map.
+
+    Values are streamed to the file one by one, only their offsets are kept
+    in memory. The file is written next to the target and then moved over
+    it, so bots that have the old file mapped keep reading the old version.
+
+    Args:
+        path (str | Path): Path to the question bank file.
+        records (Collection[tuple[str, ...]]): One tuple per question with
+            values in the order of BANK_FIELDS.
+
+    Returns:
+        str: The fingerprint of the bank, stored in the header.
+    """
+    field_names = "\n".join(BANK_FIELDS).encode("utf-8")
+    names_end = BANK_HEADER.size + len(field_names)
+    offsets_start = names_end + (-names_end % 8)
+    offsets_count = len(records) * len(BANK_FIELDS) + 1
+    blob_start = offsets_start + offsets_count * BANK_OFFSET.size
+
+    temporary_path = f"{path}.tmp"
+    offsets = array("Q", [0])
+    questions = []
+    with open(temporary_path, "wb") as file:
+        file.seek(BANK_HEADER.size)
+        file.write(field_names)
+        file.seek(blob_start)
+        for record in records:
+            if len(record) != len(BANK_FIELDS):
+                raise ValueError(
+                    f"expected {len(BANK_FIELDS)} fields per record"
+                )
+            questions.append(record[0])
+            for value in record:
+                encoded = value.encode("utf-8")
+                file.write(encoded)
+                offsets.append(offsets[-1] + len(encoded))
+        if sys.byteorder == "big":
+            offsets.byteswap()
+        file.seek(offsets_start)
+        file.write(offsets.tobytes())
+        fingerprint = fingerprint_questions(questions)
+        file.seek(0)
+        file.write(
+            BANK_HEADER.pack(
+                BANK_MAGIC,
+                len(records),
+                len(BANK_FIELDS),
+                len(field_names),
+                bytes.fromhex(fingerprint),
+            )
+        )
+    os.replace(temporary_path, path)
+    return fingerprint
@@ -0,0 +1,220 @@
+from enum import Enum
+
+from answers import is_correct_answer, strip_answer_prefix
+from facets import TOURNAMENT_FACET, YEAR_FACET, FacetIndex
+from question_bank import QuestionBank
+from scores import Outcome
+
+
+START_MESSAGE = "Напряги извилины"
+KEYBOARD = [
+    ["Новый вопрос", "Сдаться"],
+    ["Мой счёт"],
+]
+NEW_QUESTION_TEXT = "Новый вопрос"
+GIVE_UP_TEXT = "Сдаться"
+SCORE_TEXT = "Мой счёт"
+CANCEL_MESSAGE = "Если хотите, можете начать заново с /start."
+# The commands choosing the questions a user gets, by the facet they
+# choose from, None for all the questions.
+SELECTION_COMMANDS = {
+    "tournament": TOURNAMENT_FACET,
+    "year": YEAR_FACET,
+    "all": None,
+}
+MAX_LISTED_VALUES = 10
+
+
+class State(Enum):
+    NEW_QUESTION = 1
+    GUESS_ANSWER = 2
+
+
+class Action(Enum):
+    """What the bot does with a message, by the name of its handler."""
+
+    START = "start_command"
+    CANCEL = "cancel"
+    CHOOSE_SELECTION = "handle_selection_command"
+    SHOW_SCORE = "handle_score_request"
+    NEW_QUESTION = "handle_new_question_request"
+    ATTEMPT = "handle_solution_attempt"
+
+
+def judge_attempt(
+    questions: QuestionBank, question_id: int, user_answer: str
+) -> Outcome:
+    """
+    Decides what a user's message means for the current question.
+
+    Args:
+        questions (QuestionBank): The bank of questions and their answers.
+        question_id (int): The id of the question the user is answering.
+        user_answer (str): The text sent by the user.
+
+    Returns:
+        Outcome: GAVE_UP for "Сдаться", otherwise CORRECT or WRONG.
+    """
+    if user_answer == GIVE_UP_TEXT:
+        return Outcome.GAVE_UP
+    if is_correct_answer(user_answer, questions.accepted_answers(question_id)):
+        return Outcome.CORRECT
+    return Outcome.WRONG
+
+
+def format_verdict(
+    questions: QuestionBank,
+    question_id: int,
+    outcome: Outcome,
+    can_retry: bool = True,
+) -> str:
+    """
+    Formats the reply to a user's answer.
+
+    Args:
+        questions (QuestionBank): The bank of questions and their answers.
+        question_id (int): The id of the question the user answered.
+        outcome (Outcome): The result of judge_attempt.
+        can_retry (bool): Whether the user may answer the question again
+            after a wrong answer.
+
+    Returns:
+        str: The message text.
+    """
+    if outcome is Outcome.GAVE_UP:
+        correct_answer = strip_answer_prefix(questions.answer(question_id))
+        return f"Правильный ответ: {correct_answer}"
+    if outcome is Outcome.CORRECT:
+        return "Правильно!"
+    if can_retry:
+        return "Неправильно. Попробуйте ещё раз."
+    return "Неправильно."
+
+
+def get_next_state(outcome: Outcome) -> State:
+    """Returns the conversation state after an answer with the outcome."""
+    if outcome is Outcome.WRONG:
+        return State.GUESS_ANSWER
+    return State.NEW_QUESTION
+
+
+def get_command(text: str) -> str | None:
+    """
+    Returns the name of the command a message starts with, e.g. "year" for
+    "/year 2005" or "/year@quizbot 2005", or None if it is not a command.
+    """
+    words = text.split(maxsplit=1)
+    if not words or not words[0].startswith("/"):
+        return None
+    return words[0][1:].partition("@")[0]
+
+
+def get_selection_command(text: str) -> str | None:
+    """
+    Returns the name of the command of SELECTION_COMMANDS a message starts
+    with, or None.
+    """
+    command = get_command(text)
+    return command if command in SELECTION_COMMANDS else None
+
+
+def route_message(text: str, state: State | None) -> Action | None:
+    """
+    Decides what the bot does with a message in a state of the conversation.
+
+    "/start" starts the conversation over in any state. "/tournament",
+    "/year" and "/all" choose the questions in any state and outside of a
+    conversation. Other messages outside of a conversation are ignored.
+    "/cancel" starts the conversation over and "Мой счёт" shows the score.
+    In NEW_QUESTION only "Новый вопрос" is handled, in GUESS_ANSWER any
+    other text, "Новый вопрос" included, is an answer.
+
+    Args:
+        text (str): The text of the message.
+        state (State | None): The state of the conversation, None outside
+            of a conversation.
+
+    Returns:
+        Action | None: The action, or None if the message is ignored.
+    """
+    command = get_command(text)
+    if command == "start":
+        return Action.START
+    if command in SELECTION_COMMANDS:
+        return Action.CHOOSE_SELECTION
+    if state is None:
+        return None
+    if command == "cancel":
+        return Action.CANCEL
+    if command is not None:
+        return None
+    if text == SCORE_TEXT:
+        return Action.SHOW_SCORE
+    if state is State.GUESS_ANSWER:
+        return Action.ATTEMPT
+    if text == NEW_QUESTION_TEXT:
+        return Action.NEW_QUESTION
+    return None
+
+
+def get_possible_actions(text: str) -> set[Action]:
+    """
+    Returns the actions a message may lead to in any state, so that the
+    data they need is read together with the state.
+    """
+    actions = {route_message(text, state) for state in (None, *State)}
+    return actions - {None}
+
+
+def choose_selection(
+    facets: FacetIndex | None, text: str
+) -> tuple[str | None, str]:
+    """
+    Handles a command choosing the questions a user gets: "/tournament
+    <part of the name>", "/year <year>" or "/all".
+
+    Args:
+        facets (FacetIndex | None): The questions of the tournaments and
+            years, None if the bot has none.
+        text (str): The text of the command.
+
+    Returns:
+        tuple[str | None, str]: The new selection of the user, an empty
+            string for all the questions or None to keep the current one,
+            and the message text.
+    """
+    facet = SELECTION_COMMANDS[get_selection_command(text)]
+    argument = text.split(maxsplit=1)[1:]
+    if facet is None:
+        return "", "Теперь вопросы из всех турниров."
+    if facets is None or not facets.values(facet):
+        return None, "Подборки вопросов ещё не собраны."
+    if not argument:
+        if facet == TOURNAMENT_FACET:
+            return None, (
+                "Напишите часть названия турнира, например: "
+                "/tournament Кубок"
+            )
+        years = facets.values(YEAR_FACET)
+        return None, (
+            f"Есть вопросы за {years[0]}-{years[-1]} годы. Напишите год, "
+            f"например: /year {years[-1]}"
+        )
+    values = facets.find_values(facet, argument[0])
+    if not values:
+        return None, "Ничего не нашлось."
+    if len(values) > 1:
+        listed = "\n".join(values[:MAX_LISTED_VALUES])
+        more = len(values) - MAX_LISTED_VALUES
+        if more > 0:
+            listed += f"\n...и ещё {more}"
+        if facet == TOURNAMENT_FACET:
+            return None, f"Подходит несколько турниров, уточните:\n{listed}"
+        return None, f"Подходит несколько лет, уточните:\n{listed}"
+    value = values[0]
+    count = facets.count(facet, value)
+    if facet == TOURNAMENT_FACET:
+        reply = f"Теперь вопросы турнира «{value}»: {count}."
+    else:
+        reply = f"Теперь вопросы {value} года: {count}."
+    return f"{facet}\t{value}", f"{reply} Вернуть все вопросы: /all"
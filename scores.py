@@ -0,0 +1,204 @@
+from dataclasses import dataclass
+from enum import Enum
+
+import redis
+import redis.asyncio
+
+
+LEADERBOARD_KEY = "leaderboard"
+
+
+class Outcome(Enum):
+    CORRECT = "correct"
+    WRONG = "wrong"
+    GAVE_UP = "gave_up"
+
+
+@dataclass
+class Score:
+    correct: int = 0
+    given_up: int = 0
+    attempts: int = 0
+    streak: int = 0
+    rank: int | None = None
+    players: int = 0
+
+
+def get_score_key(platform: str, user_id: int) -> str:
+    return f"score:{platform}:{user_id}"
+
+
+def get_leaderboard_member(platform: str, user_id: int) -> str:
+    """
+    Returns the member of the leaderboard of a user. The leaderboard is
+    shared by the bots, so its members are namespaced like the session keys:
+    users of different platforms may have the same id.
+    """
+    return f"{platform}:{user_id}"
+
+
+def queue_outcome(
+    pipeline: redis.client.Pipeline,
+    platform: str,
+    user_id: int,
+    outcome: Outcome,
+) -> None:
+    """
+    Queues the updates of the user's counters and the leaderboard after an
+    answer on a pipeline.
+
+    The streak counts correct answers in a row, so a wrong answer resets
+    it like giving up does.
+
+    Queuing commands is synchronous for both redis.Redis and
+    redis.asyncio.Redis pipelines, so the same function serves both bots.
+
+    Args:
+        pipeline (Pipeline): A Redis pipeline.
+        platform (str): TG_PLATFORM or VK_PLATFORM.
+        user_id (int): The id of the user on the messaging platform.
+        outcome (Outcome): The result of the user's message.
+
+    Returns:
+        None
+    """
+    score_key = get_score_key(platform, user_id)
+    if outcome is Outcome.GAVE_UP:
+        pipeline.hincrby(score_key, "given_up", 1)
+    else:
+        pipeline.hincrby(score_key, "attempts", 1)
+    if outcome is not Outcome.CORRECT:
+        pipeline.hset(score_key, "streak", 0)
+    else:
+        pipeline.hincrby(score_key, "correct", 1)
+        pipeline.hincrby(score_key, "streak", 1)
+        pipeline.zincrby(
+            LEADERBOARD_KEY, 1, get_leaderboard_member(platform, user_id)
+        )
+
+
+def record_outcome(
+    redis_db: redis.Redis, platform: str, user_id: int, outcome: Outcome
+) -> None:
+    """
+    Updates the user's counters and the leaderboard after an answer.
+
+    All updates are sent in one MULTI/EXEC pipeline, so they are applied
+    atomically and cost a single round trip to Redis.
+
+    Args:
+        redis_db (Redis): A Redis database client object.
+        platform (str): TG_PLATFORM or VK_PLATFORM.
+        user_id (int): The id of the user on the messaging platform.
+        outcome (Outcome): The result of the user's message.
+
+    Returns:
+        None
+    """
+    pipeline = redis_db.pipeline(transaction=True)
+    queue_outcome(pipeline, platform, user_id, outcome)
+    pipeline.execute()
+
+
+async def record_outcome_async(
+    redis_db: redis.asyncio.Redis,
+    platform: str,
+    user_id: int,
+    outcome: Outcome,
+) -> None:
+    """Asynchronous version of record_outcome."""
+    pipeline = redis_db.pipeline(transaction=True)
+    queue_outcome(pipeline, platform, user_id, outcome)
+    await pipeline.execute()
+
+
+def queue_score_request(
+    pipeline: redis.client.Pipeline, platform: str, user_id: int
+) -> None:
+    """
+    Queues the reads of the user's counters, rank and the number of ranked
+    players on a pipeline. Looking up the rank in the sorted set is
+    O(log N).
+
+    Args:
+        pipeline (Pipeline): A Redis pipeline.
+        platform (str): TG_PLATFORM or VK_PLATFORM.
+        user_id (int): The id of the user on the messaging platform.
+
+    Returns:
+        None
+    """
+    pipeline.hgetall(get_score_key(platform, user_id))
+    pipeline.zrevrank(
+        LEADERBOARD_KEY, get_leaderboard_member(platform, user_id)
+    )
+    pipeline.zcard(LEADERBOARD_KEY)
+
+
+def parse_score(results: list) -> Score:
+    """
+    Builds the user's score from the results of queue_score_request.
+
+    Args:
+        results (list): The three results of the queued commands.
+
+    Returns:
+        Score: The user's score. The rank is None until the first correct
+            answer.
+    """
+    counters, rank, players = results
+    return Score(
+        **{field.decode(): int(value) for field, value in counters.items()},
+        rank=None if rank is None else rank + 1,
+        players=players,
+    )
+
+
+def get_score(redis_db: redis.Redis, platform: str, user_id: int) -> Score:
+    """
+    Returns the user's counters and place on the leaderboard, read in one
+    round trip.
+
+    Args:
+        redis_db (Redis): A Redis database client object.
+        platform (str): TG_PLATFORM or VK_PLATFORM.
+        user_id (int): The id of the user on the messaging platform.
+
+    Returns:
+        Score: The user's score.
+    """
+    pipeline = redis_db.pipeline(transaction=False)
+    queue_score_request(pipeline, platform, user_id)
+    return parse_score(pipeline.execute())
+
+
+async def get_score_async(
+    redis_db: redis.asyncio.Redis, platform: str, user_id: int
+) -> Score:
+    """Asynchronous version of get_score."""
+    pipeline = redis_db.pipeline(transaction=False)
+    queue_score_request(pipeline, platform, user_id)
+    return parse_score(await pipeline.execute())
+
+
+def format_score(score: Score) -> str:
+    """
+    Formats the user's score as a message.
+
+    Args:
+        score (Score): The user's score.
+
+    Returns:
+        str: The message text.
+    """
+    if score.rank is None:
+        rank = "пока нет в рейтинге"
+    else:
+        rank = f"{score.rank} из {score.players}"
+    return (
+        f"Правильных ответов: {score.correct}\n"
+        f"Сдано вопросов: {score.given_up}\n"
+        f"Попыток ответа: {score.attempts}\n"
+        f"Правильных ответов подряд: {score.streak}\n"
+        f"Место в рейтинге: {rank}"
+    )
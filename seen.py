@@ -0,0 +1,115 @@
+import redis
+
+
+# How many random questions are checked against the user's seen-set in one
+# read. A user who has seen a share p of the questions needs the fallback
+# scan only with probability p ** SEEN_CANDIDATES.
+SEEN_CANDIDATES = 8
+
+
+def get_seen_key(platform: str, user_id: int, fingerprint: str) -> str:
+    """
+    Returns the key of the bitmap of the questions the user has seen.
+
+    Bit i of the bitmap is set once the user got the question with id i, so
+    the bitmap takes at most one bit per question of the bank, e.g. 12.5 KB
+    for 100 000 questions. The ids of a rebuilt bank point to other
+    questions, so the key includes the fingerprint of the bank and the
+    bitmap of the old one is left to expire.
+
+    Args:
+        platform (str): TG_PLATFORM or VK_PLATFORM.
+        user_id (int): The id of the user on the messaging platform.
+        fingerprint (str): The fingerprint of the question bank.
+
+    Returns:
+        str: The key, e.g. "seen:tg:42:0123456789abcdef".
+    """
+    return f"seen:{platform}:{user_id}:{fingerprint}"
+
+
+def queue_seen_request(
+    pipeline: redis.client.Pipeline, seen_key: str, candidate_ids: list[int]
+) -> None:
+    """
+    Queues the reads that pick a question the user hasn't seen yet on a
+    pipeline.
+
+    One BITFIELD reads the bits of the random candidates. In case all of
+    them were seen, BITPOS finds the first unseen question after the first
+    candidate, and the first unseen question of the bank. Both stop at the
+    first byte with a clear bit, so they are short unless the user has seen
+    most of the bank.
+
+    Args:
+        pipeline (Pipeline): A Redis pipeline.
+        seen_key (str): The key of the user's seen-set.
+        candidate_ids (list[int]): Random question ids, the first one also
+            starts the scan.
+
+    Returns:
+        None
+    """
+    reads = []
+    for candidate_id in candidate_ids:
+        reads += ["GET", "u1", f"#{candidate_id}"]
+    pipeline.execute_command("BITFIELD", seen_key, *reads)
+    pipeline.bitpos(seen_key, 0, candidate_ids[0] // 8)
+    pipeline.bitpos(seen_key, 0)
+
+
+def choose_unseen_question(
+    results: list, candidate_ids: list[int], questions_count: int
+) -> tuple[int, bool]:
+    """
+    Picks a question from the results of queue_seen_request.
+
+    Args:
+        results (list): The three results of the queued commands.
+        candidate_ids (list[int]): The candidates passed to
+            queue_seen_request.
+        questions_count (int): The number of questions in the bank.
+
+    Returns:
+        tuple[int, bool]: The id of the question and whether the user has
+            seen all the questions, so the seen-set has to start over.
+    """
+    seen_bits, unseen_after_start, first_unseen = results
+    for candidate_id, seen in zip(candidate_ids, seen_bits):
+        if not seen:
+            return candidate_id, False
+    # BITPOS reports positions past the end of the bitmap or of the bank
+    # when there is no clear bit, and -1 when the start is past the end.
+    for question_id in (unseen_after_start, first_unseen):
+        if 0 <= question_id < questions_count:
+            return question_id, False
+    return candidate_ids[0], True
+
+
+def queue_seen_question(
+    pipeline: redis.client.Pipeline,
+    seen_key: str,
+    question_id: int,
+    reset: bool,
+    ttl: int,
+) -> None:
+    """
+    Queues marking a question as seen on a pipeline.
+
+    The seen-set lives as long as the session, so the bitmaps of users who
+    stopped playing don't take memory forever.
+
+    Args:
+        pipeline (Pipeline): A Redis pipeline.
+        seen_key (str): The key of the user's seen-set.
+        question_id (int): The id of the question the user got.
+        reset (bool): Whether to forget all the other questions first.
+        ttl (int): The lifetime of the seen-set in seconds.
+
+    Returns:
+        None
+    """
+    if reset:
+        pipeline.delete(seen_key)
+    pipeline.setbit(seen_key, question_id, 1)
+    pipeline.expire(seen_key, ttl)
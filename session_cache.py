@@ -0,0 +1,333 @@
+from collections import Counter, OrderedDict
+from collections.abc import Callable
+from dataclasses import dataclass, replace
+import logging
+import threading
+import time
+
+import redis
+
+
+SESSION_CACHE_SIZE = 10_000
+SESSION_CACHE_TTL = 300.0
+NOTIFY_KEYSPACE_EVENTS = "Kg$xe"
+RECONNECT_DELAY = 1.0
+METRICS_LOG_INTERVAL = 600.0
+
+
+@dataclass
+class CacheMetrics:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    invalidations: int = 0
+    size: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class SessionCache:
+    """
+    Write-through LRU cache of the users' current questions.
+
+    Redis stays the source of truth. The cache keeps the questions this
+    process has recently written or read, at most max_size of them and for
+    at most ttl seconds each. Writes of other replicas reach the cache as
+    keyspace notifications through a CacheInvalidator and drop the entries.
+
+    The notifications of the process's own writes are expected with
+    expect_write and do not drop the entries. An entry read from Redis is
+    cached only if no session changed while it was read, which is tracked
+    with a version number.
+    """
+
+    def __init__(
+        self,
+        max_size: int = SESSION_CACHE_SIZE,
+        ttl: float = SESSION_CACHE_TTL,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """
+        Initializes an empty SessionCache.
+
+        Args:
+            max_size (int): How many sessions are kept.
+            ttl (float): How many seconds a session is kept, which bounds
+                the staleness if a notification is lost.
+            clock (Callable[[], float]): Returns the current time in seconds.
+
+        Returns:
+            None
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self._entries: OrderedDict[int, tuple[int, float]] = OrderedDict()
+        self._expected_writes: Counter[int] = Counter()
+        self._version = 0
+        self._metrics = CacheMetrics()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, user_id: int) -> int | None:
+        """
+        Returns the cached question of the user.
+
+        Args:
+            user_id (int): The id of the user on the messaging platform.
+
+        Returns:
+            int | None: The question id, or None if it is not cached.
+        """
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[1] <= self.clock():
+                del self._entries[user_id]
+                self._metrics.expirations += 1
+                entry = None
+            if entry is None:
+                self._metrics.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self._metrics.hits += 1
+            return entry[0]
+
+    def version(self) -> int:
+        """Returns a number that changes whenever a session is invalidated."""
+        return self._version
+
+    def put(self, user_id: int, question_id: int, version: int) -> None:
+        """
+        Caches a question read from Redis.
+
+        Args:
+            user_id (int): The id of the user on the messaging platform.
+            question_id (int): The question id read.
+            version (int): The version taken before the read. If a session
+                was invalidated since, the question may be stale and is not
+                cached.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            if version == self._version:
+                self._store(user_id, question_id)
+
+    def expect_write(self, user_id: int) -> None:
+        """Announces a write of this process before it is sent to Redis."""
+        with self._lock:
+            self._expected_writes[user_id] += 1
+
+    def write(self, user_id: int, question_id: int) -> None:
+        """Caches a question once this process has written it to Redis."""
+        with self._lock:
+            self._store(user_id, question_id)
+
+    def cancel_write(self, user_id: int) -> None:
+        """Forgets an expected write that failed, and the user's entry."""
+        with self._lock:
+            self._forget_expected_write(user_id)
+            self._drop(user_id)
+
+    def invalidate(self, user_id: int, event: str) -> None:
+        """
+        Handles a keyspace notification of a session.
+
+        Args:
+            user_id (int): The id of the user whose session changed.
+            event (str): The event, e.g. "set", "del" or "expired".
+
+        Returns:
+            None
+        """
+        with self._lock:
+            if event == "expire":
+                # The session was prolonged, its question is the same.
+                return
+            if event == "set" and self._expected_writes[user_id]:
+                self._forget_expected_write(user_id)
+                return
+            self._drop(user_id)
+
+    def clear(self) -> None:
+        """Drops all entries, e.g. when notifications may have been lost."""
+        with self._lock:
+            self._version += 1
+            self._metrics.invalidations += len(self._entries)
+            self._entries.clear()
+            self._expected_writes.clear()
+
+    def metrics(self) -> CacheMetrics:
+        """Returns a snapshot of the cache counters."""
+        with self._lock:
+            return replace(self._metrics, size=len(self._entries))
+
+    def _store(self, user_id: int, question_id: int) -> None:
+        self._entries[user_id] = (question_id, self.clock() + self.ttl)
+        self._entries.move_to_end(user_id)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self._metrics.evictions += 1
+
+    def _drop(self, user_id: int) -> None:
+        self._version += 1
+        if self._entries.pop(user_id, None) is not None:
+            self._metrics.invalidations += 1
+
+    def _forget_expected_write(self, user_id: int) -> None:
+        self._expected_writes[user_id] -= 1
+        if self._expected_writes[user_id] <= 0:
+            del self._expected_writes[user_id]
+
+
+def enable_keyspace_notifications(redis_db: redis.Redis) -> bool:
+    """
+    Makes Redis publish the changes of keys, keeping the events enabled by
+    other clients.
+
+    Args:
+        redis_db (Redis): A Redis database client object.
+
+    Returns:
+        bool: Whether the notifications are enabled. Managed Redis services
+            may forbid CONFIG, then they have to be enabled in the service
+            settings.
+    """
+    try:
+        events = redis_db.config_get("notify-keyspace-events")
+        current = events.get("notify-keyspace-events", "")
+        if isinstance(current, bytes):
+            current = current.decode()
+        # "A" is an alias of all the event classes, "K" is not one of them.
+        missing = "".join(
+            flag
+            for flag in NOTIFY_KEYSPACE_EVENTS
+            if flag not in current and (flag == "K" or "A" not in current)
+        )
+        if missing:
+            redis_db.config_set("notify-keyspace-events", current + missing)
+    except redis.ResponseError:
+        logging.warning("Не удалось включить уведомления об изменениях ключей")
+        return False
+    return True
+
+
+class CacheInvalidator:
+    """
+    Background thread that drops cached sessions changed in Redis.
+
+    It listens to the keyspace notifications of the sessions. When the
+    subscription is lost, notifications may be missed, so the whole cache
+    is dropped and the thread subscribes again.
+    """
+
+    def __init__(
+        self, redis_db: redis.Redis, cache: SessionCache, platform: str
+    ) -> None:
+        """
+        Initializes a CacheInvalidator instance and starts its thread.
+
+        Args:
+            redis_db (Redis): A Redis database client object, the thread
+                takes one connection of its pool.
+            cache (SessionCache): The cache to invalidate.
+            platform (str): The platform whose sessions are cached.
+
+        Returns:
+            None
+        """
+        self.redis_db = redis_db
+        self.cache = cache
+        db = redis_db.connection_pool.connection_kwargs.get("db", 0)
+        # The channels of the keys made by get_session_key.
+        self.pattern = f"__keyspace@{db}__:session:{platform}:*"
+        self._prefix_length = len(self.pattern) - 1
+        self._subscribed = threading.Event()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(
+            target=self._listen_forever, daemon=True
+        )
+        self._thread.start()
+
+    def wait_subscribed(self, timeout: float | None = None) -> bool:
+        """Waits until the thread listens to the notifications."""
+        return self._subscribed.wait(timeout)
+
+    def close(self) -> None:
+        self._closed.set()
+        self._thread.join()
+
+    def __enter__(self) -> "CacheInvalidator":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _listen_forever(self) -> None:
+        logged_at = time.monotonic()
+        while not self._closed.is_set():
+            pubsub = self.redis_db.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.psubscribe(self.pattern)
+                # Sessions cached before the subscription may be stale.
+                self.cache.clear()
+                self._subscribed.set()
+                while not self._closed.is_set():
+                    message = pubsub.get_message(timeout=0.5)
+                    if message is not None:
+                        self._handle(message)
+                    if time.monotonic() - logged_at > METRICS_LOG_INTERVAL:
+                        log_metrics(self.cache.metrics())
+                        logged_at = time.monotonic()
+            except redis.RedisError:
+                logging.exception("Потеряна подписка на изменения сессий")
+                self._subscribed.clear()
+                self.cache.clear()
+                self._closed.wait(RECONNECT_DELAY)
+            finally:
+                pubsub.close()
+
+    def _handle(self, message: dict) -> None:
+        key = message["channel"][self._prefix_length :]
+        if key.isdigit():
+            self.cache.invalidate(int(key), message["data"].decode())
+
+
+def log_metrics(metrics: CacheMetrics) -> None:
+    logging.info(
+        f"Кэш сессий: {metrics.size} записей, попаданий "
+        f"{metrics.hit_rate:.0%}, вытеснено {metrics.evictions}, "
+        f"устарело {metrics.expirations}, сброшено {metrics.invalidations}"
+    )
+
+
+def start_session_cache(
+    redis_db: redis.Redis, platform: str, max_size: int, ttl: float
+) -> SessionCache | None:
+    """
+    Creates a SessionCache kept up to date by a CacheInvalidator.
+
+    Args:
+        redis_db (Redis): A Redis database client object, the invalidator
+            takes one connection of its pool for good.
+        platform (str): The platform whose sessions are cached.
+        max_size (int): How many sessions are kept, 0 disables the cache.
+        ttl (float): How many seconds a session is kept.
+
+    Returns:
+        SessionCache | None: The cache, or None if it is disabled or Redis
+            does not publish the changes of keys.
+    """
+    if max_size <= 0 or not enable_keyspace_notifications(redis_db):
+        return None
+    cache = SessionCache(max_size, ttl)
+    invalidator = CacheInvalidator(redis_db, cache, platform)
+    invalidator.wait_subscribed(RECONNECT_DELAY * 5)
+    return cache
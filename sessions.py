@@ -0,0 +1,370 @@
+from dataclasses import dataclass
+import logging
+import threading
+
+import redis
+
+from question_bank import QuestionBank
+from settings import setup_settings, load_questions
+
+
+NO_QUESTION_MESSAGE = "Сначала получите вопрос кнопкой «Новый вопрос»."
+TG_PLATFORM = "tg"
+VK_PLATFORM = "vk"
+SESSION_TTL = 7 * 24 * 60 * 60
+COMPACTION_INTERVAL = 60 * 60
+COMPACTION_LOCK_KEY = "lock:compact_sessions"
+COMPACTION_BATCH_SIZE = 1000
+
+
+def get_session_key(platform: str, user_id: int) -> str:
+    """
+    Returns the key of the user's session.
+
+    User ids of Telegram and VK may coincide, so the keys of the bots are
+    namespaced by platform.
+
+    Args:
+        platform (str): TG_PLATFORM or VK_PLATFORM.
+        user_id (int): The id of the user on the messaging platform.
+
+    Returns:
+        str: The key, e.g. "session:tg:42".
+    """
+    return f"session:{platform}:{user_id}"
+
+
+def format_session(fingerprint: str, question_id: int) -> str:
+    """
+    Returns the session value of a question: the fingerprint of the bank
+    and the id of the question in it, e.g. "5f0e9a1c2b3d4e6f:42".
+    """
+    return f"{fingerprint}:{question_id}"
+
+
+def save_question_id(
+    redis_db: redis.Redis,
+    platform: str,
+    user_id: int,
+    questions: QuestionBank,
+    question_id: int,
+    ttl: int = SESSION_TTL,
+) -> None:
+    """
+    Remembers the question the user is currently answering.
+
+    Only the integer id of the question is stored, the text and the answer
+    are looked up in the QuestionBank when needed. The id is stored with the
+    fingerprint of the bank, as a rebuild of the questions may give the id
+    to another question. The session expires after ttl seconds without
+    activity.
+
+    Args:
+        redis_db (Redis): A Redis database client object.
+        platform (str): TG_PLATFORM or VK_PLATFORM.
+        user_id (int): The id of the user on the messaging platform.
+        questions (QuestionBank): The bank of questions and their answers.
+        question_id (int): The id of the question in the QuestionBank.
+        ttl (int): The lifetime of the session in seconds.
+
+    Returns:
+        None
+    """
+    redis_db.set(
+        get_session_key(platform, user_id),
+        format_session(questions.fingerprint, question_id),
+        ex=ttl,
+    )
+
+
+def parse_question_id(
+    value: bytes | None, questions: QuestionBank
+) -> tuple[int | None, bool]:
+    """
+    Converts a stored session value into a question id.
+
+    An id stored for a bank with another fingerprint, or without one by
+    older versions of the bots, can't be trusted to point to the same
+    question, so such a session counts as no session. Sessions written
+    before question ids were introduced hold the full question text. Such
+    values are resolved through the QuestionBank and reported as legacy,
+    so the caller can rewrite them.
+
+    Args:
+        value (bytes | None): The raw value stored in Redis.
+        questions (QuestionBank): The bank of questions and their answers.
+
+    Returns:
+        tuple[int | None, bool]: The question id, or None if the value does
+            not point to a question of the bank, and whether the value was
+            stored in the legacy text format.
+    """
+    if value is None or value.isdigit():
+        return None, False
+    fingerprint, separator, question_id = value.partition(b":")
+    if not separator or not question_id.isdigit():
+        return questions.find_id(value.decode("utf-8")), True
+    if fingerprint.decode("ascii", "replace") != questions.fingerprint:
+        return None, False
+    question_id = int(question_id)
+    if not 0 <= question_id < len(questions):
+        return None, False
+    return question_id, False
+
+
+def load_question_id(
+    redis_db: redis.Redis,
+    platform: str,
+    user_id: int,
+    questions: QuestionBank,
+    ttl: int = SESSION_TTL,
+) -> int | None:
+    """
+    Returns the id of the question the user is currently answering.
+
+    Reading the session prolongs it by ttl seconds. A session written by
+    older versions of the bots under the bare user id, in either format, is
+    moved to the user's key on the first read, so live sessions survive the
+    rollout.
+
+    Args:
+        redis_db (Redis): A Redis database client object.
+        platform (str): TG_PLATFORM or VK_PLATFORM.
+        user_id (int): The id of the user on the messaging platform.
+        questions (QuestionBank): The bank of questions and their answers.
+        ttl (int): The lifetime of the session in seconds.
+
+    Returns:
+        int | None: The question id, or None if the user has no question.
+    """
+    pipeline = redis_db.pipeline(transaction=False)
+    pipeline.getex(get_session_key(platform, user_id), ex=ttl)
+    pipeline.get(user_id)
+    value, legacy_value = pipeline.execute()
+    if value is not None:
+        return parse_question_id(value, questions)[0]
+    question_id = parse_question_id(legacy_value, questions)[0]
+    if question_id is not None:
+        pipeline = redis_db.pipeline(transaction=True)
+        pipeline.set(
+            get_session_key(platform, user_id),
+            format_session(questions.fingerprint, question_id),
+            ex=ttl,
+        )
+        pipeline.delete(user_id)
+        pipeline.execute()
+    return question_id
+
+
+def migrate_sessions(redis_db: redis.Redis, questions: QuestionBank) -> int:
+    """
+    Rewrites all sessions stored in the legacy text format to question ids.
+
+    Legacy sessions are keyed by bare numeric user ids, other keys are left
+    untouched. Sessions whose question is no longer in the bank are removed.
+
+    Args:
+        redis_db (Redis): A Redis database client object.
+        questions (QuestionBank): The bank of questions and their answers.
+
+    Returns:
+        int: The number of migrated sessions.
+    """
+    migrated = 0
+    for key in redis_db.scan_iter(count=COMPACTION_BATCH_SIZE):
+        if not key.isdigit():
+            continue
+        question_id, is_legacy = parse_question_id(
+            redis_db.get(key), questions
+        )
+        if not is_legacy:
+            continue
+        if question_id is None:
+            redis_db.delete(key)
+        else:
+            redis_db.set(
+                key,
+                format_session(questions.fingerprint, question_id),
+                keepttl=True,
+            )
+        migrated += 1
+    return migrated
+
+
+@dataclass
+class CompactionReport:
+    scanned: int = 0
+    deleted: int = 0
+    deleted_bytes: int = 0
+    expiring: int = 0
+    expiring_bytes: int = 0
+
+
+def is_session_key(key: bytes) -> bool:
+    return key.isdigit() or key.startswith(b"session:")
+
+
+def compact_sessions(
+    redis_db: redis.Redis,
+    questions: QuestionBank,
+    ttl: int = SESSION_TTL,
+    batch_size: int = COMPACTION_BATCH_SIZE,
+) -> CompactionReport:
+    """
+    Cleans up the sessions that would otherwise stay in Redis forever.
+
+    Sessions written by the bots expire by themselves. Sessions without an
+    expiry were written by older versions of the bots. Those that do not
+    point to a question of the bank are deleted. The others get the session
+    TTL, so a user who comes back in time keeps the question and the
+    abandoned ones are removed by Redis. Keys are scanned and checked in
+    batches, a pipeline per batch.
+
+    Sizes are the lengths of the keys and the values, without the overhead
+    Redis adds to every key.
+
+    Args:
+        redis_db (Redis): A Redis database client object.
+        questions (QuestionBank): The bank of questions and their answers.
+        ttl (int): The lifetime of the sessions in seconds.
+        batch_size (int): How many keys are checked in one round trip.
+
+    Returns:
+        CompactionReport: How many sessions were scanned, deleted and given
+            a TTL, and their sizes in bytes.
+    """
+    report = CompactionReport()
+    batch = []
+    for key in redis_db.scan_iter(count=batch_size):
+        if is_session_key(key):
+            batch.append(key)
+        if len(batch) == batch_size:
+            compact_batch(redis_db, questions, ttl, batch, report)
+            batch = []
+    if batch:
+        compact_batch(redis_db, questions, ttl, batch, report)
+    return report
+
+
+def compact_batch(
+    redis_db: redis.Redis,
+    questions: QuestionBank,
+    ttl: int,
+    keys: list[bytes],
+    report: CompactionReport,
+) -> None:
+    pipeline = redis_db.pipeline(transaction=False)
+    for key in keys:
+        pipeline.ttl(key)
+        pipeline.get(key)
+    results = pipeline.execute()
+    report.scanned += len(keys)
+    for key, key_ttl, value in zip(keys, results[::2], results[1::2]):
+        # -1 means the key has no expiry, -2 that it is already gone.
+        if key_ttl != -1 or value is None:
+            continue
+        size = len(key) + len(value)
+        if parse_question_id(value, questions)[0] is None:
+            pipeline.delete(key)
+            report.deleted += 1
+            report.deleted_bytes += size
+        else:
+            pipeline.expire(key, ttl)
+            report.expiring += 1
+            report.expiring_bytes += size
+    pipeline.execute()
+
+
+class SessionCompactor:
+    """
+    Background thread that runs compact_sessions every interval seconds.
+
+    All replicas of both bots run a compactor, a lock in Redis lets only one
+    of them compact the sessions in each interval.
+    """
+
+    def __init__(
+        self,
+        redis_db: redis.Redis,
+        questions: QuestionBank,
+        ttl: int = SESSION_TTL,
+        interval: float = COMPACTION_INTERVAL,
+    ) -> None:
+        """
+        Initializes a SessionCompactor instance and starts its thread.
+
+        Args:
+            redis_db (Redis): A Redis database client object.
+            questions (QuestionBank): The bank of questions and their answers.
+            ttl (int): The lifetime of the sessions in seconds.
+            interval (float): How often the sessions are compacted, in
+                seconds.
+
+        Returns:
+            None
+        """
+        self.redis_db = redis_db
+        self.questions = questions
+        self.ttl = ttl
+        self.interval = interval
+        self._closed = threading.Event()
+        self._thread = threading.Thread(
+            target=self._compact_forever, daemon=True
+        )
+        self._thread.start()
+
+    def compact(self) -> CompactionReport | None:
+        """
+        Compacts the sessions unless another replica did it recently.
+
+        Returns:
+            CompactionReport | None: The report, or None if the sessions
+                were compacted by another replica.
+        """
+        if not self.redis_db.set(
+            COMPACTION_LOCK_KEY, 1, nx=True, ex=max(1, int(self.interval))
+        ):
+            return None
+        report = compact_sessions(self.redis_db, self.questions, self.ttl)
+        log_report(report)
+        return report
+
+    def close(self) -> None:
+        self._closed.set()
+        self._thread.join()
+
+    def _compact_forever(self) -> None:
+        while not self._closed.wait(self.interval):
+            try:
+                self.compact()
+            except redis.RedisError:
+                logging.exception("Не удалось очистить сессии")
+
+
+def log_report(report: CompactionReport) -> None:
+    logging.info(
+        f"Проверено сессий: {report.scanned}, удалено {report.deleted} "
+        f"({report.deleted_bytes} байт), поставлено на истечение "
+        f"{report.expiring} ({report.expiring_bytes} байт)"
+    )
+
+
+def main() -> None:
+    """
+    Migrates the legacy sessions of both bots to the question id format and
+    compacts them.
+
+    Running the script is optional, legacy sessions are also migrated
+    lazily when the user answers and compacted by the bots every hour.
+    """
+    logging.basicConfig(level=logging.INFO)
+    settings = setup_settings()
+    redis_db: redis.Redis = redis.from_url(settings["redis_url"])
+    questions = load_questions(settings)
+    migrated = migrate_sessions(redis_db, questions)
+    logging.info(f"Migrated {migrated} sessions")
+    log_report(compact_sessions(redis_db, questions, settings["session_ttl"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,10 @@ import logging
 from pathlib import Path
 
 from environs import Env
+import telegram
 
+from facets import FacetIndex
+from question_bank import MappedQuestionBank, QuestionBank
 from tg_logger import set_telegram_logger
 
 
@@ -15,14 +18,37 @@ def setup_settings() -> dict[str, str | int]:
         - tg_admin_chat_id: int (Telegram chat ID for logs)
         - vk_token: str (VK API token)
         - redis_url: str (URL of the Redis database)
+        - vk_workers: int (Number of threads handling VK messages, 8 by default)
+        - session_ttl: int (Seconds an inactive session is kept in Redis)
+        - session_cache_size: int (Sessions cached in the process, 0 disables the cache)
+        - session_cache_ttl: float (Seconds a session is cached)
+        - metrics_listen: str (Address the metrics server listens on)
+        - metrics_port: int (Port of the metrics server, 0 disables it)
+        - tg_webhook_url: str (Public URL of the Telegram webhook, empty for polling)
+        - tg_webhook_secret: str (Secret token checked on webhook requests)
+        - tg_webhook_listen: str (Address the webhook server listens on)
+        - tg_webhook_port: int (Port the webhook server listens on)
         - questions_json: str (Path to the JSON file containing questions and answers)
+        - questions_bank: str (Path to the binary question bank file)
+        - questions_facets: str (Path to the index of the questions of each tournament and year)
         - raw_questions_path: str (Path to the directory containing raw question files)
+        - questions_cache_path: str (Path to the directory caching parsed question files)
 
     The .env file should be in the following format:
     TG_BOT_TOKEN=<token>
     TG_ADMIN_CHAT_ID=<chat_id>
     VK_TOKEN=<token>
     REDIS_URL=<url>
+    VK_WORKERS=<workers> (optional)
+    SESSION_TTL=<seconds> (optional)
+    SESSION_CACHE_SIZE=<sessions> (optional)
+    SESSION_CACHE_TTL=<seconds> (optional)
+    METRICS_LISTEN=<address> (optional)
+    METRICS_PORT=<port> (optional)
+    TG_WEBHOOK_URL=<url> (optional)
+    TG_WEBHOOK_SECRET=<secret> (required with TG_WEBHOOK_URL)
+    TG_WEBHOOK_LISTEN=<address> (optional)
+    TG_WEBHOOK_PORT=<port> (optional)
     """
     base_dir = Path(__file__).resolve().parent
     env = Env()
@@ -32,12 +58,27 @@ def setup_settings() -> dict[str, str | int]:
         "tg_admin_chat_id": env.int("TG_ADMIN_CHAT_ID"),
         "vk_token": env("VK_TOKEN"),
         "redis_url": env("REDIS_URL"),
+        "vk_workers": env.int("VK_WORKERS", 8),
+        "session_ttl": env.int("SESSION_TTL", 7 * 24 * 60 * 60),
+        "session_cache_size": env.int("SESSION_CACHE_SIZE", 0),
+        "session_cache_ttl": env.float("SESSION_CACHE_TTL", 300.0),
+        "metrics_listen": env("METRICS_LISTEN", "127.0.0.1"),
+        "metrics_port": env.int("METRICS_PORT", 0),
+        "tg_webhook_url": env("TG_WEBHOOK_URL", ""),
+        "tg_webhook_secret": env("TG_WEBHOOK_SECRET", ""),
+        "tg_webhook_listen": env("TG_WEBHOOK_LISTEN", "0.0.0.0"),
+        "tg_webhook_port": env.int("TG_WEBHOOK_PORT", 8443),
         "questions_json": str(base_dir / "questions.json"),
+        "questions_bank": str(base_dir / "questions.bin"),
+        "questions_facets": str(base_dir / "questions.facets"),
         "raw_questions_path": str(base_dir / "questions"),
+        "questions_cache_path": str(base_dir / ".questions_cache"),
     }
 
 
-def setup_logging(settings: dict[str, str | int]) -> logging.Logger:
+def setup_logging(
+    settings: dict[str, str | int], bot: telegram.Bot | None = None
+) -> logging.Logger:
     """
     Configures and returns a logger instance for the application.
 
@@ -48,6 +89,8 @@ def setup_logging(settings: dict[str, str | int]) -> logging.Logger:
     Args:
         settings (dict[str, str | int]): A dictionary containing configuration settings,
                                          including Telegram bot token and admin chat ID.
+        bot (telegram.Bot | None): The bot sending the log records, a new one
+                                   if not given.
 
     Returns:
         logging.Logger: A configured logger instance.
@@ -55,6 +98,7 @@ def setup_logging(settings: dict[str, str | int]) -> logging.Logger:
     logger: logging.Logger = set_telegram_logger(
         bot_token=settings["tg_bot_token"],
         admin_chat_id=settings["tg_admin_chat_id"],
+        bot=bot,
     )
     logging.basicConfig(
         format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -63,16 +107,43 @@ def setup_logging(settings: dict[str, str | int]) -> logging.Logger:
     return logger
 
 
-def load_questions(settings: dict[str, str | int]) -> dict[str, str]:
+def load_questions(settings: dict[str, str | int]) -> QuestionBank:
     """
-    Loads a dictionary of questions and answers from a JSON file.
+    Loads questions and answers into a QuestionBank.
+
+    The binary question bank file is memory-mapped if it exists, so loading
+    is near-instant and questions are decoded only when served. Otherwise
+    the bank is built once from the JSON file with questions and answers.
 
     Args:
         settings (dict[str, str | int]): A dictionary containing configuration settings,
-                                         including the path to the JSON file with questions and answers.
+                                         including the paths to the question bank
+                                         and JSON files.
 
     Returns:
-        dict[str, str]: A dictionary with questions as keys and their corresponding answers as values.
+        QuestionBank: A bank of the questions and their corresponding answers.
     """
+    if Path(settings["questions_bank"]).exists():
+        return MappedQuestionBank(settings["questions_bank"])
     with open(settings["questions_json"], "r", encoding="utf-8") as json_file:
-        return json.load(json_file)
+        return QuestionBank.from_dict(json.load(json_file))
+
+
+def load_facets(
+    settings: dict[str, str | int], questions: QuestionBank
+) -> FacetIndex:
+    """
+    Returns the index of the questions of each tournament and year.
+
+    The index file is mapped along with the bank, and is ignored if it was
+    built for another question bank.
+
+    Args:
+        settings (dict[str, str | int]): A dictionary containing configuration settings,
+                                         including the path to the index file.
+        questions (QuestionBank): The bank the bot serves.
+
+    Returns:
+        FacetIndex: The index of the questions.
+    """
+    return FacetIndex(settings["questions_facets"], questions.fingerprint)
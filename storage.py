@@ -0,0 +1,602 @@
+from collections import Counter
+from collections.abc import Hashable
+from dataclasses import dataclass
+import threading
+import time
+
+import redis
+import redis.asyncio
+
+from facets import FacetIndex, get_selection_key
+from metrics import BotMetrics
+from persistence import (
+    CONVERSATION_NAME,
+    get_conversation_field,
+    get_conversations_key,
+)
+from question_bank import QuestionBank
+from scores import (
+    Outcome,
+    Score,
+    parse_score,
+    queue_outcome,
+    queue_score_request,
+)
+from seen import (
+    SEEN_CANDIDATES,
+    choose_unseen_question,
+    get_seen_key,
+    queue_seen_question,
+    queue_seen_request,
+)
+from session_cache import SessionCache
+from sessions import (
+    SESSION_TTL,
+    format_session,
+    get_session_key,
+    parse_question_id,
+)
+
+
+POOL_SIZE = 16
+POOL_TIMEOUT = 5.0
+SOCKET_TIMEOUT = 2.0
+SOCKET_CONNECT_TIMEOUT = 2.0
+HEALTH_CHECK_INTERVAL = 30
+
+
+def get_pool_options(max_connections: int) -> dict[str, object]:
+    """
+    Returns the options of the connection pools of both bots.
+
+    A handler waits up to POOL_TIMEOUT seconds for a free connection instead
+    of failing when all of them are busy. Every command fails after
+    SOCKET_TIMEOUT seconds instead of hanging a worker on a dead server.
+    Keepalive and health checks drop connections that died while idle, so
+    commands are not retried: retrying a MULTI that timed out could apply
+    it twice.
+
+    Args:
+        max_connections (int): The size of the pool.
+
+    Returns:
+        dict[str, object]: Keyword arguments of ConnectionPool.from_url.
+    """
+    return {
+        "max_connections": max_connections,
+        "timeout": POOL_TIMEOUT,
+        "socket_timeout": SOCKET_TIMEOUT,
+        "socket_connect_timeout": SOCKET_CONNECT_TIMEOUT,
+        "socket_keepalive": True,
+        "health_check_interval": HEALTH_CHECK_INTERVAL,
+    }
+
+
+def connect(redis_url: str, max_connections: int = POOL_SIZE) -> redis.Redis:
+    """
+    Creates a Redis client with a bounded pool of connections.
+
+    Args:
+        redis_url (str): The URL of the Redis database.
+        max_connections (int): The size of the pool, at least the number of
+            threads using the client at the same time.
+
+    Returns:
+        Redis: The Redis client.
+    """
+    pool = redis.BlockingConnectionPool.from_url(
+        redis_url, **get_pool_options(max_connections)
+    )
+    return redis.Redis(connection_pool=pool)
+
+
+def connect_async(
+    redis_url: str, max_connections: int = POOL_SIZE
+) -> redis.asyncio.Redis:
+    """Asynchronous version of connect."""
+    pool = redis.asyncio.BlockingConnectionPool.from_url(
+        redis_url, **get_pool_options(max_connections)
+    )
+    return redis.asyncio.Redis(connection_pool=pool)
+
+
+class RoundTrips:
+    """Counts the round trips to Redis made by each handler."""
+
+    def __init__(self) -> None:
+        self.counts: Counter[str] = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, handler: str) -> None:
+        with self._lock:
+            self.counts[handler] += 1
+
+    def __getitem__(self, handler: str) -> int:
+        return self.counts[handler]
+
+    def snapshot(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self.counts)
+
+
+@dataclass
+class UserRequest:
+    """
+    The Redis data of a user read for one message, and the changes to write
+    back when the message is handled.
+
+    The handlers only read and change the fields, QuizStore sends all the
+    reads of a message in one pipeline and all the writes in another.
+
+    A request for a new question carries the user's seen-set key and the
+    random candidates checked against it, and gets unseen_question_id. The
+    new_question_id the handler sets is then marked as seen. When the
+    store has a FacetIndex, the request also reads the user's selection,
+    and a user who chose a tournament or a year gets a random question of
+    it instead. A handler changes the selection with new_selection, an
+    empty string returns the user to the whole bank.
+    """
+
+    user_id: int
+    platform: str | None = None
+    session_key: str | None = None
+    fingerprint: str | None = None
+    selection_key: str | None = None
+    conversation: str | None = None
+    question_id: int | None = None
+    score: Score | None = None
+    state: int | None = None
+    seen_key: str | None = None
+    candidate_ids: list[int] | None = None
+    unseen_question_id: int | None = None
+    reset_seen: bool = False
+    selection: str | None = None
+    new_question_id: int | None = None
+    outcome: Outcome | None = None
+    new_state: int | None = None
+    new_selection: str | None = None
+    refresh_session: bool = False
+    legacy_session: bool = False
+
+
+def queue_load(
+    pipeline: redis.client.Pipeline,
+    request: UserRequest,
+    conversations_key: str,
+    session_ttl: int,
+    question: bool,
+    score: bool,
+    selection: bool = False,
+) -> None:
+    """
+    Queues the reads of a request on a pipeline.
+
+    Reading the session prolongs it. The bare user id, the key older
+    versions of the bots stored the session under, is read along with it.
+    The candidates of a request for a new question are checked against the
+    user's seen-set. Reading the selection prolongs it like the session.
+
+    Args:
+        pipeline (Pipeline): A Redis pipeline.
+        request (UserRequest): The request to fill.
+        conversations_key (str): The hash of the conversation states.
+        session_ttl (int): The lifetime of the session in seconds.
+        question (bool): Whether to read the current question.
+        score (bool): Whether to read the user's score.
+        selection (bool): Whether to read the user's selection.
+
+    Returns:
+        None
+    """
+    if request.conversation is not None:
+        pipeline.hget(conversations_key, request.conversation)
+    if question:
+        pipeline.getex(request.session_key, ex=session_ttl)
+        pipeline.get(request.user_id)
+    if selection:
+        pipeline.getex(request.selection_key, ex=session_ttl)
+    if request.candidate_ids is not None:
+        queue_seen_request(pipeline, request.seen_key, request.candidate_ids)
+    if score:
+        queue_score_request(pipeline, request.platform, request.user_id)
+
+
+def parse_load(
+    results: list,
+    request: UserRequest,
+    questions: QuestionBank,
+    question: bool,
+    score: bool,
+    facets: FacetIndex | None = None,
+) -> None:
+    """
+    Fills a request with the results of queue_load.
+
+    A session stored under the bare user id or in the legacy text format is
+    rewritten under the session key as an id together with the other writes
+    of the request.
+
+    Args:
+        results (list): The results of the queued commands.
+        request (UserRequest): The request to fill.
+        questions (QuestionBank): The bank of questions and their answers.
+        question (bool): Whether the current question was read.
+        score (bool): Whether the user's score was read.
+        facets (FacetIndex | None): The index the selection was read for,
+            None if it wasn't read.
+
+    Returns:
+        None
+    """
+    results = iter(results)
+    if request.conversation is not None:
+        state = next(results)
+        request.state = None if state is None else int(state)
+    if question:
+        value, legacy_value = next(results), next(results)
+        if value is None and legacy_value is not None:
+            value = legacy_value
+            request.legacy_session = True
+        question_id, is_legacy = parse_question_id(value, questions)
+        request.question_id = question_id
+        if (is_legacy or request.legacy_session) and question_id is not None:
+            request.new_question_id = question_id
+    if facets is not None:
+        selection = next(results)
+        if selection is not None:
+            request.selection = selection.decode("utf-8")
+    if request.candidate_ids is not None:
+        (
+            request.unseen_question_id,
+            request.reset_seen,
+        ) = choose_unseen_question(
+            [next(results) for _ in range(3)],
+            request.candidate_ids,
+            len(questions),
+        )
+    if request.selection:
+        facet, _, value = request.selection.partition("\t")
+        question_id = facets.random_id(facet, value)
+        if question_id is not None:
+            request.unseen_question_id = question_id
+            request.reset_seen = False
+    if score:
+        request.score = parse_score(list(results))
+
+
+def queue_save(
+    pipeline: redis.client.Pipeline,
+    request: UserRequest,
+    conversations_key: str,
+    session_ttl: int,
+) -> bool:
+    """
+    Queues the writes of a request on a pipeline.
+
+    Args:
+        pipeline (Pipeline): A Redis pipeline.
+        request (UserRequest): The handled request.
+        conversations_key (str): The hash of the conversation states.
+        session_ttl (int): The lifetime of the session in seconds.
+
+    Returns:
+        bool: Whether there is anything to write.
+    """
+    queued = False
+    if request.new_question_id is not None:
+        pipeline.set(
+            request.session_key,
+            format_session(request.fingerprint, request.new_question_id),
+            ex=session_ttl,
+        )
+        if request.seen_key is not None:
+            queue_seen_question(
+                pipeline,
+                request.seen_key,
+                request.new_question_id,
+                request.reset_seen,
+                session_ttl,
+            )
+        queued = True
+    elif request.refresh_session:
+        pipeline.expire(request.session_key, session_ttl)
+        queued = True
+    if request.new_selection:
+        pipeline.set(
+            request.selection_key, request.new_selection, ex=session_ttl
+        )
+        queued = True
+    elif request.new_selection is not None:
+        pipeline.delete(request.selection_key)
+        queued = True
+    if request.legacy_session:
+        pipeline.delete(request.user_id)
+        queued = True
+    if request.outcome is not None:
+        queue_outcome(
+            pipeline, request.platform, request.user_id, request.outcome
+        )
+        queued = True
+    if (
+        request.conversation is not None
+        and request.new_state is not None
+        and request.new_state != request.state
+    ):
+        pipeline.hset(
+            conversations_key, request.conversation, request.new_state
+        )
+        queued = True
+    return queued
+
+
+class QuizStore:
+    """
+    Data access of the bots' handlers.
+
+    A handler costs at most two round trips to Redis: one pipeline with all
+    the reads of the message, and one MULTI/EXEC with all its writes. Reads
+    and writes cannot share a round trip, the writes depend on the answer
+    checked between them. Every round trip is counted under the name of
+    the handler.
+
+    With a SessionCache the current question is read from Redis only if it
+    is not cached, and written both to Redis and to the cache. A session
+    taken from the cache is prolonged with the writes of the request.
+
+    With BotMetrics the duration of every round trip is observed under the
+    name of the handler.
+
+    New questions are drawn from the questions the user hasn't seen yet,
+    see seen.py. Checking a few random candidates against the user's
+    seen-set rides on the read pipeline and marking the chosen one rides
+    on the write transaction, so it costs no extra round trips. So does
+    reading the selection of the user, see facets.py: a question of a
+    tournament or a year is picked from the FacetIndex in memory. Questions
+    of a selection are not checked against the seen-set, a user who plays
+    a small tournament for long gets its questions again.
+    """
+
+    def __init__(
+        self,
+        redis_db: redis.Redis,
+        questions: QuestionBank,
+        platform: str,
+        conversation_name: str = CONVERSATION_NAME,
+        cache: SessionCache | None = None,
+        session_ttl: int = SESSION_TTL,
+        bot_metrics: BotMetrics | None = None,
+        facets: FacetIndex | None = None,
+    ) -> None:
+        """
+        Initializes a QuizStore instance.
+
+        Args:
+            redis_db (Redis): A Redis database client object.
+            questions (QuestionBank): The bank of questions and their answers.
+            platform (str): The platform of the bot, which namespaces the
+                session keys.
+            conversation_name (str): The name of the conversation whose
+                states are read with the requests.
+            cache (SessionCache | None): The cache of the current questions,
+                kept up to date by a CacheInvalidator.
+            session_ttl (int): How many seconds a session lives without
+                activity.
+            bot_metrics (BotMetrics | None): The metrics of the bot.
+            facets (FacetIndex | None): The questions of the tournaments and
+                years users can choose, no selections if None.
+
+        Returns:
+            None
+        """
+        self.redis_db = redis_db
+        self.questions = questions
+        self.platform = platform
+        self.conversations_key = get_conversations_key(conversation_name)
+        self.cache = cache
+        self.session_ttl = session_ttl
+        self.round_trips = RoundTrips()
+        self.bot_metrics = bot_metrics
+        self.facets = facets
+
+    def load(
+        self,
+        handler: str,
+        user_id: int,
+        conversation: Hashable | None = None,
+        question: bool = False,
+        score: bool = False,
+        new_question: bool = False,
+    ) -> UserRequest:
+        """
+        Reads the data a handler needs in one round trip.
+
+        Args:
+            handler (str): The name of the handler, for the round trip count.
+            user_id (int): The id of the user on the messaging platform.
+            conversation (Hashable | None): The key of the conversation whose
+                state to read, a tuple of the chat id and the user id.
+            question (bool): Whether to read the current question.
+            score (bool): Whether to read the user's score.
+            new_question (bool): Whether to pick a question the user hasn't
+                seen or one of the user's selection, into
+                unseen_question_id.
+
+        Returns:
+            UserRequest: The request with the data read.
+        """
+        request, question, version = self._prepare_load(
+            user_id, conversation, question, new_question
+        )
+        facets = self.facets if new_question else None
+        pipeline = self.redis_db.pipeline(transaction=False)
+        queue_load(
+            pipeline,
+            request,
+            self.conversations_key,
+            self.session_ttl,
+            question,
+            score,
+            facets is not None,
+        )
+        if len(pipeline):
+            self.round_trips.add(handler)
+            started_at = time.perf_counter()
+            results = pipeline.execute()
+            self._observe(handler, started_at)
+            parse_load(
+                results, request, self.questions, question, score, facets
+            )
+        self._finish_load(request, version)
+        return request
+
+    def save(self, handler: str, request: UserRequest) -> None:
+        """
+        Writes the changes of a request atomically in one round trip.
+
+        Args:
+            handler (str): The name of the handler, for the round trip count.
+            request (UserRequest): The handled request.
+
+        Returns:
+            None
+        """
+        pipeline = self.redis_db.pipeline(transaction=True)
+        if not queue_save(
+            pipeline, request, self.conversations_key, self.session_ttl
+        ):
+            return
+        self.round_trips.add(handler)
+        self._prepare_save(request)
+        started_at = time.perf_counter()
+        try:
+            pipeline.execute()
+        except Exception:
+            self._cancel_save(request)
+            raise
+        finally:
+            self._observe(handler, started_at)
+        self._finish_save(request)
+
+    def _observe(self, handler: str, started_at: float) -> None:
+        if self.bot_metrics is not None:
+            self.bot_metrics.redis_seconds.observe(
+                handler, time.perf_counter() - started_at
+            )
+
+    def _prepare_load(
+        self,
+        user_id: int,
+        conversation: Hashable | None,
+        question: bool,
+        new_question: bool,
+    ) -> tuple[UserRequest, bool, int | None]:
+        """
+        Creates a request, draws the candidates of its new question and
+        takes its current question from the cache.
+
+        Returns:
+            tuple[UserRequest, bool, int | None]: The request, whether the
+                question still has to be read from Redis, and the version of
+                the cache before the read.
+        """
+        request = UserRequest(
+            user_id,
+            platform=self.platform,
+            session_key=get_session_key(self.platform, user_id),
+            fingerprint=self.questions.fingerprint,
+            selection_key=get_selection_key(self.platform, user_id),
+        )
+        if conversation is not None:
+            request.conversation = get_conversation_field(conversation)
+        if new_question:
+            request.seen_key = get_seen_key(
+                self.platform, user_id, self.questions.fingerprint
+            )
+            request.candidate_ids = [
+                self.questions.random_id() for _ in range(SEEN_CANDIDATES)
+            ]
+        if not question or self.cache is None:
+            return request, question, None
+        request.question_id = self.cache.get(user_id)
+        if request.question_id is not None:
+            request.refresh_session = True
+            return request, False, None
+        return request, True, self.cache.version()
+
+    def _finish_load(self, request: UserRequest, version: int | None) -> None:
+        if (
+            version is not None
+            and request.question_id is not None
+            and request.new_question_id is None
+        ):
+            self.cache.put(request.user_id, request.question_id, version)
+
+    def _prepare_save(self, request: UserRequest) -> None:
+        if self.cache is not None and request.new_question_id is not None:
+            self.cache.expect_write(request.user_id)
+
+    def _cancel_save(self, request: UserRequest) -> None:
+        if self.cache is not None and request.new_question_id is not None:
+            self.cache.cancel_write(request.user_id)
+
+    def _finish_save(self, request: UserRequest) -> None:
+        if self.cache is not None and request.new_question_id is not None:
+            self.cache.write(request.user_id, request.new_question_id)
+
+
+class AsyncQuizStore(QuizStore):
+    """Asynchronous version of QuizStore."""
+
+    redis_db: redis.asyncio.Redis
+
+    async def load(
+        self,
+        handler: str,
+        user_id: int,
+        conversation: Hashable | None = None,
+        question: bool = False,
+        score: bool = False,
+        new_question: bool = False,
+    ) -> UserRequest:
+        request, question, version = self._prepare_load(
+            user_id, conversation, question, new_question
+        )
+        facets = self.facets if new_question else None
+        pipeline = self.redis_db.pipeline(transaction=False)
+        queue_load(
+            pipeline,
+            request,
+            self.conversations_key,
+            self.session_ttl,
+            question,
+            score,
+            facets is not None,
+        )
+        if len(pipeline):
+            self.round_trips.add(handler)
+            started_at = time.perf_counter()
+            results = await pipeline.execute()
+            self._observe(handler, started_at)
+            parse_load(
+                results, request, self.questions, question, score, facets
+            )
+        self._finish_load(request, version)
+        return request
+
+    async def save(self, handler: str, request: UserRequest) -> None:
+        pipeline = self.redis_db.pipeline(transaction=True)
+        if not queue_save(
+            pipeline, request, self.conversations_key, self.session_ttl
+        ):
+            return
+        self.round_trips.add(handler)
+        self._prepare_save(request)
+        started_at = time.perf_counter()
+        try:
+            await pipeline.execute()
+        except Exception:
+            self._cancel_save(request)
+            raise
+        finally:
+            self._observe(handler, started_at)
+        self._finish_save(request)
@@ -1,8 +1,16 @@
+import asyncio
+from queue import Queue
 import random
 
+import fakeredis
 import pytest
+from telegram import Bot, User
 from unittest.mock import Mock
 
+from question_bank import QuestionBank
+from sessions import TG_PLATFORM
+from storage import QuizStore
+
 
 @pytest.fixture()
 def mock_update() -> Mock:
@@ -32,47 +40,52 @@ def mock_context() -> Mock:
 
 
 @pytest.fixture()
-def mock_questions() -> dict[str, str]:
+def mock_questions() -> QuestionBank:
     """
-    Provides a mock dictionary of questions and their corresponding answers.
+    Provides a mock bank of questions and their corresponding answers.
 
     This fixture simulates a set of questions and answers for testing purposes,
-    where each question is mapped to its correct answer in the dictionary.
+    where each question id is mapped to its question and correct answer.
 
     Returns:
-        dict[str, str]: A mock dictionary containing questions as keys and answers as values.
+        QuestionBank: A mock bank containing questions and answers.
     """
-    return {
-        "Вопрос 1": "Ответ 1",
-        "Вопрос 2": "Ответ 2",
-        "Вопрос 3": "Ответ 3",
-    }
+    return QuestionBank.from_dict(
+        {
+            "Вопрос 1": "Ответ 1",
+            "Вопрос 2": "Ответ 2",
+            "Вопрос 3": "Ответ 3",
+        }
+    )
 
 
 @pytest.fixture
-def mock_redis_db() -> MockRedis:
+def mock_redis_db() -> fakeredis.FakeRedis:
     """
     Provides a mock Redis database client.
 
-    This fixture simulates a Redis-like database for testing purposes, allowing
-    storage and retrieval of questions based on user IDs. It mimics basic
-    get and set operations to manage questions for different users.
+    This fixture simulates a Redis database in memory for testing purposes,
+    supporting the commands and pipelines the bots use to store sessions
+    and scores.
 
     Returns:
-        MockRedis: An instance of a mock Redis client with get and set methods.
+        FakeRedis: An instance of an in-memory Redis client.
     """
+    return fakeredis.FakeRedis()
 
-    class MockRedis:
-        def __init__(self) -> None:
-            self.data = {}
-
-        def get(self, user_id: int) -> str:
-            return self.data.get(user_id, "No question found")
 
-        def set(self, user_id: int, question: str) -> None:
-            self.data[user_id] = question
+@pytest.fixture()
+def mock_store(
+    mock_redis_db: fakeredis.FakeRedis, mock_questions: QuestionBank
+) -> QuizStore:
+    """
+    Provides the data access of the Telegram bot's handlers over the mock
+    Redis database.
 
-    return MockRedis()
+    Returns:
+        QuizStore: A store counting the round trips of the handlers.
+    """
+    return QuizStore(mock_redis_db, mock_questions, TG_PLATFORM)
 
 
 @pytest.fixture()
@@ -103,6 +116,75 @@ def mock_event() -> Mock:
         Mock: A mock instance of the event object with an integer user ID.
     """
     event: Mock = Mock()
-    user: Mock = Mock(id=random.randint(1, 1000))
-    event.user_id = user
+    event.user_id = random.randint(1, 1000)
     return event
+
+
+class FakeClock:
+    """A clock that shows the time it is set to."""
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class RecordingBot(Bot):
+    """Bot that records sent messages instead of calling the Bot API."""
+
+    def __init__(self) -> None:
+        super().__init__("123:token")
+        self._bot = User(123, "Бот", is_bot=True, username="quiz_bot")
+        self.sent = Queue()
+        self.webhooks = []
+
+    def send_message(self, chat_id, text, *args, **kwargs) -> None:
+        self.sent.put((chat_id, text))
+
+    def set_webhook(self, url, *args, **kwargs) -> bool:
+        self.webhooks.append(url)
+        return True
+
+
+class FakeTelegramApi:
+    """Records sent messages instead of calling the Bot API."""
+
+    def __init__(self, delay: float = 0, updates: list = ()) -> None:
+        self.delay = delay
+        self.sent: list[tuple[int, str]] = []
+        self.updates = list(updates)
+        self.offsets: list[int] = []
+
+    async def get_updates(self, offset: int, timeout: int) -> list[dict]:
+        """
+        Returns the next of the given batches of updates, or raises one
+        given as an exception.
+        """
+        self.offsets.append(offset)
+        if not self.updates:
+            raise ConnectionError("no more updates")
+        updates = self.updates.pop(0)
+        if isinstance(updates, Exception):
+            raise updates
+        return updates
+
+    async def send_message(self, chat_id, text, keyboard=None) -> None:
+        await asyncio.sleep(self.delay)
+        self.sent.append((chat_id, text))
+
+
+def make_update(update_id: int, chat_id: int, text: str) -> dict:
+    """Returns a Telegram update with a text message of a private chat."""
+    message = {
+        "message_id": update_id,
+        "date": 0,
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": "Игрок"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [
+            {"type": "bot_command", "offset": 0, "length": len(text)}
+        ]
+    return {"update_id": update_id, "message": message}
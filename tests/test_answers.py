@@ -0,0 +1,111 @@
+import pytest
+
+from answers import (
+    MAX_ATTEMPT_LENGTH,
+    bounded_edit_distance,
+    is_correct_answer,
+    normalize_answer,
+    parse_accepted_answers,
+    strip_answer_prefix,
+)
+
+
+@pytest.mark.parametrize(
+    "answer, normalized",
+    [
+        ("Ответ:\nБатарея (от battre).", "батарея от battre"),
+        ("Ответ:\nОвен.", "овен"),
+        ("Ответ:\nЁлка. Новогодняя, конечно.", "елка"),
+        ("Ответ 1", "ответ 1"),
+        ('Ответ:\n  "Война  и мир"!', "война и мир"),
+    ],
+)
+def test_normalize_answer(answer: str, normalized: str) -> None:
+    """
+    Tests that the canonical answer is the first sentence without the label,
+    case folded, with "ё" replaced and punctuation and whitespace collapsed.
+    """
+    assert normalize_answer(answer) == normalized
+
+
+def test_strip_answer_prefix_keeps_leading_letters() -> None:
+    """
+    Tests that only the "Ответ:" label is removed, not every leading letter
+    that happens to occur in it.
+    """
+    assert strip_answer_prefix("Ответ:\nОвен.") == "Овен."
+
+
+@pytest.mark.parametrize(
+    "user_answer, is_correct",
+    [
+        ("Овен", True),
+        ("Это ОВЕН!", True),
+        ("Овен.", True),
+        ("Ковен", False),
+        ("", False),
+    ],
+)
+def test_is_correct_answer(user_answer: str, is_correct: bool) -> None:
+    """
+    Tests that the canonical answer has to appear in the user's answer as
+    whole words, ignoring case and punctuation.
+    """
+    assert is_correct_answer(user_answer, ["овен"]) is is_correct
+
+
+@pytest.mark.parametrize(
+    "user_answer, is_correct",
+    [
+        ("Батарея", True),
+        ("баттарея", True),
+        ("это бaтарейка", True),
+        ("аккумулятор", True),
+        ("батон", False),
+        ("акумулятор батарея", True),
+        ("Архимед", False),
+    ],
+)
+def test_is_correct_answer_tolerates_typos_and_alternatives(
+    user_answer: str, is_correct: bool
+) -> None:
+    """
+    Tests that answers with a few typos and alternative answers from the
+    "Зачёт:" field are accepted, while different words are not.
+    """
+    accepted_answers = [
+        "батарея",
+        *parse_accepted_answers("Зачёт: батарейка; Аккумулятор."),
+    ]
+    assert is_correct_answer(user_answer, accepted_answers) is is_correct
+
+
+def test_is_correct_answer_checks_only_the_beginning_of_long_answers() -> None:
+    """
+    Tests that only the first MAX_ATTEMPT_LENGTH characters of an answer are
+    checked.
+    """
+    padding = "а" * MAX_ATTEMPT_LENGTH
+    assert is_correct_answer(f"овен {padding}", ["овен"])
+    assert not is_correct_answer(f"{padding} овен", ["овен"])
+
+
+@pytest.mark.parametrize(
+    "source, target, max_distance, distance",
+    [
+        ("котик", "котик", 2, 0),
+        ("котик", "катик", 2, 1),
+        ("котик", "кот", 2, 2),
+        ("котик", "ко", 2, 3),
+        ("абвгд", "дгвба", 2, 3),
+        ("", "аб", 2, 2),
+    ],
+)
+def test_bounded_edit_distance(
+    source: str, target: str, max_distance: int, distance: int
+) -> None:
+    """
+    Tests that the banded Levenshtein distance is exact within the bound and
+    reports max_distance + 1 beyond it.
+    """
+    assert bounded_edit_distance(source, target, max_distance) == distance
@@ -0,0 +1,64 @@
+import threading
+import time
+
+import pytest
+
+from dispatcher import OrderedWorkerPool
+
+
+def test_tasks_of_one_key_keep_order() -> None:
+    """
+    Tests that the tasks submitted with the same key run in the order they
+    were submitted, even when the earlier tasks are slower.
+    """
+    handled: dict[int, list[int]] = {user_id: [] for user_id in range(10)}
+
+    def handle(user_id: int, message: int) -> None:
+        time.sleep(0.001 * (5 - message))
+        handled[user_id].append(message)
+
+    with OrderedWorkerPool(workers=4) as pool:
+        for message in range(5):
+            for user_id in range(10):
+                pool.submit(user_id, handle, user_id, message)
+
+    assert all(messages == list(range(5)) for messages in handled.values())
+
+
+def test_tasks_of_different_keys_run_in_parallel() -> None:
+    """
+    Tests that a slow task of one user does not hold back the other users.
+    """
+    slow_task_started = threading.Event()
+    release_slow_task = threading.Event()
+    fast_task_done = threading.Event()
+
+    def slow_task() -> None:
+        slow_task_started.set()
+        release_slow_task.wait(timeout=5)
+
+    with OrderedWorkerPool(workers=2) as pool:
+        pool.submit(0, slow_task)
+        slow_task_started.wait(timeout=5)
+        pool.submit(1, fast_task_done.set)
+        assert fast_task_done.wait(timeout=5)
+        release_slow_task.set()
+
+
+def test_failed_task_does_not_stop_the_worker() -> None:
+    """Tests that an exception in a task is logged and the worker goes on."""
+    done = threading.Event()
+
+    def fail() -> None:
+        raise RuntimeError("VK API is down")
+
+    with OrderedWorkerPool(workers=1) as pool:
+        pool.submit(0, fail)
+        pool.submit(0, done.set)
+
+    assert done.is_set()
+
+
+def test_workers_must_be_positive() -> None:
+    with pytest.raises(ValueError):
+        OrderedWorkerPool(workers=0)
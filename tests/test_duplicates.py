@@ -0,0 +1,62 @@
+import io
+from pathlib import Path
+
+from duplicates import merge_duplicates, normalize_question, question_digest
+from pack_parser import QuestionRecord
+
+
+def make_record(question: str, answer: str, line: int) -> QuestionRecord:
+    """Returns a record of the question with its digest."""
+    return QuestionRecord(
+        question, answer, line, digest=question_digest(question)
+    )
+
+
+def test_normalize_question() -> None:
+    """
+    Tests that the same question in different packs is normalized to the
+    same text, and different questions are not.
+    """
+    key = "кто это еж".encode("cp1251")
+    assert normalize_question("Вопрос 12:\nКто  это? Ёж!\n") == key
+    assert normalize_question(" вопрос 3.\tКТО ЭТО ЕЖ") == key
+    assert normalize_question("Вопрос:\nКто\nэто... «ёж»?") == key
+    assert normalize_question("Вопрос 1:\nΩ, ω и ω?") == b"937 969 \xe8 969"
+    assert question_digest("Вопрос 12:\nКто это?") != question_digest(
+        "Вопрос 12:\nЧто это?"
+    )
+
+
+def test_merge_duplicates() -> None:
+    """
+    Tests that duplicates across packs are merged and reported.
+
+    Asserts:
+        - A duplicate replaces the question it repeats with its answer and
+          takes its place.
+        - Every merged duplicate is reported with both locations.
+    """
+    report = io.StringIO()
+    file_records = [
+        (
+            Path("a.txt"),
+            [
+                make_record("Вопрос 1:\nКто это?", "Ответ:\nЁж.", 1),
+                make_record("Вопрос 2:\nЧто это?", "Ответ:\nДом.", 7),
+            ],
+        ),
+        (
+            Path("b.txt"),
+            [make_record("Вопрос 12:\nКто  это", "Ответ:\nЕж.", 4)],
+        ),
+    ]
+
+    questions_and_answers, merged = merge_duplicates(file_records, report)
+
+    assert questions_and_answers == {
+        "Вопрос 12:\nКто  это": ("Ответ:\nЕж.", ""),
+        "Вопрос 2:\nЧто это?": ("Ответ:\nДом.", ""),
+    }
+    assert list(questions_and_answers)[0] == "Вопрос 12:\nКто  это"
+    assert merged == 1
+    assert report.getvalue() == "b.txt:4 повторяет a.txt:1\n"
@@ -0,0 +1,198 @@
+from pathlib import Path
+
+import fakeredis
+import pytest
+
+from duplicates import merge_duplicates, question_digest
+from facets import (
+    TOURNAMENT_FACET,
+    YEAR_FACET,
+    FacetIndex,
+    FacetIndexBuilder,
+    get_selection_key,
+    write_facet_index,
+)
+from pack_parser import QuestionRecord
+from question_bank import QuestionBank
+from quiz import choose_selection
+from sessions import TG_PLATFORM
+from storage import QuizStore
+
+
+def make_record(question: str, championship: str, date: str) -> QuestionRecord:
+    """Returns a record of a question with its pack headers."""
+    return QuestionRecord(
+        question,
+        "Ответ:\nДа.",
+        1,
+        championship=championship,
+        date=date,
+        digest=question_digest(question),
+    )
+
+
+@pytest.fixture()
+def facet_questions(tmp_path: Path) -> QuestionBank:
+    """
+    Provides a bank of five questions, with their index written to
+    "questions.facets" in tmp_path: the first three of "Кубок города" of
+    2005, the last two of "Кубок мира" of 2010, and the third one repeated
+    in "Кубок мира".
+    """
+    builder = FacetIndexBuilder()
+    records = [
+        make_record("Вопрос 1:\nПервый.", "Кубок  города", "07-May-2005"),
+        make_record("Вопрос 2:\nВторой.", "Кубок  города", "07-May-2005"),
+        make_record("Вопрос 3:\nТретий.", "Кубок  города", "07-May-2005"),
+        make_record("Вопрос 1:\nЧетвёртый.", "Кубок мира", "2010"),
+        make_record("Вопрос 2:\nТретий.", "Кубок мира", "2010"),
+        make_record("Вопрос 3:\nПятый.", "Кубок мира", ""),
+    ]
+    questions_and_answers, merged = merge_duplicates(
+        [(Path("a.txt"), records[:3]), (Path("b.txt"), records[3:])],
+        facets=builder,
+    )
+    assert merged == 1
+    bank = QuestionBank.from_dict(
+        {
+            question: answer
+            for question, (answer, _) in questions_and_answers.items()
+        }
+    )
+    write_facet_index(tmp_path / "questions.facets", builder, bank.fingerprint)
+    return bank
+
+
+@pytest.fixture()
+def facet_index(facet_questions: QuestionBank, tmp_path: Path) -> FacetIndex:
+    """Provides the index of facet_questions."""
+    return FacetIndex(
+        tmp_path / "questions.facets", facet_questions.fingerprint
+    )
+
+
+def test_facet_index_roundtrip(facet_index: FacetIndex) -> None:
+    """
+    Tests that the questions of each tournament and year are read back
+    from the facet index file.
+
+    Asserts:
+        - The whitespace of the tournament names is collapsed and the years
+          are taken from the dates.
+        - A merged question belongs to the tournaments of all its packs.
+        - Random questions are drawn only from the selection.
+    """
+    assert facet_index.values(TOURNAMENT_FACET) == [
+        "Кубок города",
+        "Кубок мира",
+    ]
+    assert facet_index.values(YEAR_FACET) == ["2005", "2010"]
+    assert facet_index.count(TOURNAMENT_FACET, "Кубок мира") == 3
+    assert facet_index.count(YEAR_FACET, "2010") == 2
+    drawn = {
+        facet_index.random_id(TOURNAMENT_FACET, "Кубок мира")
+        for _ in range(100)
+    }
+    assert drawn == {2, 3, 4}
+    assert facet_index.random_id(YEAR_FACET, "1999") is None
+
+
+def test_find_values(facet_index: FacetIndex) -> None:
+    """Tests that values are found by a part, and an exact match wins."""
+    assert facet_index.find_values(TOURNAMENT_FACET, "кубок") == [
+        "Кубок города",
+        "Кубок мира",
+    ]
+    assert facet_index.find_values(TOURNAMENT_FACET, "МИРА") == ["Кубок мира"]
+    assert facet_index.find_values(YEAR_FACET, "2005") == ["2005"]
+
+
+def test_index_of_another_bank_is_ignored(
+    facet_index: FacetIndex, tmp_path: Path
+) -> None:
+    """
+    Tests that a bot doesn't pick questions from an index built for another
+    question bank or from a missing one, and picks up the index of its bank
+    once it is written.
+    """
+    rebuilt = QuestionBank.from_dict({"Вопрос 3:\nТретий.": "Да."})
+    index = FacetIndex(facet_index.path, rebuilt.fingerprint)
+    missing = FacetIndex(tmp_path / "missing", facet_index.fingerprint)
+
+    assert index.values(TOURNAMENT_FACET) == []
+    assert missing.values(YEAR_FACET) == []
+
+    builder = FacetIndexBuilder()
+    builder.add(0, make_record("Вопрос 3:\nТретий.", "Кубок мира", ""))
+    write_facet_index(facet_index.path, builder, rebuilt.fingerprint)
+
+    assert index.values(TOURNAMENT_FACET) == ["Кубок мира"]
+    assert index.random_id(TOURNAMENT_FACET, "Кубок мира") == 0
+
+
+def test_new_questions_come_from_the_selection(
+    facet_questions: QuestionBank,
+    facet_index: FacetIndex,
+    mock_redis_db: fakeredis.FakeRedis,
+) -> None:
+    """
+    Tests that a user who chose a tournament gets only its questions until
+    they choose all the questions again.
+
+    Asserts:
+        - The selection is saved with the session lifetime.
+        - A new question still costs one round trip for reads.
+        - "/all" removes the selection.
+    """
+    store = QuizStore(
+        mock_redis_db, facet_questions, TG_PLATFORM, facets=facet_index
+    )
+    selection, _ = choose_selection(facet_index, "/tournament мира")
+    request = store.load("selection", 7)
+    request.new_selection = selection
+    store.save("selection", request)
+
+    question_ids = set()
+    for _ in range(20):
+        request = store.load("new_question", 7, new_question=True)
+        question_ids.add(request.unseen_question_id)
+
+    assert question_ids <= {2, 3, 4}
+    assert store.round_trips["new_question"] == 20
+    assert mock_redis_db.ttl(get_selection_key(TG_PLATFORM, 7)) > 0
+
+    selection, _ = choose_selection(facet_index, "/all")
+    request = store.load("selection", 7)
+    request.new_selection = selection
+    store.save("selection", request)
+
+    assert not mock_redis_db.exists(get_selection_key(TG_PLATFORM, 7))
+
+
+@pytest.mark.parametrize(
+    "text, selection",
+    [
+        ("/tournament Кубок", None),
+        ("/tournament@quizbot города", "tournament\tКубок города"),
+        ("/tournament чемпионат", None),
+        ("/year", None),
+        ("/year 2010", "year\t2010"),
+        ("/all", ""),
+    ],
+)
+def test_choose_selection(
+    facet_index: FacetIndex, text: str, selection: str | None
+) -> None:
+    """
+    Tests that a selection command changes the selection only when it
+    names exactly one tournament or year.
+    """
+    assert choose_selection(facet_index, text)[0] == selection
+
+
+def test_ambiguous_year_lists_years(facet_index: FacetIndex) -> None:
+    """Tests that a year matching several years asks to choose a year."""
+    selection, reply = choose_selection(facet_index, "/year 20")
+
+    assert selection is None
+    assert reply == "Подходит несколько лет, уточните:\n2005\n2010"
@@ -0,0 +1,17 @@
+import pytest
+
+from benchmarks.load_test import BOTS, run_load
+
+
+@pytest.mark.parametrize("bot", BOTS)
+def test_every_message_is_answered(bot: str) -> None:
+    """
+    Tests that the load test drives every bot against the fake backends
+    and that every simulated message gets its replies.
+    """
+    report = run_load(bot, users=20, rounds=2)
+
+    messages_per_user = 4 if bot == "vk" else 5
+    assert report.timeouts == 0
+    assert report.messages == 20 * messages_per_user
+    assert report.percentile(50) <= report.percentile(99)
@@ -0,0 +1,135 @@
+from http.client import HTTPConnection
+import threading
+
+import pytest
+
+from metrics import (
+    BotMetrics,
+    Gauge,
+    Histogram,
+    MetricsRegistry,
+    MetricsServer,
+)
+from outbound import OutboundScheduler
+from question_bank import QuestionBank
+from sessions import TG_PLATFORM, save_question_id
+from storage import QuizStore
+from tg_bot import handle_solution_attempt
+
+
+def test_histogram_renders_cumulative_buckets() -> None:
+    """Tests that the buckets are rendered cumulatively in the text format."""
+    histogram = Histogram(
+        "latency_seconds", "Latency.", "handler", buckets=(0.001, 0.01)
+    )
+    histogram.observe("start", 0.005)
+    histogram.observe("start", 2.0)
+
+    assert histogram.render() == [
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{handler="start",le="0.001"} 0',
+        'latency_seconds_bucket{handler="start",le="0.01"} 1',
+        'latency_seconds_bucket{handler="start",le="+Inf"} 2',
+        'latency_seconds_sum{handler="start"} 2.005',
+        'latency_seconds_count{handler="start"} 2',
+    ]
+
+
+def test_instrument_observes_failed_handlers() -> None:
+    """
+    Tests that an instrumented handler returns the result of the handler,
+    and that a handler raising an error is observed too.
+    """
+    bot_metrics = BotMetrics()
+
+    def fail() -> None:
+        raise ValueError
+
+    assert bot_metrics.instrument("double", lambda x: 2 * x)(2) == 4
+    with pytest.raises(ValueError):
+        bot_metrics.instrument("fail", fail)()
+
+    assert bot_metrics.handler_seconds.count("double") == 1
+    assert bot_metrics.handler_seconds.count("fail") == 1
+
+
+def test_store_observes_round_trips(
+    mock_update, mock_context, mock_questions: QuestionBank, mock_redis_db
+) -> None:
+    """Tests that every round trip to Redis is timed under its handler."""
+    bot_metrics = BotMetrics()
+    store = QuizStore(
+        mock_redis_db, mock_questions, TG_PLATFORM, bot_metrics=bot_metrics
+    )
+    save_question_id(
+        mock_redis_db,
+        TG_PLATFORM,
+        mock_update.effective_user.id,
+        mock_questions,
+        0,
+    )
+    mock_update.message.text = "Ответ 1"
+
+    handle_solution_attempt(mock_update, mock_context, mock_questions, store)
+
+    assert bot_metrics.redis_seconds.count("handle_solution_attempt") == 2
+
+
+def test_scheduler_counts_errors() -> None:
+    """Tests that the API calls are timed and their errors counted."""
+    bot_metrics = BotMetrics()
+    attempts = []
+
+    def flood() -> None:
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise TimeoutError
+
+    def fail() -> None:
+        raise ValueError
+
+    with OutboundScheduler(
+        100,
+        100,
+        get_retry_after=lambda error: (
+            0.01 if isinstance(error, TimeoutError) else None
+        ),
+        bot_metrics=bot_metrics,
+    ) as scheduler:
+        scheduler.submit(1, flood)
+        scheduler.submit(2, fail)
+
+    assert bot_metrics.outbound_seconds.count() == 3
+    assert bot_metrics.outbound_errors.get("retried") == 1
+    assert bot_metrics.outbound_errors.get("failed") == 1
+
+
+def test_server_serves_metrics() -> None:
+    """
+    Tests that the metrics are served on /metrics, skipping a gauge whose
+    source fails, and that other paths are not found.
+    """
+    bot_metrics = BotMetrics(MetricsRegistry())
+    bot_metrics.updates.inc()
+    bot_metrics.watch_queue("outbound", lambda: 3)
+    bot_metrics.registry.register(Gauge("broken", "Broken.", lambda: 1 / 0))
+    server = MetricsServer(("127.0.0.1", 0), bot_metrics.registry)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    connection = HTTPConnection(*server.server_address)
+    connection.request("GET", "/metrics")
+    response = connection.getresponse()
+    body = response.read().decode()
+    connection.request("GET", "/other")
+    other_status = connection.getresponse().status
+    connection.close()
+    server.shutdown()
+    server.server_close()
+
+    assert response.status == 200
+    assert response.headers["Content-Type"].startswith("text/plain")
+    assert "quiz_updates_total 1\n" in body
+    assert 'quiz_queue_depth{queue="outbound"} 3\n' in body
+    assert "broken" not in body
+    assert other_status == 404
@@ -0,0 +1,105 @@
+import threading
+import time
+
+import pytest
+
+from outbound import ChatBuckets, OutboundScheduler, Priority, TokenBucket
+from tests.conftest import FakeClock
+
+
+class SlowDown(Exception):
+    pass
+
+
+def test_token_bucket_allows_bursts_and_sustained_rate() -> None:
+    """
+    Tests that a full bucket allows a burst of capacity events and then one
+    event per 1 / rate seconds.
+    """
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, capacity=2, clock=clock)
+
+    assert [bucket.reserve() for _ in range(3)] == [0, 0, 0.5]
+    clock.now = 1.0
+    assert bucket.delay() == 0
+    assert bucket.reserve() == 0
+    assert bucket.delay() == pytest.approx(0.5)
+
+
+def test_chat_buckets_drop_full_buckets() -> None:
+    """Tests that full buckets are dropped once there are many buckets."""
+    buckets = ChatBuckets(rate=1, burst=2, sweep_size=10)
+    buckets.get("busy").reserve()
+    for chat_id in range(20):
+        buckets.get(chat_id)
+
+    assert len(buckets) < 20
+    assert buckets.get("busy").tokens < 2
+
+
+def test_scheduler_limits_chat_rate_and_keeps_order() -> None:
+    """
+    Tests that messages of a chat are sent in order no faster than the chat
+    rate allows.
+    """
+    sent = []
+
+    with OutboundScheduler(rate=1000, chat_rate=20, senders=4) as scheduler:
+        started_at = time.monotonic()
+        for number in range(5):
+            scheduler.submit(1, lambda number=number: sent.append(number))
+    elapsed = time.monotonic() - started_at
+
+    assert sent == list(range(5))
+    assert elapsed >= 0.19
+    assert scheduler.metrics().sent == 5
+
+
+def test_scheduler_sends_answers_before_logs() -> None:
+    """
+    Tests that when several chats wait for the sender, answers go before
+    keyboards and logs.
+    """
+    release = threading.Event()
+    sent = []
+
+    with OutboundScheduler(rate=1000, chat_rate=1000) as scheduler:
+        scheduler.submit("busy", lambda: release.wait(5))
+        scheduler.submit("admin", lambda: sent.append("log"), Priority.LOG)
+        scheduler.submit(1, lambda: sent.append("keyboard"), Priority.KEYBOARD)
+        scheduler.submit(2, lambda: sent.append("answer"), Priority.ANSWER)
+        release.set()
+
+    assert sent == ["answer", "keyboard", "log"]
+
+
+def test_scheduler_retries_after_slow_down() -> None:
+    """
+    Tests that a message rejected with a retry delay is sent again after the
+    delay, while a message failed for another reason is dropped.
+    """
+    attempts = []
+
+    def send() -> None:
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise SlowDown()
+
+    def fail() -> None:
+        raise ValueError("chat not found")
+
+    with OutboundScheduler(
+        rate=1000,
+        chat_rate=1000,
+        get_retry_after=lambda error: (
+            0.1 if isinstance(error, SlowDown) else None
+        ),
+    ) as scheduler:
+        scheduler.submit(1, send)
+        scheduler.submit(2, fail)
+
+    metrics = scheduler.metrics()
+    assert len(attempts) == 2
+    assert attempts[1] - attempts[0] >= 0.09
+    assert (metrics.sent, metrics.retried, metrics.failed) == (1, 1, 1)
+    assert metrics.queued == 0
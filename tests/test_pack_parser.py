@@ -0,0 +1,174 @@
+import io
+import logging
+from pathlib import Path
+
+import pytest
+
+from pack_parser import (
+    SAMPLE_SIZE,
+    ParseIssue,
+    QuestionRecord,
+    detect_encoding,
+    iter_paragraph_blocks,
+    iter_records,
+    parse_pack,
+)
+
+
+PACK = (
+    "Чемпионат:\nКубок города\n\nТур:\n1\n\n"
+    "Вопрос 1:\nПервый\nвопрос.\n\nОтвет:\nПервый.\n\nЗачёт:\nОдин.\n\n"
+    "Комментарий:\nПояснение.\n\nИсточник(и):\nКнига.\n\nАвторы:\nКто-то\n\n"
+    "Вопрос 2:\nБез ответа.\n\n"
+    "Вопрос 3:\nТретий.\n\n\n\nОтвет:\nТретий.  \n\n"
+    "Ответ:\nЛишний.\n\n"
+    "Тур:\n2\n\n"
+    "Вопрос 4:\nЧетвёртый.\n\nОтвет:\nЧетвёртый.\n\n"
+    "Комментарий:\nТурнир: не заголовок.\n"
+)
+
+
+def test_records_hold_all_fields() -> None:
+    """
+    Tests that every question is paired with its own answer and fields,
+    and that the pack headers apply to the questions after them.
+
+    Asserts:
+        - The question without an answer is skipped, the later answers
+          are not shifted.
+        - The answer without a question is skipped.
+        - Runs of empty lines separate paragraphs like a single one.
+    """
+    records = list(iter_records(io.StringIO(PACK)))
+
+    assert records == [
+        QuestionRecord(
+            question="Вопрос 1:\nПервый\nвопрос.",
+            answer="Ответ:\nПервый.",
+            line=7,
+            accepted="Зачёт:\nОдин.",
+            comment="Комментарий:\nПояснение.",
+            source="Источник(и):\nКнига.",
+            author="Авторы:\nКто-то",
+            championship="Кубок города",
+            tour="1",
+        ),
+        QuestionRecord(
+            question="Вопрос 3:\nТретий.",
+            answer="Ответ:\nТретий.",
+            line=29,
+            championship="Кубок города",
+            tour="1",
+        ),
+        QuestionRecord(
+            question="Вопрос 4:\nЧетвёртый.",
+            answer="Ответ:\nЧетвёртый.",
+            line=43,
+            comment="Комментарий:\nТурнир: не заголовок.",
+            championship="Кубок города",
+            tour="2",
+        ),
+    ]
+
+
+def test_issues_are_reported_with_lines() -> None:
+    """Tests that the skipped paragraphs are reported with their lines."""
+    issues: list[ParseIssue] = []
+
+    list(iter_records(io.StringIO(PACK), issues))
+
+    assert issues == [
+        ParseIssue(26, "вопрос без ответа"),
+        ParseIssue(37, "ответ без вопроса"),
+    ]
+
+
+def test_paragraphs_span_blocks() -> None:
+    """
+    Tests that the paragraphs are the same whatever the block size, when
+    paragraphs and empty lines are cut by the end of a block.
+    """
+    for block_size in [1, 2, 7, 64]:
+        blocks = iter_paragraph_blocks(io.StringIO(PACK), block_size)
+
+        paragraphs = [paragraph for block in blocks for paragraph in block]
+
+        assert paragraphs == PACK.split("\n\n")
+
+
+def test_parse_pack_logs_issues(tmp_path: Path, caplog) -> None:
+    """
+    Tests that a KOI8-R pack with Windows line endings is parsed and its
+    problems are logged with the file and the line.
+    """
+    path = tmp_path / "pack.txt"
+    path.write_bytes(
+        "Вопрос 1:\r\nПервый.\r\n\r\nОтвет:\r\nДа.\r\n\r\nВопрос 2:\r\n"
+        "Второй.\r\n".encode("KOI8-R")
+    )
+
+    with caplog.at_level(logging.WARNING):
+        records = parse_pack(path)
+
+    assert [(record.question, record.answer) for record in records] == [
+        ("Вопрос 1:\nПервый.", "Ответ:\nДа.")
+    ]
+    assert caplog.messages == [f"{path}:7: вопрос без ответа"]
+
+
+@pytest.mark.parametrize(
+    "encoding, detected",
+    [
+        ("koi8-r", "koi8-r"),
+        ("cp1251", "cp1251"),
+        ("utf-8", "utf-8"),
+        ("utf-8-sig", "utf-8-sig"),
+        ("utf-16", "utf-16"),
+        ("cp866", "cp866"),
+    ],
+)
+def test_detect_encoding(encoding: str, detected: str) -> None:
+    """
+    Tests that the encodings of the archive are detected from a prefix of
+    a pack, even when it cuts a character in two.
+    """
+    sample = (PACK * 10).encode(encoding)
+
+    assert detect_encoding(sample[:296]) == detected
+
+
+def test_parse_pack_detects_encoding(tmp_path: Path) -> None:
+    """Tests that a windows-1251 pack is read without garbling."""
+    path = tmp_path / "pack.txt"
+    path.write_bytes(PACK.encode("cp1251"))
+
+    records = parse_pack(path)
+
+    assert records == list(iter_records(io.StringIO(PACK)))
+
+
+def test_undecodable_pack_is_skipped(tmp_path: Path, caplog) -> None:
+    """
+    Tests that a pack that turns out not to be in the detected encoding
+    after the sampled prefix is skipped and logged instead of failing the
+    build.
+    """
+    path = tmp_path / "pack.txt"
+    path.write_bytes(
+        b"\n" * SAMPLE_SIZE + "Вопрос 1:\nПервый.\n".encode("koi8-r")
+    )
+
+    with caplog.at_level(logging.ERROR):
+        records = parse_pack(path)
+
+    assert records == []
+    assert caplog.messages[0].startswith(f"{path}: файл пропущен")
+
+
+def test_date_header_applies_to_questions() -> None:
+    """Tests that the "Дата:" header is kept like the other headers."""
+    pack = "Дата:\n07-May-2005\n\n" + PACK
+
+    records = list(iter_records(io.StringIO(pack)))
+
+    assert {record.date for record in records} == {"07-May-2005"}
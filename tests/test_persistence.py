@@ -0,0 +1,126 @@
+from queue import Queue
+import time
+
+import fakeredis
+from telegram import Update
+from telegram.ext import Dispatcher
+
+from persistence import RedisConversations, RedisPersistence
+from question_bank import QuestionBank
+from quiz import State
+from sessions import TG_PLATFORM
+from storage import QuizStore
+from tests.conftest import RecordingBot, make_update
+from tg_bot import make_conversation_handler
+
+
+def test_writes_are_buffered_and_coalesced() -> None:
+    """
+    Tests that state writes are sent to Redis in one batch on flush, with
+    only the last state of each conversation, and are readable before.
+    """
+    redis_db = fakeredis.FakeRedis()
+    conversations = RedisConversations(redis_db, "quiz", flush_interval=60)
+
+    conversations[(1, 1)] = State.NEW_QUESTION.value
+    conversations[(1, 1)] = State.GUESS_ANSWER.value
+    conversations[(2, 2)] = State.NEW_QUESTION.value
+    del conversations[(2, 2)]
+
+    assert conversations.get((1, 1)) == State.GUESS_ANSWER.value
+    assert (2, 2) not in conversations
+    assert redis_db.hgetall("conversations:quiz") == {}
+    conversations.close()
+    assert redis_db.hgetall("conversations:quiz") == {b"1:1": b"2"}
+
+
+def test_writes_are_readable_while_flushed() -> None:
+    """
+    Tests that a write taken from the buffer is still read from it until
+    Redis has it, instead of the previous state from Redis.
+    """
+    redis_db = fakeredis.FakeRedis()
+    conversations = RedisConversations(redis_db, "quiz", flush_interval=60)
+    conversations[(1, 1)] = State.NEW_QUESTION.value
+    conversations.flush()
+    conversations[(1, 1)] = State.GUESS_ANSWER.value
+    read_while_flushed = []
+    make_pipeline = redis_db.pipeline
+
+    def pipeline(*args, **kwargs):
+        pipeline = make_pipeline(*args, **kwargs)
+        execute = pipeline.execute
+
+        def read_and_execute():
+            read_while_flushed.append(conversations[(1, 1)])
+            return execute()
+
+        pipeline.execute = read_and_execute
+        return pipeline
+
+    redis_db.pipeline = pipeline
+    conversations.close()
+
+    assert read_while_flushed == [State.GUESS_ANSWER.value]
+    assert conversations[(1, 1)] == State.GUESS_ANSWER.value
+
+
+def test_replicas_share_states() -> None:
+    """
+    Tests that a state written by one replica is read by another one once
+    the flusher has sent it.
+    """
+    server = fakeredis.FakeServer()
+    replica = RedisConversations(
+        fakeredis.FakeRedis(server=server), "quiz", flush_interval=0.01
+    )
+    other_replica = RedisConversations(
+        fakeredis.FakeRedis(server=server), "quiz", flush_interval=0.01
+    )
+
+    replica[(5, 7)] = State.GUESS_ANSWER.value
+    time.sleep(0.1)
+
+    assert other_replica.get((5, 7)) == State.GUESS_ANSWER.value
+    assert list(other_replica) == [(5, 7)]
+    replica.close()
+    other_replica.close()
+
+
+def test_conversation_survives_restart(
+    mock_questions: QuestionBank, mock_redis_db: fakeredis.FakeRedis
+) -> None:
+    """
+    Tests that a conversation started before a restart goes on after it:
+    the new dispatcher knows the user asked for a question.
+    """
+
+    def start_replica() -> tuple[Dispatcher, RecordingBot]:
+        bot = RecordingBot()
+        dispatcher = Dispatcher(
+            bot,
+            Queue(),
+            workers=1,
+            persistence=RedisPersistence(mock_redis_db),
+        )
+        dispatcher.add_handler(
+            make_conversation_handler(
+                mock_questions,
+                QuizStore(mock_redis_db, mock_questions, TG_PLATFORM),
+                persistent=True,
+            )
+        )
+        return dispatcher, bot
+
+    dispatcher, bot = start_replica()
+    for update_id, text in enumerate(["/start", "Новый вопрос"], 1):
+        update = Update.de_json(make_update(update_id, 3, text), bot)
+        dispatcher.process_update(update)
+    dispatcher.persistence.flush()
+
+    dispatcher, bot = start_replica()
+    update = Update.de_json(make_update(3, 3, "Сдаться"), bot)
+    dispatcher.process_update(update)
+
+    assert bot.sent.get_nowait()[1].startswith("Правильный ответ: ")
+    assert bot.sent.get_nowait()[1] == "Напряги извилины"
@@ -0,0 +1,170 @@
+from pathlib import Path
+
+import pytest
+
+from prepare_questions import (
+    BuildCache,
+    build_question_answer_pairs,
+    build_question_answer_pairs_incrementally,
+    parse_file,
+)
+
+
+PACKS = [
+    "Чемпионат:\nТестовый\n\nВопрос 1:\nПервый\nвопрос.\n\nОтвет:\nПервый.\n\n\n"
+    "Вопрос 2:\nВторой вопрос.\n  \nОтвет:\nВторой.\n\nАвтор:\nКто-то\n",
+    "Вопрос 1:\nБез ответа.\n\n\n\nВопрос 2:\nВторой вопрос.\n\nОтвет:\nОпять.",
+    "\r\n\r\nВопрос 3:\r\nС переводами строк Windows.\r\n\r\nОтвет:\r\nДа.\r\n",
+]
+
+
+# The questions and answers of PACKS. The questions without an answer are
+# skipped, as is the one whose answer follows a whitespace-only line instead
+# of an empty one, and the repeated question keeps the answer of the later
+# pack.
+EXPECTED = {
+    "Вопрос 1:\nПервый\nвопрос.": "Ответ:\nПервый.",
+    "Вопрос 2:\nВторой вопрос.": "Ответ:\nОпять.",
+    "Вопрос 3:\nС переводами строк Windows.": "Ответ:\nДа.",
+}
+
+
+def expected_for(files: list[Path]) -> dict[str, str]:
+    """Returns the expected questions and answers of the current packs."""
+    return strip_accepted(build_question_answer_pairs(files))
+
+
+def strip_accepted(
+    questions_and_answers: dict[str, tuple[str, str]]
+) -> dict[str, str]:
+    """Drops the "Зачёт:" paragraphs from built questions and answers."""
+    return {
+        question: answer
+        for question, (answer, _) in questions_and_answers.items()
+    }
+
+
+@pytest.fixture()
+def pack_files(tmp_path: Path) -> list[Path]:
+    """
+    Writes question packs in the KOI8-R encoding to a temporary directory.
+
+    The packs include a question without an answer, whitespace-only lines,
+    repeated questions and Windows line endings.
+
+    Returns:
+        list[Path]: Paths to the written files.
+    """
+    files = []
+    for number, pack in enumerate(PACKS):
+        path = tmp_path / f"pack{number}.txt"
+        path.write_bytes(pack.encode("KOI8-R"))
+        files.append(path)
+    return files
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_build_question_answer_pairs(
+    pack_files: list[Path], workers: int
+) -> None:
+    """
+    Tests that every question is paired with its own answer, however many
+    workers parse the files.
+
+    Asserts:
+        - A question without an answer doesn't shift the later answers.
+        - Keys, values and their order are as expected.
+    """
+    result = build_question_answer_pairs(pack_files, workers=workers)
+
+    assert list(strip_accepted(result).items()) == list(EXPECTED.items())
+
+
+def test_incremental_build_reparses_only_changed_files(
+    pack_files: list[Path], tmp_path: Path
+) -> None:
+    """
+    Tests that a rebuild reuses cached parse results of unchanged files,
+    picks up changed files and drops questions of deleted files.
+
+    Asserts:
+        - The first build parses every file.
+        - A rebuild without changes parses nothing.
+        - A rebuild after changes parses only the changed file.
+        - Every build matches a full build of the current files.
+    """
+    cache_path = tmp_path / "cache"
+
+    result, parsed, _ = build_question_answer_pairs_incrementally(
+        pack_files, BuildCache(cache_path)
+    )
+    assert parsed == len(pack_files)
+    assert strip_accepted(result) == EXPECTED
+
+    _, parsed, _ = build_question_answer_pairs_incrementally(
+        pack_files, BuildCache(cache_path)
+    )
+    assert parsed == 0
+
+    pack_files[0].write_bytes(
+        "Вопрос 9:\nНовый вопрос.\n\nОтвет:\nНовый.\n".encode("KOI8-R")
+    )
+    pack_files[2].unlink()
+    current_files = pack_files[:2]
+    result, parsed, _ = build_question_answer_pairs_incrementally(
+        current_files, BuildCache(cache_path)
+    )
+    assert parsed == 1
+    assert strip_accepted(result) == expected_for(current_files)
+    assert len(list(cache_path.glob("*.json"))) == len(current_files) + 1
+
+
+def test_accepted_answers_are_attached_to_answers(tmp_path: Path) -> None:
+    """
+    Tests that a "Зачёт:" paragraph is kept with the answer preceding it.
+
+    Asserts:
+        - The answer followed by "Зачёт:" carries it.
+        - Other answers carry an empty string.
+    """
+    path = tmp_path / "pack.txt"
+    path.write_bytes(
+        "Вопрос 1:\nПервый.\n\nОтвет:\nБатарея.\n\nЗачет:\nБатарейка.\n\n"
+        "Вопрос 2:\nВторой.\n\nОтвет:\nВторой.\n".encode("KOI8-R")
+    )
+
+    records = parse_file(path)
+
+    assert [(record.answer, record.accepted) for record in records] == [
+        ("Ответ:\nБатарея.", "Зачет:\nБатарейка."),
+        ("Ответ:\nВторой.", ""),
+    ]
+
+
+def test_incremental_build_detects_encodings(tmp_path: Path) -> None:
+    """
+    Tests that packs of a mixed archive are each read in their own encoding
+    and that the encodings are kept in the manifest.
+    """
+    files = []
+    for encoding in ["koi8-r", "cp1251", "utf-8"]:
+        path = tmp_path / f"{encoding}.txt"
+        path.write_bytes(
+            f"Вопрос:\nВ кодировке {encoding}?\n\nОтвет:\nДа.\n".encode(
+                encoding
+            )
+        )
+        files.append(path)
+    cache = BuildCache(tmp_path / "cache")
+
+    result, _, _ = build_question_answer_pairs_incrementally(files, cache)
+
+    assert list(strip_accepted(result)) == [
+        "Вопрос:\nВ кодировке cp1251?",
+        "Вопрос:\nВ кодировке koi8-r?",
+        "Вопрос:\nВ кодировке utf-8?",
+    ]
+    assert {
+        Path(path).stem: entry["encoding"]
+        for path, entry in BuildCache(tmp_path / "cache").manifest.items()
+    } == {"koi8-r": "koi8-r", "cp1251": "cp1251", "utf-8": "utf-8"}
@@ -0,0 +1,88 @@
+import pytest
+
+from answers import normalize_answer
+from question_bank import MappedQuestionBank, QuestionBank, write_question_bank
+
+
+def test_question_bank_lookup_by_id(mock_questions: QuestionBank) -> None:
+    """
+    Tests that questions and answers are addressed by their position in the
+    source dictionary.
+
+    Asserts:
+        - The bank has as many questions as the dictionary.
+        - The question and answer with the same id belong together.
+        - A question text is resolved back to its id.
+    """
+    assert len(mock_questions) == 3
+    assert mock_questions.question(1) == "Вопрос 2"
+    assert mock_questions.answer(1) == "Ответ 2"
+    assert mock_questions.find_id("Вопрос 3") == 2
+    assert mock_questions.find_id("Вопрос 4") is None
+
+
+def test_question_bank_random_id(mock_questions: QuestionBank) -> None:
+    """
+    Tests that random ids always point to an existing question and that
+    sampling an empty bank fails loudly.
+
+    Asserts:
+        - Every sampled id is a valid index.
+        - An empty bank raises IndexError.
+    """
+    for _ in range(100):
+        assert 0 <= mock_questions.random_id() < len(mock_questions)
+    with pytest.raises(IndexError):
+        QuestionBank([], []).random_id()
+
+
+def test_mapped_question_bank_roundtrip(tmp_path) -> None:
+    """
+    Tests that a question bank file maps back to the same questions and
+    answers, including multi-byte text and empty values.
+
+    Asserts:
+        - The mapped bank has the same size and values as the source.
+        - The file stores the fingerprint of the questions.
+        - Out of range ids raise IndexError.
+        - A file of another format is rejected.
+    """
+    questions_and_answers = {
+        "Вопрос 1:\nЧто такое «ёлка»?": "Ответ:\nДерево.",
+        "Question 2": "",
+        "Вопрос 3": "Ответ:\n✓",
+    }
+    path = tmp_path / "questions.bin"
+    fingerprint = write_question_bank(
+        path,
+        [
+            (question, answer, normalize_answer(answer), "")
+            for question, answer in questions_and_answers.items()
+        ],
+    )
+
+    questions = MappedQuestionBank(path)
+
+    assert len(questions) == 3
+    assert questions.fingerprint == fingerprint
+    assert (
+        fingerprint
+        == QuestionBank.from_dict(questions_and_answers).fingerprint
+    )
+    for question_id, (question, answer) in enumerate(
+        questions_and_answers.items()
+    ):
+        assert questions.question(question_id) == question
+        assert questions.answer(question_id) == answer
+        assert questions.normalized_answer(question_id) == normalize_answer(
+            answer
+        )
+    assert questions.find_id("Вопрос 3") == 2
+    assert questions.accepted_answers(0) == ["дерево"]
+    with pytest.raises(IndexError):
+        questions.question(3)
+    questions.close()
+
+    (tmp_path / "questions.json").write_text("{}")
+    with pytest.raises(ValueError):
+        MappedQuestionBank(tmp_path / "questions.json")
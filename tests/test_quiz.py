@@ -0,0 +1,42 @@
+import pytest
+
+from quiz import Action, State, get_possible_actions, route_message
+
+
+@pytest.mark.parametrize(
+    "text, state, action",
+    [
+        ("/start", None, Action.START),
+        ("/start@quizbot", State.GUESS_ANSWER, Action.START),
+        ("/year 2005", None, Action.CHOOSE_SELECTION),
+        ("/all", State.GUESS_ANSWER, Action.CHOOSE_SELECTION),
+        ("Новый вопрос", None, None),
+        ("/cancel", None, None),
+        ("/cancel", State.NEW_QUESTION, Action.CANCEL),
+        ("/help", State.GUESS_ANSWER, None),
+        ("Мой счёт", State.NEW_QUESTION, Action.SHOW_SCORE),
+        ("Мой счёт", State.GUESS_ANSWER, Action.SHOW_SCORE),
+        ("Новый вопрос", State.NEW_QUESTION, Action.NEW_QUESTION),
+        ("Новый вопрос", State.GUESS_ANSWER, Action.ATTEMPT),
+        ("Сдаться", State.GUESS_ANSWER, Action.ATTEMPT),
+        ("Сдаться", State.NEW_QUESTION, None),
+    ],
+)
+def test_route_message(
+    text: str, state: State | None, action: Action | None
+) -> None:
+    """Tests which action a message leads to in each state."""
+    assert route_message(text, state) is action
+
+
+def test_possible_actions() -> None:
+    """
+    Tests that the data of every action a message may lead to is read
+    before the state is known.
+    """
+    assert get_possible_actions("Новый вопрос") == {
+        Action.NEW_QUESTION,
+        Action.ATTEMPT,
+    }
+    assert get_possible_actions("Мой счёт") == {Action.SHOW_SCORE}
+    assert get_possible_actions("/help") == set()
@@ -0,0 +1,79 @@
+import fakeredis
+
+from scores import (
+    LEADERBOARD_KEY,
+    Outcome,
+    Score,
+    format_score,
+    get_score,
+    record_outcome,
+)
+from sessions import TG_PLATFORM, VK_PLATFORM
+
+
+def test_record_outcome_updates_counters_and_leaderboard(
+    mock_redis_db: fakeredis.FakeRedis,
+) -> None:
+    """
+    Tests that answers update the user's counters, streak and leaderboard.
+
+    Asserts:
+        - Correct and wrong answers count as attempts, giving up does not.
+        - Wrong answers and giving up reset the streak of correct answers.
+        - Users are ranked by the number of correct answers.
+        - Users without correct answers have no rank.
+    """
+    for outcome in [
+        Outcome.CORRECT,
+        Outcome.WRONG,
+        Outcome.CORRECT,
+        Outcome.GAVE_UP,
+        Outcome.CORRECT,
+    ]:
+        record_outcome(mock_redis_db, TG_PLATFORM, 1, outcome)
+    record_outcome(mock_redis_db, TG_PLATFORM, 2, Outcome.CORRECT)
+    record_outcome(mock_redis_db, TG_PLATFORM, 3, Outcome.WRONG)
+    for outcome in [Outcome.CORRECT, Outcome.CORRECT, Outcome.WRONG]:
+        record_outcome(mock_redis_db, TG_PLATFORM, 5, outcome)
+
+    assert get_score(mock_redis_db, TG_PLATFORM, 1) == Score(
+        correct=3, given_up=1, attempts=4, streak=1, rank=1, players=3
+    )
+    assert get_score(mock_redis_db, TG_PLATFORM, 2).rank == 3
+    assert get_score(mock_redis_db, TG_PLATFORM, 3) == Score(
+        attempts=1, players=3
+    )
+    assert get_score(mock_redis_db, TG_PLATFORM, 4) == Score(players=3)
+    assert get_score(mock_redis_db, TG_PLATFORM, 5) == Score(
+        correct=2, attempts=3, streak=0, rank=2, players=3
+    )
+
+
+def test_platforms_have_separate_scores(
+    mock_redis_db: fakeredis.FakeRedis,
+) -> None:
+    """
+    Tests that a Telegram user and a VK user with the same id have scores
+    and leaderboard entries of their own.
+    """
+    record_outcome(mock_redis_db, TG_PLATFORM, 42, Outcome.CORRECT)
+    record_outcome(mock_redis_db, TG_PLATFORM, 42, Outcome.CORRECT)
+    record_outcome(mock_redis_db, VK_PLATFORM, 42, Outcome.CORRECT)
+
+    assert get_score(mock_redis_db, TG_PLATFORM, 42) == Score(
+        correct=2, attempts=2, streak=2, rank=1, players=2
+    )
+    assert get_score(mock_redis_db, VK_PLATFORM, 42) == Score(
+        correct=1, attempts=1, streak=1, rank=2, players=2
+    )
+    assert mock_redis_db.zrange(LEADERBOARD_KEY, 0, -1) == [b"vk:42", b"tg:42"]
+
+
+def test_format_score() -> None:
+    """
+    Tests that the score message shows the rank or its absence.
+    """
+    assert "Место в рейтинге: 2 из 5" in format_score(
+        Score(correct=3, rank=2, players=5)
+    )
+    assert "пока нет в рейтинге" in format_score(Score())
@@ -0,0 +1,113 @@
+import asyncio
+import math
+
+import fakeredis
+
+from question_bank import QuestionBank
+from seen import SEEN_CANDIDATES, get_seen_key
+from sessions import SESSION_TTL, TG_PLATFORM
+from storage import AsyncQuizStore, QuizStore
+
+
+def make_bank(size: int) -> QuestionBank:
+    """Returns a bank of the given number of questions."""
+    return QuestionBank.from_dict(
+        {f"Вопрос {number}": f"Ответ {number}" for number in range(size)}
+    )
+
+
+def get_new_question(store: QuizStore, user_id: int) -> int:
+    """Gives the user a new question the way the handlers do."""
+    request = store.load("handler", user_id, new_question=True)
+    request.new_question_id = request.unseen_question_id
+    store.save("handler", request)
+    return request.new_question_id
+
+
+def test_questions_do_not_repeat_until_exhausted(
+    mock_redis_db: fakeredis.FakeRedis,
+) -> None:
+    """
+    Tests that a user gets every question of the bank once before any of
+    them repeats, and that the seen-set starts over after that.
+
+    Asserts:
+        - Every question is given once, also when all the random
+          candidates were seen already.
+        - The question after the last one starts a new seen-set.
+        - Every question costs one round trip for reads and one for writes.
+    """
+    bank = make_bank(50)
+    store = QuizStore(mock_redis_db, bank, TG_PLATFORM)
+
+    question_ids = [get_new_question(store, 7) for _ in range(len(bank))]
+    next_question_id = get_new_question(store, 7)
+
+    assert sorted(question_ids) == list(range(len(bank)))
+    seen_key = get_seen_key(TG_PLATFORM, 7, bank.fingerprint)
+    assert mock_redis_db.bitcount(seen_key) == 1
+    assert mock_redis_db.getbit(seen_key, next_question_id) == 1
+    assert store.round_trips["handler"] == 2 * (len(bank) + 1)
+
+
+def test_seen_set_is_bounded(mock_redis_db: fakeredis.FakeRedis) -> None:
+    """
+    Tests that a seen-set takes at most a bit per question and expires
+    with the session.
+    """
+    bank = make_bank(1000)
+    store = QuizStore(mock_redis_db, bank, TG_PLATFORM)
+
+    for _ in range(3 * SEEN_CANDIDATES):
+        get_new_question(store, 7)
+
+    seen_key = get_seen_key(TG_PLATFORM, 7, bank.fingerprint)
+    assert mock_redis_db.strlen(seen_key) <= math.ceil(len(bank) / 8)
+    assert 0 < mock_redis_db.ttl(seen_key) <= SESSION_TTL
+
+
+def test_async_store_skips_seen_questions() -> None:
+    """
+    Tests that the asynchronous store picks the only question the user
+    hasn't seen.
+    """
+    redis_db = fakeredis.FakeAsyncRedis()
+    bank = make_bank(100)
+    store = AsyncQuizStore(redis_db, bank, TG_PLATFORM)
+    seen_key = get_seen_key(TG_PLATFORM, 7, bank.fingerprint)
+
+    async def get_question_id() -> int:
+        for question_id in range(len(bank)):
+            if question_id != 57:
+                await redis_db.setbit(seen_key, question_id, 1)
+        request = await store.load("handler", 7, new_question=True)
+        return request.unseen_question_id
+
+    assert asyncio.run(get_question_id()) == 57
+
+
+def test_seen_set_of_a_rebuilt_bank_is_ignored(
+    mock_redis_db: fakeredis.FakeRedis,
+) -> None:
+    """
+    Tests that the questions seen in a bank don't hide the questions of a
+    rebuilt bank, whose ids point to other questions.
+    """
+    bank = make_bank(50)
+    store = QuizStore(mock_redis_db, bank, TG_PLATFORM)
+    for _ in range(len(bank) - 1):
+        get_new_question(store, 7)
+    rebuilt = QuestionBank.from_dict(
+        {f"Новый вопрос {number}": "Ответ" for number in range(50)}
+    )
+    rebuilt_store = QuizStore(mock_redis_db, rebuilt, TG_PLATFORM)
+
+    question_ids = [
+        get_new_question(rebuilt_store, 7) for _ in range(len(rebuilt))
+    ]
+
+    assert sorted(question_ids) == list(range(len(rebuilt)))
+    assert (
+        mock_redis_db.bitcount(get_seen_key(TG_PLATFORM, 7, bank.fingerprint))
+        == len(bank) - 1
+    )
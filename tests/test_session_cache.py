@@ -0,0 +1,131 @@
+import time
+from unittest.mock import Mock
+
+import fakeredis
+import redis
+
+from question_bank import QuestionBank
+from session_cache import (
+    CacheInvalidator,
+    SessionCache,
+    enable_keyspace_notifications,
+)
+from sessions import TG_PLATFORM
+from storage import QuizStore
+from tests.conftest import FakeClock
+
+
+def test_cache_evicts_least_recently_used() -> None:
+    """Tests that the least recently used session is evicted first."""
+    cache = SessionCache(max_size=2)
+    cache.write(1, 10)
+    cache.write(2, 20)
+    assert cache.get(1) == 10
+
+    cache.write(3, 30)
+
+    assert cache.get(2) is None
+    assert cache.get(1) == 10
+    assert cache.get(3) == 30
+    metrics = cache.metrics()
+    assert (metrics.hits, metrics.misses, metrics.evictions) == (3, 1, 1)
+    assert metrics.hit_rate == 0.75
+    assert metrics.size == 2
+
+
+def test_cache_expires_sessions() -> None:
+    """Tests that a session is not served after its TTL."""
+    clock = FakeClock()
+    cache = SessionCache(ttl=10, clock=clock)
+    cache.write(1, 10)
+
+    clock.now = 11
+
+    assert cache.get(1) is None
+    assert cache.metrics().expirations == 1
+
+
+def test_own_writes_do_not_invalidate() -> None:
+    """
+    Tests that the notification of the process's own write keeps the entry,
+    while a write of another replica drops it.
+    """
+    cache = SessionCache()
+    cache.expect_write(1)
+    cache.write(1, 10)
+
+    cache.invalidate(1, "set")
+    assert cache.get(1) == 10
+
+    cache.invalidate(1, "set")
+    assert cache.get(1) is None
+    assert cache.metrics().invalidations == 1
+
+
+def test_stale_reads_are_not_cached() -> None:
+    """
+    Tests that a session read while another one was invalidated is not
+    cached, as the read may have missed the change.
+    """
+    cache = SessionCache()
+    version = cache.version()
+    cache.invalidate(1, "set")
+
+    cache.put(1, 10, version)
+
+    assert cache.get(1) is None
+
+
+def test_enable_keyspace_notifications_keeps_events() -> None:
+    """Tests that the events enabled by other clients stay enabled."""
+    redis_db = Mock()
+    redis_db.config_get.return_value = {"notify-keyspace-events": "Elg"}
+
+    assert enable_keyspace_notifications(redis_db)
+
+    redis_db.config_set.assert_called_once_with(
+        "notify-keyspace-events", "ElgK$xe"
+    )
+
+
+def test_enable_keyspace_notifications_without_config() -> None:
+    """Tests that the cache is not used if Redis forbids CONFIG."""
+    redis_db = Mock()
+    redis_db.config_get.side_effect = redis.ResponseError("unknown command")
+
+    assert not enable_keyspace_notifications(redis_db)
+
+
+def test_replicas_invalidate_each_other(mock_questions: QuestionBank) -> None:
+    """
+    Tests that a replica serves its own writes from the cache without
+    reading Redis, and reads Redis again once another replica has changed
+    the session.
+    """
+    server = fakeredis.FakeServer()
+    redis_db = fakeredis.FakeRedis(server=server)
+    redis_db.config_set("notify-keyspace-events", "Kg$xe")
+    cache = SessionCache()
+    invalidator = CacheInvalidator(
+        fakeredis.FakeRedis(server=server), cache, TG_PLATFORM
+    )
+    assert invalidator.wait_subscribed(5)
+    replica = QuizStore(redis_db, mock_questions, TG_PLATFORM, cache=cache)
+    other_replica = QuizStore(
+        fakeredis.FakeRedis(server=server), mock_questions, TG_PLATFORM
+    )
+
+    request = replica.load("handler", 5)
+    request.new_question_id = 1
+    replica.save("handler", request)
+    time.sleep(0.1)
+    assert replica.load("handler", 5, question=True).question_id == 1
+    assert replica.round_trips["handler"] == 1
+
+    request = other_replica.load("handler", 5)
+    request.new_question_id = 2
+    other_replica.save("handler", request)
+    time.sleep(0.1)
+    assert replica.load("handler", 5, question=True).question_id == 2
+    assert replica.round_trips["handler"] == 2
+    invalidator.close()
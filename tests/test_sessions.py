@@ -0,0 +1,168 @@
+from question_bank import QuestionBank
+from sessions import (
+    TG_PLATFORM,
+    VK_PLATFORM,
+    SessionCompactor,
+    compact_sessions,
+    format_session,
+    load_question_id,
+    migrate_sessions,
+    save_question_id,
+)
+
+
+def test_question_id_roundtrip(
+    mock_questions: QuestionBank, mock_redis_db
+) -> None:
+    """
+    Tests that the session stores only the question id and reads it back.
+
+    Asserts:
+        - The stored value is the id with the fingerprint of the bank, not
+          the question text.
+        - The id is read back unchanged.
+        - A user without a session has no question.
+        - The sessions of the bots do not collide.
+    """
+    save_question_id(mock_redis_db, TG_PLATFORM, 42, mock_questions, 2)
+
+    assert mock_redis_db.get("session:tg:42") == (
+        f"{mock_questions.fingerprint}:2".encode()
+    )
+    assert (
+        load_question_id(mock_redis_db, TG_PLATFORM, 42, mock_questions) == 2
+    )
+    assert (
+        load_question_id(mock_redis_db, TG_PLATFORM, 43, mock_questions)
+        is None
+    )
+    assert (
+        load_question_id(mock_redis_db, VK_PLATFORM, 42, mock_questions)
+        is None
+    )
+
+
+def test_session_ttl_slides(
+    mock_questions: QuestionBank, mock_redis_db
+) -> None:
+    """
+    Tests that a session expires after the TTL, which starts over on every
+    read.
+    """
+    save_question_id(mock_redis_db, VK_PLATFORM, 42, mock_questions, 2, ttl=60)
+    assert mock_redis_db.ttl("session:vk:42") == 60
+
+    mock_redis_db.expire("session:vk:42", 5)
+    load_question_id(mock_redis_db, VK_PLATFORM, 42, mock_questions, ttl=60)
+
+    assert mock_redis_db.ttl("session:vk:42") > 50
+
+
+def test_legacy_session_is_migrated_on_read(
+    mock_questions: QuestionBank, mock_redis_db
+) -> None:
+    """
+    Tests that a session holding the full question text under the bare user
+    id is resolved to the question id and moved to the session key.
+
+    Asserts:
+        - The legacy session resolves to the id of its question.
+        - The session is rewritten with the id under the session key.
+        - The legacy key is removed.
+    """
+    mock_redis_db.set(42, "Вопрос 2".encode())
+
+    assert (
+        load_question_id(mock_redis_db, TG_PLATFORM, 42, mock_questions) == 1
+    )
+    assert mock_redis_db.get("session:tg:42") == (
+        format_session(mock_questions.fingerprint, 1).encode()
+    )
+    assert mock_redis_db.get(42) is None
+
+
+def test_migrate_sessions(mock_questions: QuestionBank, mock_redis_db) -> None:
+    """
+    Tests the bulk migration of legacy sessions.
+
+    Asserts:
+        - Only legacy sessions are counted as migrated.
+        - Sessions of unknown questions are removed.
+        - Non-session keys are left untouched.
+    """
+    mock_redis_db.set(1, "Вопрос 3".encode())
+    mock_redis_db.set(2, "Удалённый вопрос".encode())
+    mock_redis_db.set(3, 0)
+    mock_redis_db.set("leaderboard", "Вопрос 1".encode())
+
+    assert migrate_sessions(mock_redis_db, mock_questions) == 2
+    assert mock_redis_db.get(1) == (
+        format_session(mock_questions.fingerprint, 2).encode()
+    )
+    assert mock_redis_db.get(2) is None
+    assert mock_redis_db.get(3) == b"0"
+    assert mock_redis_db.get("leaderboard") == "Вопрос 1".encode()
+
+
+def test_compact_sessions(mock_questions: QuestionBank, mock_redis_db) -> None:
+    """
+    Tests that sessions without a TTL are deleted if they are broken and
+    get the session TTL otherwise, while other keys are left untouched.
+    """
+    mock_redis_db.set(1, "Вопрос 1".encode())
+    mock_redis_db.set(2, "Удалённый вопрос".encode())
+    mock_redis_db.set("session:vk:3", 0)
+    save_question_id(mock_redis_db, TG_PLATFORM, 4, mock_questions, 1, ttl=60)
+    mock_redis_db.set("leaderboard", 1)
+
+    report = compact_sessions(mock_redis_db, mock_questions, ttl=100)
+
+    assert report.scanned == 4
+    assert report.deleted == 2
+    assert report.deleted_bytes == len("2Удалённый вопрос".encode()) + len(
+        "session:vk:30"
+    )
+    assert (report.expiring, report.expiring_bytes) == (
+        1,
+        len("1Вопрос 1".encode()),
+    )
+    assert mock_redis_db.ttl(1) == 100
+    assert mock_redis_db.ttl("session:tg:4") == 60
+    assert mock_redis_db.get(2) is None
+    assert mock_redis_db.get("session:vk:3") is None
+    assert mock_redis_db.ttl("leaderboard") == -1
+
+
+def test_only_one_replica_compacts(
+    mock_questions: QuestionBank, mock_redis_db
+) -> None:
+    """Tests that replicas do not compact the sessions in the same interval."""
+    compactor = SessionCompactor(mock_redis_db, mock_questions, interval=3600)
+    other_compactor = SessionCompactor(
+        mock_redis_db, mock_questions, interval=3600
+    )
+
+    assert compactor.compact() is not None
+    assert other_compactor.compact() is None
+    compactor.close()
+    other_compactor.close()
+
+
+def test_session_of_another_bank_is_ignored(
+    mock_questions: QuestionBank, mock_redis_db
+) -> None:
+    """
+    Tests that a question id saved for another bank, or without the
+    fingerprint of a bank, is not taken for a question of this one.
+    """
+    rebuilt = QuestionBank.from_dict({"Вопрос 3": "Ответ 3"})
+    save_question_id(mock_redis_db, TG_PLATFORM, 42, rebuilt, 0)
+    mock_redis_db.set("session:tg:43", 0)
+
+    for user_id in [42, 43]:
+        assert (
+            load_question_id(
+                mock_redis_db, TG_PLATFORM, user_id, mock_questions
+            )
+            is None
+        )
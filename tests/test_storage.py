@@ -0,0 +1,116 @@
+import asyncio
+
+import fakeredis
+import redis
+
+from question_bank import QuestionBank
+from scores import Outcome
+from sessions import TG_PLATFORM, format_session
+from storage import HEALTH_CHECK_INTERVAL, SOCKET_TIMEOUT, QuizStore, connect
+from tests.conftest import FakeTelegramApi
+from tg_bot_async import AsyncQuizBot, IncomingMessage
+
+
+def test_connect_configures_pool() -> None:
+    """
+    Tests that the client has a bounded pool with timeouts and keepalive.
+    Nothing is sent to Redis until the first command.
+    """
+    redis_db = connect("redis://localhost:6379/0", max_connections=4)
+
+    pool = redis_db.connection_pool
+    assert isinstance(pool, redis.BlockingConnectionPool)
+    assert pool.max_connections == 4
+    assert pool.connection_kwargs["socket_timeout"] == SOCKET_TIMEOUT
+    assert pool.connection_kwargs["socket_keepalive"] is True
+    assert (
+        pool.connection_kwargs["health_check_interval"]
+        == HEALTH_CHECK_INTERVAL
+    )
+
+
+def test_load_and_save_share_round_trips(
+    mock_questions: QuestionBank, mock_redis_db: fakeredis.FakeRedis
+) -> None:
+    """
+    Tests that a request reads the state, the question and the score in one
+    round trip and writes all its changes in another, moving a legacy
+    session to the session key on the way.
+    """
+    store = QuizStore(mock_redis_db, mock_questions, TG_PLATFORM)
+    mock_redis_db.set(5, "Вопрос 2")
+    mock_redis_db.hset("conversations:quiz", "5:5", 2)
+
+    request = store.load(
+        "handler", 5, conversation=(5, 5), question=True, score=True
+    )
+    request.outcome = Outcome.CORRECT
+    request.new_state = 1
+    store.save("handler", request)
+
+    assert request.state == 2
+    assert request.question_id == mock_questions.find_id("Вопрос 2")
+    assert request.score.correct == 0
+    assert store.round_trips["handler"] == 2
+    assert mock_redis_db.get("session:tg:5") == (
+        format_session(
+            mock_questions.fingerprint, request.question_id
+        ).encode()
+    )
+    assert mock_redis_db.get(5) is None
+    assert mock_redis_db.hget("score:tg:5", "correct") == b"1"
+    assert mock_redis_db.hget("conversations:quiz", "5:5") == b"1"
+
+
+def test_sessions_expire_without_activity(
+    mock_questions: QuestionBank, mock_redis_db: fakeredis.FakeRedis
+) -> None:
+    """
+    Tests that a session is written with a TTL, and that reading it starts
+    the TTL over.
+    """
+    store = QuizStore(
+        mock_redis_db, mock_questions, TG_PLATFORM, session_ttl=60
+    )
+    request = store.load("handler", 5)
+    request.new_question_id = 1
+    store.save("handler", request)
+    assert mock_redis_db.ttl("session:tg:5") == 60
+
+    mock_redis_db.expire("session:tg:5", 10)
+    store.load("handler", 5, question=True)
+
+    assert mock_redis_db.ttl("session:tg:5") > 50
+
+
+def test_nothing_to_read_or_write_costs_nothing(
+    mock_questions: QuestionBank, mock_redis_db: fakeredis.FakeRedis
+) -> None:
+    """Tests that an empty request does not go to Redis."""
+    store = QuizStore(mock_redis_db, mock_questions, TG_PLATFORM)
+
+    store.save("handler", store.load("handler", 5))
+
+    assert store.round_trips.snapshot() == {}
+
+
+def test_async_bot_round_trips_per_message(
+    mock_questions: QuestionBank,
+) -> None:
+    """
+    Tests that every message handled by the asyncio runtime costs at most
+    one round trip for reads and one for writes, the state included.
+    """
+    bot = AsyncQuizBot(
+        FakeTelegramApi(), mock_questions, fakeredis.FakeAsyncRedis()
+    )
+    texts = ["/start", "Новый вопрос", "Ерунда", "Сдаться", "Мой счёт"]
+
+    async def talk() -> None:
+        for text in texts:
+            await bot.handle_message(IncomingMessage(1, 1, text))
+
+    asyncio.run(talk())
+
+    # "Мой счёт" only reads, the other messages read and write.
+    assert bot.store.round_trips["handle_message"] == 2 * len(texts) - 1
@@ -1,11 +1,23 @@
-import random
-
 from unittest.mock import Mock
 from telegram import ReplyKeyboardMarkup
 
+from outbound import Priority
+from question_bank import QuestionBank
+
+from scores import Outcome, record_outcome
+from sessions import (
+    NO_QUESTION_MESSAGE,
+    TG_PLATFORM,
+    parse_question_id,
+    save_question_id,
+)
+from storage import QuizStore
 from tg_bot import (
+    ScheduledBot,
     start_command,
     handle_new_question_request,
+    handle_score_request,
+    handle_selection_command,
     handle_solution_attempt,
     State,
 )
@@ -42,8 +54,9 @@ def test_start_command(mock_update: Mock, mock_context: Mock) -> None:
 def test_handle_new_question_request(
     mock_update: Mock,
     mock_context: Mock,
-    mock_questions: dict,
+    mock_questions: QuestionBank,
     mock_redis_db: Mock,
+    mock_store: QuizStore,
 ) -> None:
     """
     Tests the handle_new_question_request function to ensure it sends the question
@@ -52,35 +65,43 @@ def test_handle_new_question_request(
     Args:
         mock_update (Mock): Mock object for the Update class
         mock_context (Mock): Mock object for the CallbackContext
-        mock_questions (dict[str, str]): A dictionary containing questions as keys and their
-            corresponding answers as values
+        mock_questions (QuestionBank): A bank of questions and their answers
         mock_redis_db (Mock): Mock object for the Redis client
+        mock_store (QuizStore): The data access over the Redis client
 
     Returns:
         None
 
     Asserts:
         - The reply_text method is called once with the correct question.
-        - The question is stored in the Redis database.
+        - The question id is stored in the Redis database.
         - The function returns the GUESS_ANSWER state.
+        - The user's seen-set is read in one round trip and the question
+          is saved in another one.
     """
     result = handle_new_question_request(
         update=mock_update,
         context=mock_context,
         questions=mock_questions,
-        redis_db=mock_redis_db,
+        store=mock_store,
+    )
+    question_id, _ = parse_question_id(
+        mock_redis_db.get(f"session:tg:{mock_update.effective_user.id}"),
+        mock_questions,
     )
     mock_update.message.reply_text.assert_called_once_with(
-        mock_redis_db.get(mock_update.effective_user.id)
+        mock_questions.question(question_id)
     )
     assert result == State.GUESS_ANSWER.value
+    assert mock_store.round_trips["handle_new_question_request"] == 2
 
 
 def test_handle_solution_attempt(
     mock_update: Mock,
     mock_context: Mock,
-    mock_questions: dict[str, str],
+    mock_questions: QuestionBank,
     mock_redis_db: Mock,
+    mock_store: QuizStore,
 ) -> None:
     """
     Tests the handle_solution_attempt function to ensure it correctly processes
@@ -90,9 +111,9 @@ def test_handle_solution_attempt(
     Args:
         mock_update (Mock): Mock object for the Update class.
         mock_context (Mock): Mock object for the CallbackContext.
-        mock_questions (dict[str, str]): A dictionary containing questions as keys and their
-            corresponding answers as values.
+        mock_questions (QuestionBank): A bank of questions and their answers.
         mock_redis_db (Mock): Mock object for the Redis client.
+        mock_store (QuizStore): The data access over the Redis client.
 
     Returns:
         None
@@ -100,20 +121,24 @@ def test_handle_solution_attempt(
     Asserts:
         - The reply_text method is called twice with the correct messages.
         - The function returns the NEW_QUESTION state.
+        - The question is read in one round trip and the score is updated
+          in another.
     """
-    mock_redis_db.set(
+    question_id = mock_questions.random_id()
+    save_question_id(
+        mock_redis_db,
+        TG_PLATFORM,
         mock_update.effective_user.id,
-        random.choice(list(mock_questions.keys())).encode(),
+        mock_questions,
+        question_id,
     )
-    mock_update.message.text = mock_questions[
-        mock_redis_db.get(mock_update.effective_user.id).decode("utf-8")
-    ]
+    mock_update.message.text = mock_questions.answer(question_id)
 
     result = handle_solution_attempt(
         update=mock_update,
         context=mock_context,
         questions=mock_questions,
-        redis_db=mock_redis_db,
+        store=mock_store,
     )
     assert mock_update.message.reply_text.call_count == 2
     mock_update.message.reply_text.assert_any_call("Правильно!")
@@ -125,3 +150,138 @@ def test_handle_solution_attempt(
     )
 
     assert result == State.NEW_QUESTION.value
+    assert mock_store.round_trips["handle_solution_attempt"] == 2
+    assert (
+        mock_redis_db.hget(
+            f"score:tg:{mock_update.effective_user.id}", "correct"
+        )
+        == b"1"
+    )
+
+
+def test_session_of_a_rebuilt_bank_is_no_question(
+    mock_update: Mock,
+    mock_context: Mock,
+    mock_redis_db: Mock,
+    mock_questions: QuestionBank,
+    mock_store: QuizStore,
+) -> None:
+    """
+    Tests that an answer to a question saved before the questions were
+    rebuilt is not checked against the question that took its id.
+    """
+    rebuilt = QuestionBank.from_dict({"Вопрос 3": "Ответ 3"})
+    save_question_id(
+        mock_redis_db, TG_PLATFORM, mock_update.effective_user.id, rebuilt, 0
+    )
+    mock_update.message.text = "Ответ 1"
+
+    handle_solution_attempt(
+        update=mock_update,
+        context=mock_context,
+        questions=mock_questions,
+        store=mock_store,
+    )
+
+    mock_update.message.reply_text.assert_any_call(NO_QUESTION_MESSAGE)
+    assert "Правильно!" not in [
+        call.args[0] for call in mock_update.message.reply_text.call_args_list
+    ]
+
+
+def test_handle_score_request(
+    mock_update: Mock,
+    mock_context: Mock,
+    mock_redis_db: Mock,
+    mock_store: QuizStore,
+) -> None:
+    """
+    Tests the handle_score_request function to ensure it replies with the
+    user's score and keeps the conversation state.
+
+    Args:
+        mock_update (Mock): Mock object for the Update class.
+        mock_context (Mock): Mock object for the CallbackContext.
+        mock_redis_db (Mock): Mock object for the Redis client.
+        mock_store (QuizStore): The data access over the Redis client.
+
+    Returns:
+        None
+
+    Asserts:
+        - The reply mentions the number of correct answers and the rank.
+        - The function returns None, so the state does not change.
+        - The score is read in one round trip.
+    """
+    record_outcome(
+        mock_redis_db,
+        TG_PLATFORM,
+        mock_update.effective_user.id,
+        Outcome.CORRECT,
+    )
+
+    result = handle_score_request(
+        update=mock_update, context=mock_context, store=mock_store
+    )
+
+    reply = mock_update.message.reply_text.call_args.args[0]
+    assert "Правильных ответов: 1" in reply
+    assert "Место в рейтинге: 1 из 1" in reply
+    assert result is None
+    assert mock_store.round_trips["handle_score_request"] == 1
+
+
+def test_handle_selection_command(
+    mock_update: Mock,
+    mock_context: Mock,
+    mock_store: QuizStore,
+) -> None:
+    """
+    Tests that the selection commands reply without changing the state,
+    and write only a selection they changed.
+
+    Asserts:
+        - A tournament can't be chosen while the bot has no facet index.
+        - "/all" is written in one round trip.
+    """
+    mock_update.message.text = "/tournament Кубок"
+
+    result = handle_selection_command(
+        mock_update, mock_context, store=mock_store
+    )
+
+    mock_update.message.reply_text.assert_called_once_with(
+        "Подборки вопросов ещё не собраны."
+    )
+    assert result is None
+    assert mock_store.round_trips["handle_selection_command"] == 0
+
+    mock_update.message.text = "/all"
+
+    handle_selection_command(mock_update, mock_context, store=mock_store)
+
+    mock_update.message.reply_text.assert_called_with(
+        "Теперь вопросы из всех турниров."
+    )
+    assert mock_store.round_trips["handle_selection_command"] == 1
+
+
+def test_scheduled_bot_prioritizes_messages() -> None:
+    """
+    Tests that ScheduledBot queues messages instead of sending them, with
+    answers before keyboards and logs.
+    """
+    scheduler = Mock()
+    bot = ScheduledBot("123:token", scheduler, log_chat_id=100)
+
+    bot.send_message(1, "Правильно!")
+    bot.send_message(1, "Напряги извилины", reply_markup=Mock())
+    bot.send_message(chat_id=100, text="Бот упал")
+
+    priorities = [call.args[2] for call in scheduler.submit.call_args_list]
+    assert priorities == [Priority.ANSWER, Priority.KEYBOARD, Priority.LOG]
+    assert [call.args[0] for call in scheduler.submit.call_args_list] == [
+        1,
+        1,
+        100,
+    ]
@@ -0,0 +1,180 @@
+import asyncio
+
+import fakeredis
+import pytest
+
+from question_bank import QuestionBank
+from sessions import NO_QUESTION_MESSAGE, parse_question_id
+from tests.conftest import FakeTelegramApi, make_update
+from tg_bot_async import AsyncQuizBot, IncomingMessage, PollingOffset, State
+
+
+@pytest.fixture()
+def bot(mock_questions: QuestionBank) -> AsyncQuizBot:
+    return AsyncQuizBot(
+        FakeTelegramApi(), mock_questions, fakeredis.FakeAsyncRedis()
+    )
+
+
+def test_conversation(bot: AsyncQuizBot) -> None:
+    """
+    Tests a whole conversation: the bot sends a question, rejects a wrong
+    answer, accepts the right one and counts the score.
+    """
+
+    message = IncomingMessage(1, 1, "")
+
+    async def talk() -> None:
+        for text in ["/start", "Новый вопрос", "Ерунда"]:
+            await bot.handle_message(IncomingMessage(1, 1, text))
+        assert await bot.load_state(message) is State.GUESS_ANSWER
+        question_id, _ = parse_question_id(
+            await bot.redis_db.get("session:tg:1"), bot.questions
+        )
+        answer = bot.questions.answer(question_id)
+        await bot.handle_message(IncomingMessage(1, 1, answer))
+        await bot.handle_message(IncomingMessage(1, 1, "Мой счёт"))
+        assert await bot.load_state(message) is State.NEW_QUESTION
+
+    asyncio.run(talk())
+
+    texts = [text for _, text in bot.api.sent]
+    assert "Неправильно. Попробуйте ещё раз." in texts
+    assert "Правильно!" in texts
+    assert texts[-1].startswith("Правильных ответов: 1\n")
+
+
+def test_new_question_text_is_an_answer_while_guessing(
+    bot: AsyncQuizBot,
+) -> None:
+    """
+    Tests that "Новый вопрос" sent while answering is judged as an answer
+    to the live question, like the ConversationHandler of tg_bot does.
+    """
+
+    async def talk() -> State:
+        for text in ["/start", "Новый вопрос", "Новый вопрос"]:
+            await bot.handle_message(IncomingMessage(1, 1, text))
+        return await bot.load_state(IncomingMessage(1, 1, ""))
+
+    state = asyncio.run(talk())
+
+    texts = [text for _, text in bot.api.sent]
+    assert NO_QUESTION_MESSAGE not in texts
+    assert "Неправильно. Попробуйте ещё раз." in texts
+    assert state is State.GUESS_ANSWER
+
+
+def test_messages_outside_conversation_are_ignored(bot: AsyncQuizBot) -> None:
+    """Tests that only /start begins a conversation."""
+    asyncio.run(bot.handle_message(IncomingMessage(1, 1, "Новый вопрос")))
+
+    assert bot.api.sent == []
+
+
+def test_selection_commands_work_outside_conversation(
+    bot: AsyncQuizBot,
+) -> None:
+    """Tests that /all is handled before /start too."""
+    asyncio.run(bot.handle_message(IncomingMessage(1, 1, "/all")))
+
+    assert bot.api.sent == [(1, "Теперь вопросы из всех турниров.")]
+
+
+def test_dispatch_keeps_order_within_a_chat(
+    mock_questions: QuestionBank,
+) -> None:
+    """
+    Tests that updates of different chats are handled concurrently, while
+    the updates of one chat are handled in the order they arrived.
+    """
+    bot = AsyncQuizBot(
+        FakeTelegramApi(delay=0.05),
+        mock_questions,
+        fakeredis.FakeAsyncRedis(),
+    )
+
+    async def run() -> tuple[float, list[State]]:
+        loop = asyncio.get_running_loop()
+        started_at = loop.time()
+        update_id = 0
+        for text in ["/start", "Новый вопрос", "Сдаться"]:
+            for chat_id in range(1, 51):
+                update_id += 1
+                await bot.dispatch(make_update(update_id, chat_id, text))
+        await bot.drain()
+        elapsed = loop.time() - started_at
+        states = [
+            await bot.load_state(IncomingMessage(chat_id, chat_id, ""))
+            for chat_id in range(1, 51)
+        ]
+        return elapsed, states
+
+    elapsed, states = asyncio.run(run())
+
+    assert elapsed < 1
+    for chat_id in range(1, 51):
+        texts = [text for chat, text in bot.api.sent if chat == chat_id]
+        assert texts[0] == "Напряги извилины"
+        assert bot.questions.find_id(texts[1]) is not None
+        assert texts[2].startswith("Правильный ответ: ")
+    assert all(state is State.NEW_QUESTION for state in states)
+
+
+def test_dispatch_waits_while_saturated(mock_questions: QuestionBank) -> None:
+    """
+    Tests that no more than max_concurrent_updates updates are scheduled
+    at a time, so the bot doesn't fetch updates it can't handle yet.
+    """
+    bot = AsyncQuizBot(
+        FakeTelegramApi(delay=0.05),
+        mock_questions,
+        fakeredis.FakeAsyncRedis(),
+        max_concurrent_updates=2,
+    )
+
+    async def run() -> bool:
+        await bot.dispatch(make_update(1, 1, "/start"))
+        await bot.dispatch(make_update(2, 2, "/start"))
+        third = asyncio.create_task(bot.dispatch(make_update(3, 3, "/start")))
+        await asyncio.sleep(0.01)
+        saturated = not third.done()
+        await third
+        await bot.drain()
+        return saturated
+
+    assert asyncio.run(run())
+    assert len(bot.api.sent) == 3
+
+
+def test_polling_resumes_after_the_handled_updates(
+    mock_questions: QuestionBank,
+) -> None:
+    """
+    Tests that polling restarted after a network error fetches only the
+    updates after those already dispatched.
+    """
+    api = FakeTelegramApi(
+        updates=[
+            [make_update(5, 1, "/start"), make_update(6, 1, "Новый вопрос")],
+            ConnectionError("network is down"),
+            [make_update(7, 1, "Мой счёт")],
+        ]
+    )
+    offset = PollingOffset()
+    server = fakeredis.FakeServer()
+
+    async def poll() -> None:
+        redis_db = fakeredis.FakeAsyncRedis(server=server)
+        bot = AsyncQuizBot(api, mock_questions, redis_db)
+        try:
+            await bot.run_polling(offset)
+        finally:
+            await bot.drain()
+
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            asyncio.run(poll())
+
+    assert api.offsets == [0, 7, 7, 8]
+    assert len(api.sent) == 3
@@ -0,0 +1,90 @@
+import logging
+import threading
+from unittest.mock import Mock
+
+from tg_logger import MAX_MESSAGE_LENGTH, TelegramLogsHandler, pack_messages
+
+
+def make_logger(handler: TelegramLogsHandler) -> logging.Logger:
+    test_logger = logging.getLogger(f"test_tg_logger_{id(handler)}")
+    test_logger.propagate = False
+    test_logger.addHandler(handler)
+    return test_logger
+
+
+def test_pack_messages_counts_repeated_records() -> None:
+    """
+    Tests that repeated records are sent once with the number of repeats,
+    in the order of their first occurrence.
+    """
+    messages = pack_messages(["Ошибка сети", "Бот упал", "Ошибка сети"])
+
+    assert messages == ["[×2] Ошибка сети\n\nБот упал"]
+
+
+def test_pack_messages_respects_message_length_limit() -> None:
+    """
+    Tests that records are split between messages under the Telegram limit,
+    and a record longer than the limit keeps its end.
+    """
+    traceback = "Traceback\n" + "x" * MAX_MESSAGE_LENGTH + "\nValueError"
+    entries = [f"Запись {number} " + "y" * 1000 for number in range(10)]
+
+    messages = pack_messages([*entries, traceback], dropped=3)
+
+    assert all(len(message) <= MAX_MESSAGE_LENGTH for message in messages)
+    assert len(messages) == 5
+    assert messages[-2].endswith("\nValueError")
+    assert messages[-1] == "Пропущено записей из-за переполнения: 3"
+
+
+def test_handler_batches_records_and_flushes_on_close() -> None:
+    """
+    Tests that logging does not wait for the Bot API, and the records are
+    sent in one message when the handler is closed.
+    """
+    bot = Mock()
+    handler = TelegramLogsHandler(bot, chat_id=1, batch_interval=60)
+    test_logger = make_logger(handler)
+
+    for _ in range(3):
+        test_logger.error("Бот упал")
+    test_logger.error("Ошибка сети")
+    bot.send_message.assert_not_called()
+    handler.close()
+
+    bot.send_message.assert_called_once_with(
+        text="[×3] Бот упал\n\nОшибка сети", chat_id=1
+    )
+
+
+def test_handler_drops_records_when_queue_is_full() -> None:
+    """
+    Tests that records over the queue limit are dropped and reported, while
+    the Bot API is unavailable.
+    """
+    sending = threading.Event()
+    api_is_back = threading.Event()
+    bot = Mock()
+    bot.send_message.side_effect = lambda **params: (
+        sending.set(),
+        api_is_back.wait(5),
+    )
+    handler = TelegramLogsHandler(
+        bot, chat_id=1, max_queued_records=2, batch_interval=0
+    )
+    test_logger = make_logger(handler)
+
+    test_logger.error("Запись 0")
+    sending.wait(5)
+    for number in range(1, 6):
+        test_logger.error(f"Запись {number}")
+    api_is_back.set()
+    handler.close()
+
+    sent = "\n\n".join(
+        call.kwargs["text"] for call in bot.send_message.call_args_list
+    )
+    assert all(f"Запись {number}" in sent for number in range(3))
+    assert all(f"Запись {number}" not in sent for number in range(3, 6))
+    assert "Пропущено записей из-за переполнения: 3" in sent
@@ -1,83 +1,205 @@
-import random
+import json
+from queue import Queue
 
 import pytest
-from unittest.mock import Mock, ANY
+from unittest.mock import Mock
 
-from vk_bot import handle_new_question_request, handle_solution_attempt
+from vk_api.exceptions import ApiError
+
+import outbound
+from question_bank import QuestionBank
+from scores import Outcome
+from sessions import VK_PLATFORM, save_question_id
+from storage import QuizStore, UserRequest
+from vk_bot import (
+    handle_event,
+    handle_new_question_request,
+    handle_solution_attempt,
+    set_keyboard,
+)
+from vk_replies import ReplySender, VkReply, send_replies
 
 
 def test_handle_new_question_request(
     mock_event: Mock,
-    mock_vk_api: Mock,
-    mock_questions: dict[str, str],
-    mock_redis_db: Mock,
+    mock_questions: QuestionBank,
 ) -> None:
     """
-    Tests the handle_new_question_request function to ensure it sends the
-    question and stores it in the Redis database.
+    Tests the handle_new_question_request function to ensure it adds the
+    unseen question picked for the user to the reply and saves it in the
+    user's request.
 
     Args:
         mock_event (Mock): Mock object for the event passed to the function.
-        mock_vk_api (Mock): Mock object for the vk_api object.
-        mock_questions (dict): A dictionary containing questions as keys and their
-            corresponding answers as values.
-        mock_redis_db (Mock): Mock object for the Redis client.
+        mock_questions (QuestionBank): A bank of questions and their answers.
 
     Asserts:
-        - The messages.send method is called once with the correct message
-        - The messages.send method is called once with the correct message.
+        - The reply contains only the question.
     """
+    reply = VkReply(mock_event.user_id)
+    request = UserRequest(mock_event.user_id, unseen_question_id=2)
+
     handle_new_question_request(
         event=mock_event,
-        vk_api=mock_vk_api,
+        reply=reply,
         questions=mock_questions,
-        redis_db=mock_redis_db,
-    )
-    mock_vk_api.messages.send.assert_called_once_with(
-        message=mock_redis_db.get(mock_event.user_id),
-        user_id=mock_event.user_id,
-        random_id=ANY,
+        request=request,
     )
 
+    assert request.new_question_id == 2
+    assert reply.texts == [mock_questions.question(2)]
+
 
 def test_handle_solution_attempt(
     mock_event: Mock,
-    mock_vk_api: Mock,
-    mock_questions: dict[str, str],
-    mock_redis_db: Mock,
+    mock_questions: QuestionBank,
 ) -> None:
     """
     Tests the handle_solution_attempt function to ensure it correctly processes
-    a user's answer to a question, sends the appropriate response message, and
-    transitions to the NEW_QUESTION state if the answer is correct.
+    a user's answer to a question and adds the appropriate response message
+    to the reply.
 
     Args:
         mock_event (Mock): Mock object for the event passed to the function.
-        mock_vk_api (Mock): Mock object for the vk_api object.
-        mock_questions (dict[str, str]): A dictionary containing questions as keys
-            and their corresponding answers as values.
-        mock_redis_db (Mock): Mock object for the Redis client.
+        mock_questions (QuestionBank): A bank of questions and their answers.
 
     Asserts:
-        - The messages.send method is called once with the correct message.
+        - The reply contains only the congratulatory message.
+        - The outcome is saved in the user's request.
     """
-    mock_redis_db.set(
-        mock_event.user_id,
-        random.choice(list(mock_questions.keys())).encode(),
-    )
-    mock_event.text = mock_questions[
-        mock_redis_db.get(mock_event.user_id).decode("utf-8")
-    ]
+    question_id = mock_questions.random_id()
+    mock_event.text = mock_questions.answer(question_id)
+
+    reply = VkReply(mock_event.user_id)
+    request = UserRequest(mock_event.user_id, question_id=question_id)
 
-    result = handle_solution_attempt(
+    handle_solution_attempt(
         event=mock_event,
-        vk_api=mock_vk_api,
+        reply=reply,
         questions=mock_questions,
-        redis_db=mock_redis_db,
+        request=request,
     )
 
-    mock_vk_api.messages.send.assert_called_once_with(
-        message="Правильно!",
-        user_id=mock_event.user_id,
-        random_id=ANY,
+    assert reply.texts == ["Правильно!"]
+    assert request.outcome is Outcome.CORRECT
+
+
+@pytest.mark.parametrize(
+    "text, verdict, outcome",
+    [
+        ("Сдаться", "Правильный ответ: ", Outcome.GAVE_UP),
+        ("Совсем не то", "Неправильно.", Outcome.WRONG),
+    ],
+)
+def test_handle_solution_attempt_verdicts(
+    mock_event: Mock,
+    mock_questions: QuestionBank,
+    text: str,
+    verdict: str,
+    outcome: Outcome,
+) -> None:
+    """
+    Tests that giving up shows the correct answer, and that a wrong answer
+    doesn't ask to try again, as a new question follows it.
+    """
+    question_id = mock_questions.random_id()
+    mock_event.text = text
+
+    reply = VkReply(mock_event.user_id)
+    request = UserRequest(mock_event.user_id, question_id=question_id)
+
+    handle_solution_attempt(mock_event, reply, mock_questions, request)
+
+    assert reply.texts[0].startswith(verdict)
+    assert "Попробуйте ещё раз" not in reply.texts[0]
+    assert request.outcome is outcome
+
+
+@pytest.mark.parametrize(
+    "text, round_trips",
+    [("Сдаться", 2), ("Новый вопрос", 2), ("Мой счёт", 1)],
+)
+def test_handle_event_sends_one_message(
+    mock_event: Mock,
+    mock_vk_api: Mock,
+    mock_questions: QuestionBank,
+    mock_redis_db: Mock,
+    text: str,
+    round_trips: int,
+) -> None:
+    """
+    Tests that the whole answer to a message, with the keyboard, is sent
+    with a single messages.send call, and that the user's data costs at
+    most one round trip to Redis for reads and one for writes.
+    """
+    store = QuizStore(mock_redis_db, mock_questions, VK_PLATFORM)
+    save_question_id(
+        mock_redis_db,
+        VK_PLATFORM,
+        mock_event.user_id,
+        mock_questions,
+        mock_questions.random_id(),
     )
+    mock_event.text = text
+
+    with ReplySender(mock_vk_api) as replies:
+        handle_event(
+            mock_event, replies, mock_questions, store, set_keyboard()
+        )
+
+    mock_vk_api.messages.send.assert_called_once()
+    params = mock_vk_api.messages.send.call_args.kwargs
+    assert params["user_id"] == mock_event.user_id
+    assert json.loads(params["keyboard"])["buttons"]
+    mock_vk_api.execute.assert_not_called()
+    assert store.round_trips["handle_event"] == round_trips
+
+
+def test_send_replies_batches_with_execute(mock_vk_api: Mock) -> None:
+    """
+    Tests that replies to many users are sent with one execute call per
+    25 replies, in order.
+    """
+    replies = [VkReply(user_id, [f"Ответ {user_id}"]) for user_id in range(30)]
+
+    send_replies(mock_vk_api, replies)
+
+    assert mock_vk_api.execute.call_count == 2
+    first_code = mock_vk_api.execute.call_args_list[0].kwargs["code"]
+    assert first_code.count('"user_id"') == 25
+    assert first_code.index("Ответ 0") < first_code.index("Ответ 24")
+    mock_vk_api.messages.send.assert_not_called()
+
+
+def test_reply_sender_drops_batch_vk_keeps_rejecting(
+    mock_vk_api: Mock, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """
+    Tests that a reply VK rejects with flood control every time is dropped
+    after max_attempts attempts, and the replies queued after it are sent.
+    """
+    monkeypatch.setattr(outbound, "VK_RETRY_AFTER", 0.01)
+    flood_error = ApiError(
+        mock_vk_api,
+        "messages.send",
+        {},
+        {},
+        {"error_code": 9, "error_msg": "Flood control"},
+    )
+    attempts = Queue()
+
+    def send(**params) -> None:
+        attempts.put(params["user_id"])
+        if params["user_id"] == 1:
+            raise flood_error
+
+    mock_vk_api.messages.send.side_effect = send
+
+    with ReplySender(mock_vk_api, rate=1000, max_attempts=3) as replies:
+        replies.send(VkReply(1, ["Ответ"]))
+        first_attempts = [attempts.get(timeout=5) for _ in range(3)]
+        replies.send(VkReply(2, ["Ответ"]))
+
+    assert first_attempts == [1, 1, 1]
+    assert attempts.get(timeout=5) == 2
+    assert attempts.empty()
@@ -0,0 +1,275 @@
+from functools import partial
+from http.client import HTTPConnection
+import json
+import os
+from queue import Queue
+import signal
+import socket
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from telegram.ext import Dispatcher, Updater
+
+from persistence import (
+    CONVERSATION_NAME,
+    RedisPersistence,
+    get_conversations_key,
+)
+from question_bank import QuestionBank
+from sessions import TG_PLATFORM, parse_question_id
+from storage import QuizStore
+from tests.conftest import RecordingBot, make_update
+from tg_bot import (
+    WebhookBindError,
+    make_conversation_handler,
+    queue_update,
+    run_webhook,
+)
+from webhook import SECRET_TOKEN_HEADER, WebhookServer
+
+
+SECRET_TOKEN = "secret-token"
+
+
+class SlowBot(RecordingBot):
+    """RecordingBot that takes a while to send a message."""
+
+    def send_message(self, chat_id, text, *args, **kwargs) -> None:
+        time.sleep(0.2)
+        super().send_message(chat_id, text, *args, **kwargs)
+
+
+def post(
+    server: WebhookServer, body: bytes, secret_token: str, path: str = "/tg"
+) -> int:
+    connection = HTTPConnection(*server.server_address)
+    connection.request(
+        "POST", path, body=body, headers={SECRET_TOKEN_HEADER: secret_token}
+    )
+    status = connection.getresponse().status
+    connection.close()
+    return status
+
+
+@pytest.fixture()
+def server():
+    updates = []
+    server = WebhookServer(
+        ("127.0.0.1", 0), "/tg", SECRET_TOKEN, updates.append
+    )
+    server.updates = updates
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize(
+    "path, secret_token, body, status",
+    [
+        ("/tg", SECRET_TOKEN, b'{"update_id": 1}', 200),
+        ("/tg", "wrong", b'{"update_id": 1}', 403),
+        ("/other", SECRET_TOKEN, b'{"update_id": 1}', 404),
+        ("/tg", SECRET_TOKEN, b"not json", 400),
+    ],
+)
+def test_webhook_checks_requests(
+    server: WebhookServer,
+    path: str,
+    secret_token: str,
+    body: bytes,
+    status: int,
+) -> None:
+    """
+    Tests that only valid updates sent to the webhook path with the secret
+    token are accepted.
+    """
+    assert post(server, body, secret_token, path) == status
+    assert server.updates == ([{"update_id": 1}] if status == 200 else [])
+
+
+def test_webhook_feeds_conversation_handler(
+    mock_questions: QuestionBank, mock_redis_db
+) -> None:
+    """
+    Tests that updates received by the webhook are handled by the quiz
+    conversation.
+    """
+    bot = RecordingBot()
+    dispatcher = Dispatcher(bot, Queue(), workers=1)
+    dispatcher.add_handler(
+        make_conversation_handler(
+            mock_questions,
+            QuizStore(mock_redis_db, mock_questions, TG_PLATFORM),
+        )
+    )
+    dispatcher_thread = threading.Thread(target=dispatcher.start, daemon=True)
+    dispatcher_thread.start()
+    server = WebhookServer(
+        ("127.0.0.1", 0),
+        "/tg",
+        SECRET_TOKEN,
+        partial(queue_update, dispatcher),
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    try:
+        for update_id, text in enumerate(["/start", "Новый вопрос"], 1):
+            body = json.dumps(make_update(update_id, 7, text)).encode()
+            assert post(server, body, SECRET_TOKEN) == 200
+        replies = [bot.sent.get(timeout=5) for _ in range(2)]
+    finally:
+        server.shutdown()
+        server.server_close()
+        dispatcher.stop()
+
+    assert replies[0] == (7, "Напряги извилины")
+    question_id, _ = parse_question_id(
+        mock_redis_db.get("session:tg:7"), mock_questions
+    )
+    assert replies[1] == (7, mock_questions.question(question_id))
+
+
+@pytest.fixture()
+def webhook_bot(mock_questions: QuestionBank, mock_redis_db):
+    """
+    Provides a SlowBot with an updater running the quiz conversation, and
+    the settings of a webhook on a free local port.
+    """
+    with socket.socket() as free_socket:
+        free_socket.bind(("127.0.0.1", 0))
+        port = free_socket.getsockname()[1]
+    bot = SlowBot()
+    bot.updater = Updater(bot=bot, persistence=RedisPersistence(mock_redis_db))
+    bot.updater.dispatcher.add_handler(
+        make_conversation_handler(
+            mock_questions,
+            QuizStore(mock_redis_db, mock_questions, TG_PLATFORM),
+            persistent=True,
+        )
+    )
+    bot.settings = {
+        "tg_webhook_url": "https://example.com/tg",
+        "tg_webhook_secret": SECRET_TOKEN,
+        "tg_webhook_listen": "127.0.0.1",
+        "tg_webhook_port": port,
+    }
+    bot.address = ("127.0.0.1", port)
+    return bot
+
+
+def connect_when_listening(address: tuple[str, int]) -> socket.socket:
+    """Connects to the webhook once run_webhook has started its server."""
+    while True:
+        try:
+            return socket.create_connection(address)
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+
+
+def test_webhook_handles_queued_updates_on_sigterm(
+    webhook_bot: SlowBot, mock_redis_db
+) -> None:
+    """
+    Tests that the updates acknowledged before SIGTERM are handled and their
+    conversation states saved before run_webhook returns.
+    """
+    server = SimpleNamespace(server_address=webhook_bot.address)
+    sigterm_handler = signal.getsignal(signal.SIGTERM)
+
+    def send_updates() -> None:
+        connect_when_listening(webhook_bot.address).close()
+        for update_id, (chat_id, text) in enumerate(
+            [(7, "/start"), (7, "Новый вопрос"), (8, "/start")], 1
+        ):
+            body = json.dumps(make_update(update_id, chat_id, text)).encode()
+            assert post(server, body, SECRET_TOKEN) == 200
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    threading.Thread(target=send_updates, daemon=True).start()
+    run_webhook(webhook_bot.updater, webhook_bot.settings)
+
+    assert webhook_bot.sent.qsize() == 3
+    assert mock_redis_db.hlen(get_conversations_key(CONVERSATION_NAME)) == 2
+    assert signal.getsignal(signal.SIGTERM) is sigterm_handler
+
+
+def test_webhook_waits_for_requests_in_flight_on_sigterm(
+    webhook_bot: SlowBot,
+) -> None:
+    """
+    Tests that an update still being received when SIGTERM comes is
+    acknowledged and handled before run_webhook returns.
+    """
+    body = json.dumps(make_update(1, 7, "/start")).encode()
+    statuses = []
+
+    def send_slowly() -> None:
+        with connect_when_listening(webhook_bot.address) as connection:
+            connection.sendall(
+                (
+                    f"POST /tg HTTP/1.1\r\n"
+                    f"{SECRET_TOKEN_HEADER}: {SECRET_TOKEN}\r\n"
+                    f"Content-Length: {len(body)}\r\n\r\n"
+                ).encode()
+            )
+            time.sleep(0.2)
+            os.kill(os.getpid(), signal.SIGTERM)
+            time.sleep(0.8)
+            connection.sendall(body)
+            statuses.append(connection.recv(1024).split()[1])
+
+    threading.Thread(target=send_slowly, daemon=True).start()
+    run_webhook(webhook_bot.updater, webhook_bot.settings)
+
+    assert statuses == [b"200"]
+    assert webhook_bot.sent.qsize() == 1
+
+
+def test_webhook_refuses_updates_once_closing(
+    server: WebhookServer,
+) -> None:
+    """
+    Tests that an update sent on an open connection after the shutdown
+    started gets 503, so that Telegram sends it again.
+    """
+    body = json.dumps({"update_id": 1}).encode()
+    connection = HTTPConnection(*server.server_address)
+    headers = {SECRET_TOKEN_HEADER: SECRET_TOKEN}
+    connection.request("POST", "/tg", body=body, headers=headers)
+    assert connection.getresponse().read() == b""
+    server.shutdown()
+
+    connection.request("POST", "/tg", body=body, headers=headers)
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+
+    assert response.status == 503
+    assert response.getheader("Connection") == "close"
+    assert server.updates == [{"update_id": 1}]
+
+
+def test_webhook_fails_without_retrying_on_wrong_settings(
+    webhook_bot: SlowBot,
+) -> None:
+    """
+    Tests that run_webhook fails before registering the webhook when the
+    secret token is missing or the address is taken.
+    """
+    with pytest.raises(ValueError):
+        run_webhook(
+            webhook_bot.updater,
+            {**webhook_bot.settings, "tg_webhook_secret": ""},
+        )
+    with socket.socket() as taken_socket:
+        taken_socket.bind(webhook_bot.address)
+        taken_socket.listen()
+        with pytest.raises(WebhookBindError):
+            run_webhook(webhook_bot.updater, webhook_bot.settings)
+
+    assert webhook_bot.webhooks == []
+    assert not webhook_bot.updater.dispatcher.running
@@ -1,27 +1,111 @@
-from enum import Enum
 from functools import partial
 import logging
-import random
+import signal
+import threading
+import time
 import traceback
+from urllib.parse import urlparse
 
 import redis
-from telegram import Update, ReplyKeyboardMarkup
+from telegram import Bot, Message, Update, ReplyKeyboardMarkup
 from telegram.ext import (
     Updater,
-    CommandHandler,
     MessageHandler,
-    Filters,
+    MessageFilter,
     CallbackContext,
     ConversationHandler,
     Dispatcher,
+    TypeHandler,
 )
+from telegram.utils.request import Request
+
+from metrics import BotMetrics, start_metrics_server
+from outbound import (
+    TELEGRAM_CHAT_BURST,
+    TELEGRAM_CHAT_RATE,
+    TELEGRAM_RATE,
+    OutboundScheduler,
+    Priority,
+    get_telegram_retry_after,
+)
+from persistence import CONVERSATION_NAME, RedisPersistence
+from question_bank import QuestionBank
+from quiz import (
+    CANCEL_MESSAGE,
+    KEYBOARD,
+    START_MESSAGE,
+    Action,
+    State,
+    choose_selection,
+    format_verdict,
+    get_next_state,
+    judge_attempt,
+    route_message,
+)
+from scores import format_score
+from session_cache import start_session_cache
+from sessions import NO_QUESTION_MESSAGE, TG_PLATFORM, SessionCompactor
+from settings import (
+    setup_settings,
+    setup_logging,
+    load_facets,
+    load_questions,
+)
+from storage import QuizStore, connect
+from webhook import WebhookServer
+
 
-from settings import setup_settings, setup_logging, load_questions
+OUTBOUND_SENDERS = 8
+# Seconds between restarts of the bot after an error, doubled after
+# every failed restart.
+MIN_RESTART_DELAY = 1
+MAX_RESTART_DELAY = 60
 
 
-class State(Enum):
-    NEW_QUESTION = 1
-    GUESS_ANSWER = 2
+class ScheduledBot(Bot):
+    """
+    Bot that sends messages through an OutboundScheduler.
+
+    send_message returns at once and the message is sent when the rate
+    limits allow. Messages to the log chat have the lowest priority, and
+    messages with a keyboard go after plain answers.
+    """
+
+    def __init__(
+        self,
+        token: str,
+        scheduler: OutboundScheduler,
+        log_chat_id: int | None = None,
+        **kwargs,
+    ) -> None:
+        """
+        Initializes a ScheduledBot instance.
+
+        Args:
+            token (str): The Telegram bot token.
+            scheduler (OutboundScheduler): The scheduler sending messages.
+            log_chat_id (int | None): The chat where logs are sent.
+            **kwargs: Other arguments of telegram.Bot.
+
+        Returns:
+            None
+        """
+        super().__init__(token, **kwargs)
+        self.scheduler = scheduler
+        self.log_chat_id = log_chat_id
+
+    def send_message(self, chat_id, text, *args, **kwargs) -> None:
+        if chat_id == self.log_chat_id:
+            priority = Priority.LOG
+        elif kwargs.get("reply_markup") is not None:
+            priority = Priority.KEYBOARD
+        else:
+            priority = Priority.ANSWER
+        self.scheduler.submit(
+            chat_id,
+            partial(super().send_message, chat_id, text, *args, **kwargs),
+            priority,
+        )
 
 
 def start_command(update: Update, context: CallbackContext) -> int:
@@ -37,18 +121,14 @@ def start_command(update: Update, context: CallbackContext) -> int:
     Returns:
         int: The next state of the conversation, which is set to NEW_QUESTION.
     """
-    keyboard = [
-        ["Новый вопрос", "Сдаться"],
-        ["Мой счёт"],
-    ]
     update.message.reply_text(
-        "Напряги извилины", reply_markup=ReplyKeyboardMarkup(keyboard)
+        START_MESSAGE, reply_markup=ReplyKeyboardMarkup(KEYBOARD)
     )
     return State.NEW_QUESTION.value
 
 
 def handle_new_question_request(
-    update: Update, context: CallbackContext, questions, redis_db
+    update: Update, context: CallbackContext, questions, store
 ) -> int:
     """
     Handles a user's request to receive a new question.
@@ -60,21 +140,26 @@ def handle_new_question_request(
         update (Update): Incoming update object that contains all the information
                          about the incoming message.
         context (CallbackContext): Provides access to context-related data.
-        questions (dict): A dictionary containing questions as keys and their
-                         corresponding answers as values.
-        redis_db (Redis): A Redis database client object.
+        questions (QuestionBank): The bank of questions and their answers.
+        store (QuizStore): The data access of the handlers.
 
     Returns:
         int: The next state of the conversation, which is set to GUESS_ANSWER.
     """
-    random_question = random.choice(list(questions.keys()))
-    update.message.reply_text(random_question)
-    redis_db.set(update.effective_user.id, str(random_question))
+    request = store.load(
+        "handle_new_question_request",
+        update.effective_user.id,
+        new_question=True,
+    )
+    question_id = request.unseen_question_id
+    update.message.reply_text(questions.question(question_id))
+    request.new_question_id = question_id
+    store.save("handle_new_question_request", request)
     return State.GUESS_ANSWER.value
 
 
 def handle_solution_attempt(
-    update: Update, context: CallbackContext, questions, redis_db
+    update: Update, context: CallbackContext, questions, store
 ) -> int:
     """
     Handles a user's attempt to answer the current question.
@@ -83,47 +168,274 @@ def handle_solution_attempt(
     answer to the current question. The function checks if the answer is correct,
     and if so, sends a congratulatory message and returns to the NEW_QUESTION
     state. If the answer is incorrect, sends a message with the correct answer
-    and returns to the GUESS_ANSWER state.
+    and returns to the GUESS_ANSWER state. The outcome is added to the user's
+    score.
 
     Args:
         update (Update): Incoming update object that contains all the information
                          about the incoming message.
         context (CallbackContext): Provides access to context-related data.
-        questions (dict): A dictionary containing questions as keys and their
-                         corresponding answers as values.
-        redis_db (Redis): A Redis database client object.
+        questions (QuestionBank): The bank of questions and their answers.
+        store (QuizStore): The data access of the handlers.
 
     Returns:
         int: The next state of the conversation, which is set to NEW_QUESTION
              if the answer is correct, or GUESS_ANSWER if the answer is incorrect.
     """
-    user_id = update.effective_user.id
-    question = redis_db.get(user_id)
-    question = question.decode("utf-8")
-    user_answer = update.message.text
-    correct_answer = (
-        questions[question].split(". ")[0].lstrip("Ответ:\n").rstrip(".")
+    request = store.load(
+        "handle_solution_attempt", update.effective_user.id, question=True
     )
-
-    if correct_answer.lower() in user_answer.lower():
-        update.message.reply_text("Правильно!")
+    question_id = request.question_id
+    if question_id is None:
+        update.message.reply_text(NO_QUESTION_MESSAGE)
         return start_command(update, context)
-    elif update.message.text == "Сдаться":
-        correct_answer = questions[question].lstrip("Ответ:\n")
-        update.message.reply_text(f"Правильный ответ: {correct_answer}")
-        return start_command(update, context)
-    else:
-        update.message.reply_text("Неправильно. Попробуйте ещё раз.")
-        start_command(update, context)
-        print(correct_answer)
-        return State.GUESS_ANSWER.value
+    outcome = judge_attempt(questions, question_id, update.message.text)
+    request.outcome = outcome
+    store.save("handle_solution_attempt", request)
+    update.message.reply_text(format_verdict(questions, question_id, outcome))
+    start_command(update, context)
+    return get_next_state(outcome).value
+
+
+def handle_score_request(
+    update: Update, context: CallbackContext, store
+) -> None:
+    """
+    Handles a user's request to see their score.
+
+    This function is triggered when the user sends a message containing the
+    text "Мой счёт" or presses the corresponding button on the keyboard.
+
+    Args:
+        update (Update): Incoming update object that contains all the information
+                         about the incoming message.
+        context (CallbackContext): Provides access to context-related data.
+        store (QuizStore): The data access of the handlers.
+
+    Returns:
+        None: The state of the conversation does not change.
+    """
+    request = store.load(
+        "handle_score_request", update.effective_user.id, score=True
+    )
+    update.message.reply_text(format_score(request.score))
+
+
+def handle_selection_command(
+    update: Update, context: CallbackContext, store
+) -> None:
+    """
+    Handles a user's command choosing the questions they get: /tournament,
+    /year or /all.
+
+    Args:
+        update (Update): Incoming update object that contains all the information
+                         about the incoming message.
+        context (CallbackContext): Provides access to context-related data.
+        store (QuizStore): The data access of the handlers.
+
+    Returns:
+        None: The state of the conversation does not change.
+    """
+    selection, reply = choose_selection(store.facets, update.message.text)
+    if selection is not None:
+        request = store.load(
+            "handle_selection_command", update.effective_user.id
+        )
+        request.new_selection = selection
+        store.save("handle_selection_command", request)
+    update.message.reply_text(reply)
 
 
 def cancel(update: Update, context: CallbackContext) -> int:
-    update.message.reply_text("Если хотите, можете начать заново с /start.")
+    update.message.reply_text(CANCEL_MESSAGE)
     return start_command(update, context)
 
 
+class RouteFilter(MessageFilter):
+    """Passes the text messages quiz.route_message sends to an action."""
+
+    __slots__ = ("state", "action")
+
+    def __init__(self, state: State | None, action: Action) -> None:
+        self.state = state
+        self.action = action
+
+    def filter(self, message: Message) -> bool:
+        return (
+            message.text is not None
+            and route_message(message.text, self.state) is self.action
+        )
+
+
+def make_conversation_handler(
+    questions: QuestionBank,
+    store: QuizStore,
+    persistent: bool = False,
+    bot_metrics: BotMetrics | None = None,
+) -> ConversationHandler:
+    """
+    Creates a ConversationHandler for managing the Telegram bot's interaction flow.
+
+    This handler manages the states of the conversation, handling user requests
+    for new questions and solution attempts. Which handler a message goes to
+    in each state is decided by quiz.route_message, which tg_bot_async uses
+    too, so both runtimes behave the same.
+
+    States:
+        - NEW_QUESTION: Triggers when the user requests a new question.
+        - GUESS_ANSWER: Triggers when the user attempts to answer a question.
+
+    In both states "Мой счёт" shows the user's score without changing the state,
+    and /start and /cancel start the conversation over.
+    The /tournament, /year and /all commands choose the questions the user
+    gets, in any state and before /start too.
+
+    Entry Points:
+        - The /start command to initiate the conversation.
+        - The selection commands.
+
+    The handlers keep the id of the current question and the score of each
+    user in Redis, through the store.
+    If persistent, the conversation states are kept in the dispatcher's
+    persistence too, so they survive restarts and are shared by replicas.
+    With BotMetrics the duration of every handler is observed.
+
+    Args:
+        questions (QuestionBank): The bank of questions and their answers.
+        store (QuizStore): The data access of the handlers.
+        persistent (bool): Whether the conversation states are persisted.
+        bot_metrics (BotMetrics | None): The metrics of the bot.
+
+    Returns:
+        ConversationHandler: The handler of the quiz conversation.
+    """
+    callbacks = {
+        Action.START: start_command,
+        Action.CANCEL: cancel,
+        Action.CHOOSE_SELECTION: partial(
+            handle_selection_command, store=store
+        ),
+        Action.SHOW_SCORE: partial(handle_score_request, store=store),
+        Action.NEW_QUESTION: partial(
+            handle_new_question_request, questions=questions, store=store
+        ),
+        Action.ATTEMPT: partial(
+            handle_solution_attempt, questions=questions, store=store
+        ),
+    }
+    if bot_metrics is not None:
+        callbacks = {
+            action: bot_metrics.instrument(action.value, callback)
+            for action, callback in callbacks.items()
+        }
+
+    def get_handlers(state: State | None) -> list[MessageHandler]:
+        return [
+            MessageHandler(RouteFilter(state, action), callback)
+            for action, callback in callbacks.items()
+        ]
+
+    return ConversationHandler(
+        entry_points=get_handlers(None),
+        states={state.value: get_handlers(state) for state in State},
+        fallbacks=[],
+        name=CONVERSATION_NAME,
+        persistent=persistent,
+    )
+
+
+def queue_update(dispatcher: Dispatcher, data: dict) -> None:
+    """Decodes an update received by the webhook and queues it."""
+    dispatcher.update_queue.put(Update.de_json(data, dispatcher.bot))
+
+
+class WebhookBindError(Exception):
+    pass
+
+
+def check_webhook_settings(settings: dict[str, str | int]) -> None:
+    """
+    Checks the settings of webhook mode, which are useless to retry.
+
+    Args:
+        settings (dict[str, str | int]): The bot settings.
+
+    Returns:
+        None
+
+    Raises:
+        ValueError: If the webhook secret token is not set.
+    """
+    if not settings["tg_webhook_secret"]:
+        raise ValueError("TG_WEBHOOK_SECRET is required in webhook mode")
+
+
+def run_webhook(updater: Updater, settings: dict[str, str | int]) -> None:
+    """
+    Receives updates over HTTP instead of long polling.
+
+    Registers the webhook with Telegram and serves it with a WebhookServer,
+    which checks the secret token and puts updates in the same queue the
+    polling loop uses, so the ConversationHandler works unchanged. Several
+    replicas may serve one webhook URL behind a load balancer.
+
+    SIGTERM and SIGINT stop the server. Telegram has already been answered
+    for the queued updates, so they are handled before the dispatcher
+    stops, and the buffered conversation states are saved.
+
+    Args:
+        updater (Updater): The updater whose dispatcher handles the updates.
+        settings (dict[str, str | int]): The bot settings.
+
+    Returns:
+        None
+
+    Raises:
+        ValueError: If the webhook settings are incomplete.
+        WebhookBindError: If the server can't listen on the address.
+    """
+    check_webhook_settings(settings)
+    dispatcher = updater.dispatcher
+    try:
+        server = WebhookServer(
+            (settings["tg_webhook_listen"], settings["tg_webhook_port"]),
+            urlparse(settings["tg_webhook_url"]).path or "/",
+            settings["tg_webhook_secret"],
+            partial(queue_update, dispatcher),
+        )
+    except OSError as bind_error:
+        raise WebhookBindError(
+            f"Не удалось занять адрес webhook: {bind_error}"
+        ) from bind_error
+    threading.Thread(target=dispatcher.start, daemon=True).start()
+
+    def stop_server(signum: int, frame) -> None:
+        logging.info(f"Получен сигнал {signal.Signals(signum).name}")
+        # shutdown waits for serve_forever, which runs in this thread.
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    handlers = {
+        signum: signal.signal(signum, stop_server)
+        for signum in (signal.SIGTERM, signal.SIGINT)
+    }
+    try:
+        updater.bot.set_webhook(
+            settings["tg_webhook_url"],
+            secret_token=settings["tg_webhook_secret"],
+        )
+        server.serve_forever()
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+        # Waits for the requests being served, so that all acknowledged
+        # updates are in the queue. The dispatcher stops once it is empty.
+        server.server_close()
+        dispatcher.stop()
+        if updater.persistence:
+            updater.persistence.flush()
+
+
 def main() -> None:
     """
     Initializes and starts the Telegram bot for handling quiz interactions.
@@ -132,7 +444,12 @@ def main() -> None:
     Redis database connection, logging, and loading questions. It configures
     the updater and dispatcher to manage incoming updates and handlers for
     user interactions through commands and messages. The bot runs in polling
-    mode, continuously checking for new messages and responding accordingly.
+    mode, continuously checking for new messages and responding accordingly,
+    or in webhook mode if TG_WEBHOOK_URL is set. The metrics of the bot are
+    served over HTTP if METRICS_PORT is set. When the bot stops, the queued
+    messages are sent before it exits. After an error the bot is restarted
+    with a growing delay, but not when the webhook settings are wrong or
+    its address is taken.
 
     The ConversationHandler is used to manage different states of the
     conversation, facilitating the transition between requesting a new question
@@ -147,73 +464,96 @@ def main() -> None:
         Exception: For any other exception that occurs during bot operation.
     """
     settings = setup_settings()
-    redis_db: redis.Redis = redis.from_url(settings["redis_url"])
-    logger: logging.Logger = setup_logging(settings)
-    questions: dict[str, str] = load_questions(settings)
-    updater: Updater = Updater(settings["tg_bot_token"])
+    if settings["tg_webhook_url"]:
+        check_webhook_settings(settings)
+    redis_db: redis.Redis = connect(settings["redis_url"])
+    bot_metrics = BotMetrics()
+    scheduler = OutboundScheduler(
+        TELEGRAM_RATE,
+        TELEGRAM_CHAT_RATE,
+        TELEGRAM_CHAT_BURST,
+        get_telegram_retry_after,
+        senders=OUTBOUND_SENDERS,
+        bot_metrics=bot_metrics,
+    )
+    bot = ScheduledBot(
+        settings["tg_bot_token"],
+        scheduler,
+        log_chat_id=settings["tg_admin_chat_id"],
+        request=Request(con_pool_size=OUTBOUND_SENDERS + 8),
+    )
+    logger: logging.Logger = setup_logging(settings, bot)
+    questions: QuestionBank = load_questions(settings)
+    updater: Updater = Updater(bot=bot, persistence=RedisPersistence(redis_db))
     dispatcher: Dispatcher = updater.dispatcher
-    """
-    Creates a ConversationHandler for managing the Telegram bot's interaction flow.
-    
-    This handler manages the states of the conversation, handling user requests
-    for new questions and solution attempts. It defines entry points for starting
-    the conversation and fallbacks for canceling it.
-    
-    States:
-        - NEW_QUESTION: Triggers when the user requests a new question.
-        - GUESS_ANSWER: Triggers when the user attempts to answer a question.
-    
-    Entry Points:
-        - CommandHandler for the "start" command to initiate the conversation.
-    
-    Fallbacks:
-        - CommandHandler for the "cancel" command to end the conversation.
-    
-    The handler uses Redis to track the current question for each user.
-    """
-    conversation_handler = ConversationHandler(
-        entry_points=[CommandHandler("start", start_command)],
-        states={
-            State.NEW_QUESTION.value: [
-                MessageHandler(
-                    Filters.text
-                    & ~Filters.command
-                    & Filters.regex("^Новый вопрос$"),
-                    partial(
-                        handle_new_question_request,
-                        questions=questions,
-                        redis_db=redis_db,
-                    ),
-                ),
-            ],
-            State.GUESS_ANSWER.value: [
-                MessageHandler(
-                    Filters.text & ~Filters.command,
-                    partial(
-                        handle_solution_attempt,
-                        questions=questions,
-                        redis_db=redis_db,
-                    ),
-                )
-            ],
-        },
-        fallbacks=[CommandHandler("cancel", cancel)],
+    cache = start_session_cache(
+        redis_db,
+        TG_PLATFORM,
+        settings["session_cache_size"],
+        settings["session_cache_ttl"],
+    )
+    store = QuizStore(
+        redis_db,
+        questions,
+        TG_PLATFORM,
+        cache=cache,
+        session_ttl=settings["session_ttl"],
+        bot_metrics=bot_metrics,
+        facets=load_facets(settings, questions),
+    )
+    dispatcher.add_handler(
+        TypeHandler(Update, lambda update, context: bot_metrics.updates.inc()),
+        group=-1,
+    )
+    dispatcher.add_handler(
+        make_conversation_handler(
+            questions, store, persistent=True, bot_metrics=bot_metrics
+        )
+    )
+    SessionCompactor(redis_db, questions, settings["session_ttl"])
+    bot_metrics.watch_corpus(lambda: len(questions))
+    bot_metrics.watch_queue("updates", dispatcher.update_queue.qsize)
+    bot_metrics.watch_queue("outbound", lambda: scheduler.metrics().queued)
+    if cache is not None:
+        bot_metrics.watch_cache(cache.metrics)
+    start_metrics_server(
+        bot_metrics.registry,
+        settings["metrics_listen"],
+        settings["metrics_port"],
     )
-
-    dispatcher.add_handler(conversation_handler)
 
     bot_start_log_message: str = "tg_bot started"
     logging.info(bot_start_log_message)
     logger.info(bot_start_log_message)
 
-    while True:
-        try:
-            updater.start_polling()
-            updater.idle()
-        except ConnectionError as connection_error:
-            logging.error(f"Ошибка сети {connection_error}")
-        except Exception:
-            logger.error(f"Бот упал с ошибкой: {traceback.format_exc()}")
+    restart_delay = MIN_RESTART_DELAY
+    try:
+        while True:
+            started_at = time.monotonic()
+            try:
+                if settings["tg_webhook_url"]:
+                    run_webhook(updater, settings)
+                else:
+                    updater.start_polling()
+                    updater.idle()
+                break
+            except KeyboardInterrupt:
+                break
+            except WebhookBindError as bind_error:
+                logger.error(str(bind_error))
+                raise
+            except ConnectionError as connection_error:
+                logging.error(f"Ошибка сети {connection_error}")
+            except Exception:
+                logger.error(f"Бот упал с ошибкой: {traceback.format_exc()}")
+            # A bot that ran for a while starts again soon, one failing
+            # at once waits longer and longer.
+            if time.monotonic() - started_at > MAX_RESTART_DELAY:
+                restart_delay = MIN_RESTART_DELAY
+            time.sleep(restart_delay)
+            restart_delay = min(restart_delay * 2, MAX_RESTART_DELAY)
+    finally:
+        scheduler.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,506 @@
+import asyncio
+from dataclasses import dataclass
+from functools import partial
+import json
+import logging
+import traceback
+
+import aiohttp
+import redis.asyncio
+
+from outbound import (
+    TELEGRAM_CHAT_BURST,
+    TELEGRAM_CHAT_RATE,
+    TELEGRAM_RATE,
+    ChatBuckets,
+    TokenBucket,
+)
+from persistence import (
+    CONVERSATION_NAME,
+    get_conversation_field,
+    get_conversations_key,
+)
+from facets import FacetIndex
+from question_bank import QuestionBank
+from quiz import (
+    CANCEL_MESSAGE,
+    KEYBOARD,
+    START_MESSAGE,
+    Action,
+    State,
+    choose_selection,
+    format_verdict,
+    get_next_state,
+    get_possible_actions,
+    judge_attempt,
+    route_message,
+)
+from scores import format_score
+from session_cache import SessionCache, start_session_cache
+from sessions import (
+    NO_QUESTION_MESSAGE,
+    SESSION_TTL,
+    TG_PLATFORM,
+    SessionCompactor,
+)
+from settings import (
+    setup_settings,
+    setup_logging,
+    load_facets,
+    load_questions,
+)
+from storage import AsyncQuizStore, UserRequest, connect, connect_async
+
+
+POLLING_TIMEOUT = 30
+# Each update being handled holds at most one Redis connection at a time,
+# so the pool of the bot has as many connections as this.
+MAX_CONCURRENT_UPDATES = 100
+
+
+class TelegramApiError(Exception):
+    pass
+
+
+@dataclass
+class IncomingMessage:
+    chat_id: int
+    user_id: int
+    text: str
+
+    @classmethod
+    def from_update(cls, update: dict) -> "IncomingMessage | None":
+        """
+        Extracts a text message from a Telegram update.
+
+        Args:
+            update (dict): An update as returned by getUpdates.
+
+        Returns:
+            IncomingMessage | None: The message, or None if the update is
+                not a text message.
+        """
+        message = update.get("message")
+        if not message or "text" not in message or "from" not in message:
+            return None
+        return cls(
+            chat_id=message["chat"]["id"],
+            user_id=message["from"]["id"],
+            text=message["text"],
+        )
+
+
+@dataclass
+class PollingOffset:
+    """
+    The id of the next update to fetch. It outlives the event loop of the
+    bot, so after a restart the bot doesn't fetch the updates it has
+    already handled.
+    """
+
+    value: int = 0
+
+
+class TelegramApi:
+    """Minimal asynchronous client of the Telegram Bot API."""
+
+    def __init__(
+        self,
+        token: str,
+        session: aiohttp.ClientSession,
+        base_url: str = "https://api.telegram.org",
+    ) -> None:
+        """
+        Initializes a TelegramApi instance.
+
+        Args:
+            token (str): The Telegram bot token.
+            session (ClientSession): The HTTP session used for requests.
+            base_url (str): The Bot API server, e.g. a local Bot API server.
+
+        Returns:
+            None
+        """
+        self.session = session
+        self.url = f"{base_url}/bot{token}"
+        self.bucket = TokenBucket(TELEGRAM_RATE, TELEGRAM_RATE)
+        self.chat_buckets = ChatBuckets(
+            TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST
+        )
+
+    async def call(self, method: str, **params) -> object:
+        """
+        Calls a Bot API method.
+
+        Args:
+            method (str): The method name, e.g. "sendMessage".
+            **params: The method parameters.
+
+        Returns:
+            object: The "result" field of the response.
+
+        If the Bot API asks to slow down with a 429 response, the call is
+        repeated after the requested delay.
+
+        Raises:
+            TelegramApiError: If the Bot API reports an error.
+        """
+        while True:
+            async with self.session.post(
+                f"{self.url}/{method}", json=params
+            ) as response:
+                data = await response.json()
+            if data.get("ok"):
+                return data["result"]
+            retry_after = data.get("parameters", {}).get("retry_after")
+            if retry_after is None:
+                raise TelegramApiError(
+                    data.get("description", "unknown error")
+                )
+            logging.warning(f"Отправка приостановлена на {retry_after} с")
+            await asyncio.sleep(retry_after)
+
+    async def get_updates(self, offset: int, timeout: int) -> list[dict]:
+        return await self.call("getUpdates", offset=offset, timeout=timeout)
+
+    async def send_message(
+        self, chat_id: int, text: str, keyboard: list[list[str]] | None = None
+    ) -> None:
+        """
+        Sends a message within the global and per-chat rate limits.
+
+        Args:
+            chat_id (int): The chat to send the message to.
+            text (str): The message text.
+            keyboard (list[list[str]] | None): The reply keyboard buttons.
+
+        Returns:
+            None
+        """
+        delay = max(
+            self.bucket.reserve(), self.chat_buckets.get(chat_id).reserve()
+        )
+        if delay:
+            await asyncio.sleep(delay)
+        params = {"chat_id": chat_id, "text": text}
+        if keyboard is not None:
+            params["reply_markup"] = json.dumps({"keyboard": keyboard})
+        await self.call("sendMessage", **params)
+
+
+class AsyncQuizBot:
+    """
+    Asyncio runtime of the Telegram quiz bot.
+
+    Every update is handled in its own task, so one process serves many
+    conversations at once without a thread per update. Updates of the same
+    chat are still handled one after another, in the order they arrive.
+    At most max_concurrent_updates updates are handled or wait for their
+    chat at a time. Once there are that many, the bot stops fetching
+    updates, so under overload they wait at Telegram, not in memory.
+    """
+
+    def __init__(
+        self,
+        api: TelegramApi,
+        questions: QuestionBank,
+        redis_db: redis.asyncio.Redis,
+        max_concurrent_updates: int = MAX_CONCURRENT_UPDATES,
+        cache: SessionCache | None = None,
+        session_ttl: int = SESSION_TTL,
+        facets: FacetIndex | None = None,
+    ) -> None:
+        """
+        Initializes an AsyncQuizBot instance.
+
+        Args:
+            api (TelegramApi): The Telegram Bot API client.
+            questions (QuestionBank): The bank of questions and their answers.
+            redis_db (redis.asyncio.Redis): An asynchronous Redis client.
+            max_concurrent_updates (int): How many updates may be handled at
+                the same time, counting those waiting for their chat.
+            cache (SessionCache | None): The cache of the current questions.
+            session_ttl (int): How many seconds a session lives without
+                activity.
+            facets (FacetIndex | None): The questions of the tournaments and
+                years users can choose.
+
+        Returns:
+            None
+        """
+        self.api = api
+        self.questions = questions
+        self.redis_db = redis_db
+        self.store = AsyncQuizStore(
+            redis_db,
+            questions,
+            TG_PLATFORM,
+            cache=cache,
+            session_ttl=session_ttl,
+            facets=facets,
+        )
+        self.conversations_key = get_conversations_key(CONVERSATION_NAME)
+        self._chat_tails: dict[int, asyncio.Task] = {}
+        self._concurrency = asyncio.Semaphore(max_concurrent_updates)
+
+    async def load_state(self, message: IncomingMessage) -> State | None:
+        """
+        Reads the conversation state from Redis, where tg_bot keeps it too,
+        so both runtimes and all their replicas share the conversations.
+
+        Args:
+            message (IncomingMessage): A message of the conversation.
+
+        Returns:
+            State | None: The state, or None outside of a conversation.
+        """
+        state = await self.redis_db.hget(
+            self.conversations_key,
+            get_conversation_field((message.chat_id, message.user_id)),
+        )
+        return None if state is None else State(int(state))
+
+    async def start_command(self, message: IncomingMessage) -> State:
+        await self.api.send_message(message.chat_id, START_MESSAGE, KEYBOARD)
+        return State.NEW_QUESTION
+
+    async def handle_new_question_request(
+        self, message: IncomingMessage, request: UserRequest
+    ) -> State:
+        question_id = request.unseen_question_id
+        await self.api.send_message(
+            message.chat_id, self.questions.question(question_id)
+        )
+        request.new_question_id = question_id
+        return State.GUESS_ANSWER
+
+    async def handle_solution_attempt(
+        self, message: IncomingMessage, request: UserRequest
+    ) -> State:
+        question_id = request.question_id
+        if question_id is None:
+            await self.api.send_message(message.chat_id, NO_QUESTION_MESSAGE)
+            return await self.start_command(message)
+        outcome = judge_attempt(self.questions, question_id, message.text)
+        request.outcome = outcome
+        await self.api.send_message(
+            message.chat_id,
+            format_verdict(self.questions, question_id, outcome),
+        )
+        await self.start_command(message)
+        return get_next_state(outcome)
+
+    async def handle_score_request(
+        self, message: IncomingMessage, request: UserRequest
+    ) -> None:
+        await self.api.send_message(
+            message.chat_id, format_score(request.score)
+        )
+
+    async def handle_selection_command(
+        self, message: IncomingMessage, request: UserRequest
+    ) -> None:
+        selection, reply = choose_selection(self.store.facets, message.text)
+        request.new_selection = selection
+        await self.api.send_message(message.chat_id, reply)
+
+    async def cancel(self, message: IncomingMessage) -> State:
+        await self.api.send_message(message.chat_id, CANCEL_MESSAGE)
+        return await self.start_command(message)
+
+    async def handle_message(self, message: IncomingMessage) -> None:
+        """
+        Routes a message with quiz.route_message, which the
+        ConversationHandler of tg_bot is built from too.
+
+        The state and the data the message may need are read from Redis in
+        one round trip before routing, and all the changes are written in
+        another one after it.
+
+        Args:
+            message (IncomingMessage): The incoming message.
+
+        Returns:
+            None
+        """
+        actions = get_possible_actions(message.text)
+        if not actions:
+            return
+        request = await self.store.load(
+            "handle_message",
+            message.user_id,
+            conversation=(message.chat_id, message.user_id),
+            question=Action.ATTEMPT in actions,
+            score=Action.SHOW_SCORE in actions,
+            new_question=Action.NEW_QUESTION in actions,
+        )
+        state = None if request.state is None else State(request.state)
+        action = route_message(message.text, state)
+        if action is Action.START:
+            new_state = await self.start_command(message)
+        elif action is Action.CANCEL:
+            new_state = await self.cancel(message)
+        elif action is Action.CHOOSE_SELECTION:
+            new_state = await self.handle_selection_command(message, request)
+        elif action is Action.SHOW_SCORE:
+            new_state = await self.handle_score_request(message, request)
+        elif action is Action.NEW_QUESTION:
+            new_state = await self.handle_new_question_request(
+                message, request
+            )
+        elif action is Action.ATTEMPT:
+            new_state = await self.handle_solution_attempt(message, request)
+        else:
+            return
+        if new_state is not None:
+            request.new_state = new_state.value
+        await self.store.save("handle_message", request)
+
+    async def dispatch(self, update: dict) -> None:
+        """
+        Schedules an update to be handled in the background.
+
+        Waits while max_concurrent_updates updates are being handled. The
+        task of an update waits for the previous task of the same chat,
+        which keeps the order of messages within a conversation.
+
+        Args:
+            update (dict): An update as returned by getUpdates.
+
+        Returns:
+            None
+        """
+        message = IncomingMessage.from_update(update)
+        if message is None:
+            return
+        await self._concurrency.acquire()
+        previous_task = self._chat_tails.get(message.chat_id)
+        task = asyncio.create_task(self._handle_after(previous_task, message))
+        self._chat_tails[message.chat_id] = task
+        task.add_done_callback(partial(self._finish_task, message.chat_id))
+
+    async def _handle_after(
+        self, previous_task: asyncio.Task | None, message: IncomingMessage
+    ) -> None:
+        if previous_task is not None:
+            await asyncio.wait([previous_task])
+        try:
+            await self.handle_message(message)
+        except Exception:
+            logging.exception(f"Ошибка обработки сообщения {message}")
+
+    def _finish_task(self, chat_id: int, task: asyncio.Task) -> None:
+        self._concurrency.release()
+        if self._chat_tails.get(chat_id) is task:
+            del self._chat_tails[chat_id]
+
+    async def drain(self) -> None:
+        """Waits until all scheduled updates are handled."""
+        while self._chat_tails:
+            await asyncio.wait(list(self._chat_tails.values()))
+
+    async def run_polling(self, offset: PollingOffset | None = None) -> None:
+        """
+        Receives updates with long polling and dispatches them forever.
+
+        Args:
+            offset (PollingOffset | None): The id of the next update to
+                fetch, advanced as the updates are dispatched.
+
+        Returns:
+            None
+        """
+        if offset is None:
+            offset = PollingOffset()
+        while True:
+            updates = await self.api.get_updates(offset.value, POLLING_TIMEOUT)
+            for update in updates:
+                await self.dispatch(update)
+                offset.value = update["update_id"] + 1
+
+
+async def run_bot(
+    settings: dict[str, str | int],
+    questions: QuestionBank,
+    cache: SessionCache | None = None,
+    facets: FacetIndex | None = None,
+    offset: PollingOffset | None = None,
+) -> None:
+    """
+    Connects to Telegram and Redis and runs the bot until it is cancelled
+    or fails.
+
+    Either way the updates already fetched are handled before it returns,
+    so that a restart with the same offset neither loses nor repeats them.
+
+    Args:
+        settings (dict[str, str | int]): The bot settings.
+        questions (QuestionBank): The bank of questions and their answers.
+        cache (SessionCache | None): The cache of the current questions.
+        facets (FacetIndex | None): The questions of the tournaments and
+            years users can choose.
+        offset (PollingOffset | None): The id of the next update to fetch.
+
+    Returns:
+        None
+    """
+    redis_db = connect_async(settings["redis_url"], MAX_CONCURRENT_UPDATES)
+    timeout = aiohttp.ClientTimeout(total=POLLING_TIMEOUT + 10)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        bot = AsyncQuizBot(
+            TelegramApi(settings["tg_bot_token"], session),
+            questions,
+            redis_db,
+            cache=cache,
+            session_ttl=settings["session_ttl"],
+            facets=facets,
+        )
+        try:
+            await bot.run_polling(offset)
+        finally:
+            await bot.drain()
+
+
+def main() -> None:
+    """
+    Starts the Telegram quiz bot on the asyncio runtime.
+
+    The bot behaves like tg_bot.py, but handles updates as asyncio tasks
+    with an asynchronous Redis client instead of a pool of worker threads.
+
+    Returns:
+        None
+    """
+    settings = setup_settings()
+    logger: logging.Logger = setup_logging(settings)
+    questions = load_questions(settings)
+    facets = load_facets(settings, questions)
+    # The cache and the compactor outlive the event loops. They are threads
+    # with connections of their own.
+    redis_db = connect(settings["redis_url"], max_connections=2)
+    cache = start_session_cache(
+        redis_db,
+        TG_PLATFORM,
+        settings["session_cache_size"],
+        settings["session_cache_ttl"],
+    )
+    SessionCompactor(redis_db, questions, settings["session_ttl"])
+
+    bot_start_log_message: str = "tg_bot_async started"
+    logging.info(bot_start_log_message)
+    logger.info(bot_start_log_message)
+
+    offset = PollingOffset()
+    while True:
+        try:
+            asyncio.run(run_bot(settings, questions, cache, facets, offset))
+        except KeyboardInterrupt:
+            break
+        except (aiohttp.ClientError, asyncio.TimeoutError) as network_error:
+            logging.error(f"Ошибка сети {network_error}")
+        except Exception:
+            logger.error(f"Бот упал с ошибкой: {traceback.format_exc()}")
+
+
+if __name__ == "__main__":
+    main()
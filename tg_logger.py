@@ -1,19 +1,90 @@
 import logging
+import queue
+import threading
+import time
 
 import telegram
 
 
 logger = logging.getLogger("bot_logger")
 
+MAX_MESSAGE_LENGTH = 4096
+MAX_QUEUED_RECORDS = 1000
+BATCH_INTERVAL = 2.0
+_STOP = object()
+
+
+def pack_messages(entries: list[str], dropped: int = 0) -> list[str]:
+    """
+    Packs formatted log records into as few messages as possible.
+
+    Repeated records are sent once with the number of repeats, in the order
+    of their first occurrence. Every message fits in the Telegram limit of
+    MAX_MESSAGE_LENGTH characters; a longer record keeps its end, where the
+    exception of a traceback is.
+
+    Args:
+        entries (list[str]): Formatted log records.
+        dropped (int): The number of records dropped because the queue was
+            full.
+
+    Returns:
+        list[str]: The message texts.
+    """
+    repeats: dict[str, int] = {}
+    for entry in entries:
+        repeats[entry] = repeats.get(entry, 0) + 1
+    blocks = [
+        entry if count == 1 else f"[×{count}] {entry}"
+        for entry, count in repeats.items()
+    ]
+    if dropped:
+        blocks.append(f"Пропущено записей из-за переполнения: {dropped}")
+
+    messages = []
+    message = ""
+    for block in blocks:
+        if len(block) > MAX_MESSAGE_LENGTH:
+            block = "…" + block[-MAX_MESSAGE_LENGTH + 1 :]
+        if not message:
+            message = block
+        elif len(message) + 2 + len(block) <= MAX_MESSAGE_LENGTH:
+            message = f"{message}\n\n{block}"
+        else:
+            messages.append(message)
+            message = block
+    if message:
+        messages.append(message)
+    return messages
+
 
 class TelegramLogsHandler(logging.Handler):
-    def __init__(self, bot: telegram.Bot, chat_id: int) -> None:
+    """
+    Sends log records to a Telegram chat from a background thread.
+
+    emit only puts the formatted record in a bounded queue, so logging never
+    waits for the Bot API. The sender thread collects the records that
+    arrive within batch_interval seconds and sends them packed by
+    pack_messages, which keeps an error storm to a few messages. When the
+    queue is full new records are dropped and only counted.
+    """
+
+    def __init__(
+        self,
+        bot: telegram.Bot,
+        chat_id: int,
+        max_queued_records: int = MAX_QUEUED_RECORDS,
+        batch_interval: float = BATCH_INTERVAL,
+    ) -> None:
         """
-        Initializes a TelegramLogsHandler instance.
+        Initializes a TelegramLogsHandler instance and starts its sender.
 
         Args:
             bot (telegram.Bot): Telegram Bot API object.
             chat_id (int): The Telegram chat ID where logs will be sent.
+            max_queued_records (int): How many records may wait to be sent.
+            batch_interval (float): How long the sender collects records
+                before sending them, in seconds.
 
         Returns:
             None
@@ -21,13 +92,16 @@ class TelegramLogsHandler(logging.Handler):
         super().__init__()
         self.bot = bot
         self.chat_id = chat_id
+        self.batch_interval = batch_interval
+        self.records: queue.Queue = queue.Queue(max_queued_records)
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+        self._sender = threading.Thread(target=self._send_forever, daemon=True)
+        self._sender.start()
 
     def emit(self, record: logging.LogRecord) -> None:
         """
-        Sends a log record to a Telegram chat.
-
-        This method formats the specified log record and sends it as a message
-        to the configured Telegram chat using the bot instance.
+        Queues a log record to be sent to a Telegram chat.
 
         Args:
             record (logging.LogRecord): The log record to be sent, containing
@@ -35,22 +109,79 @@ class TelegramLogsHandler(logging.Handler):
         Returns:
             None
         """
-        log_entry = self.format(record)
-        self.bot.send_message(text=log_entry, chat_id=self.chat_id)
+        try:
+            log_entry = self.format(record)
+        except Exception:
+            self.handleError(record)
+            return
+        try:
+            self.records.put_nowait(log_entry)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+    def flush(self) -> None:
+        """Waits until all queued records are sent."""
+        if self._sender.is_alive():
+            self.records.join()
+
+    def close(self) -> None:
+        """Sends the queued records and stops the sender thread."""
+        if self._sender.is_alive():
+            self.records.put(_STOP)
+            self._sender.join()
+        super().close()
+
+    def _send_forever(self) -> None:
+        stopping = False
+        while not stopping:
+            entries = [self.records.get()]
+            deadline = time.monotonic() + self.batch_interval
+            while entries[-1] is not _STOP:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    entries.append(self.records.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            if entries[-1] is _STOP:
+                stopping = True
+                entries.pop()
+            with self._dropped_lock:
+                dropped, self.dropped = self.dropped, 0
+            for message in pack_messages(entries, dropped):
+                self._send(message)
+            for _ in range(len(entries) + stopping):
+                self.records.task_done()
+
+    def _send(self, text: str) -> None:
+        try:
+            self.bot.send_message(text=text, chat_id=self.chat_id)
+        except telegram.error.RetryAfter as error:
+            time.sleep(error.retry_after)
+            self._send(text)
+        except Exception as error:
+            logging.error(f"Не удалось отправить лог в Telegram: {error}")
 
 
-def set_telegram_logger(bot_token: str, admin_chat_id: int) -> logging.Logger:
+def set_telegram_logger(
+    bot_token: str, admin_chat_id: int, bot: telegram.Bot | None = None
+) -> logging.Logger:
     """
     Configures a logger instance to send log records to a Telegram chat.
 
     Args:
         bot_token (str): The Telegram Bot API token.
         admin_chat_id (int): The Telegram chat ID where logs will be sent.
+        bot (telegram.Bot | None): The bot sending the log records, a new one
+            if not given.
 
     Returns:
         logging.Logger: A logger instance configured to send logs to the specified Telegram chat.
     """
-    bot = telegram.Bot(bot_token)
+    if bot is None:
+        bot = telegram.Bot(bot_token)
     logger.setLevel(logging.INFO)
     logger.addHandler(TelegramLogsHandler(bot, admin_chat_id))
     return logger
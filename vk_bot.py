@@ -1,39 +1,43 @@
+from collections.abc import Iterable
 import logging
-import random
 import traceback
 
 import redis
 import vk_api as vk
 from vk_api.keyboard import VkKeyboard, VkKeyboardColor
-from vk_api.longpoll import VkLongPoll, VkEventType
+from vk_api.longpoll import Event, VkLongPoll, VkEventType
 
-from settings import setup_settings, setup_logging, load_questions
-
-
-def make_keyboard(
-    event: VkEventType, vk_api: vk.vk_api.VkApiMethod, keyboard: VkKeyboard
-) -> None:
-    """
-    Sends a message with a keyboard to the user.
-
-    Args:
-        event: The event object containing the user's data.
-        vk_api: The VK API object.
-        keyboard: The keyboard to be sent.
-    """
-    vk_api.messages.send(
-        user_id=event.user_id,
-        message="Напряги извилины",
-        keyboard=keyboard.get_keyboard(),
-        random_id=random.randint(1, 1000),
-    )
+from dispatcher import OrderedWorkerPool
+from metrics import BotMetrics, start_metrics_server
+from outbound import VK_RATE
+from question_bank import QuestionBank
+from quiz import (
+    GIVE_UP_TEXT,
+    NEW_QUESTION_TEXT,
+    SCORE_TEXT,
+    choose_selection,
+    format_verdict,
+    get_selection_command,
+    judge_attempt,
+)
+from scores import format_score
+from session_cache import start_session_cache
+from sessions import NO_QUESTION_MESSAGE, VK_PLATFORM, SessionCompactor
+from settings import (
+    setup_settings,
+    setup_logging,
+    load_facets,
+    load_questions,
+)
+from storage import QuizStore, UserRequest, connect
+from vk_replies import ReplySender, VkReply
 
 
 def handle_new_question_request(
     event: VkEventType,
-    vk_api: vk.vk_api.VkApiMethod,
-    questions: dict[str, str],
-    redis_db: redis.Redis,
+    reply: VkReply,
+    questions: QuestionBank,
+    request: UserRequest,
 ) -> None:
     """
     Handles a user's request to receive a new question.
@@ -43,76 +47,150 @@ def handle_new_question_request(
 
     Args:
         event (VkEventType): The event object containing the user's data.
-        vk_api (VkApiMethod): The VK API object.
-        questions (dict[str, str]): A dictionary containing questions as keys and their
-            corresponding answers as values.
-        redis_db (Redis): A Redis database client object.
+        reply (VkReply): The reply to the event, collecting the messages.
+        questions (QuestionBank): The bank of questions and their answers.
+        request (UserRequest): The user's data with a question the user
+            hasn't seen, the question is saved in it.
 
     Returns:
         None
     """
-    random_question = random.choice(list(questions.keys()))
-    vk_api.messages.send(
-        message=random_question,
-        user_id=event.user_id,
-        random_id=random.randint(1, 1000),
-    )
-    redis_db.set(event.user_id, str(random_question))
+    question_id = request.unseen_question_id
+    reply.add(questions.question(question_id))
+    request.new_question_id = question_id
 
 
 def handle_solution_attempt(
     event: VkEventType,
-    vk_api: vk.vk_api.VkApiMethod,
-    questions: dict[str, str],
-    redis_db: redis.Redis,
+    reply: VkReply,
+    questions: QuestionBank,
+    request: UserRequest,
 ) -> None:
     """
     Handles a user's attempt to answer the current question.
 
     This function is triggered when the user sends a message containing their
     answer to the current question. The function checks if the answer is correct,
-    and if so, sends a congratulatory message. If the answer is incorrect, sends
-    a message with the correct answer or prompts to try again.
+    and if so, adds a congratulatory message to the reply. If the answer is
+    incorrect, adds a message with the correct answer or prompts to try again.
+    The outcome is added to the user's score.
 
     Args:
         event (VkEventType): The event object containing the user's data.
-        vk_api (VkApiMethod): The VK API object.
-        questions (dict[str, str]): A dictionary containing questions as keys and their
-            corresponding answers as values.
-        redis_db (Redis): A Redis database client object.
+        reply (VkReply): The reply to the event, collecting the messages.
+        questions (QuestionBank): The bank of questions and their answers.
+        request (UserRequest): The user's data with the current question,
+            the outcome is saved in it.
 
     Returns:
         None
     """
-    user_id = event.user_id
-    question = redis_db.get(user_id)
-
-    question = question.decode("utf-8")
-    user_answer = event.text
-    correct_answer = (
-        questions[question].split(". ")[0].lstrip("Ответ:\n").rstrip(".")
+    question_id = request.question_id
+    if question_id is None:
+        reply.add(NO_QUESTION_MESSAGE)
+        return
+    request.outcome = judge_attempt(questions, question_id, event.text)
+    # A new question follows every answer, so a wrong one isn't retried.
+    reply.add(
+        format_verdict(
+            questions, question_id, request.outcome, can_retry=False
+        )
     )
 
-    if correct_answer.lower() in user_answer.lower():
-        vk_api.messages.send(
-            message="Правильно!",
-            user_id=event.user_id,
-            random_id=random.randint(1, 1000),
-        )
-    elif event.text == "Сдаться":
-        correct_answer = questions[question].lstrip("Ответ:\n")
-        vk_api.messages.send(
-            message=f"Правильный ответ: {correct_answer}",
-            user_id=event.user_id,
-            random_id=random.randint(1, 1000),
-        )
+
+def handle_score_request(
+    event: VkEventType,
+    reply: VkReply,
+    request: UserRequest,
+) -> None:
+    """
+    Handles a user's request to see their score.
+
+    This function is triggered when the user sends a message containing the
+    text "Мой счёт" or presses the corresponding button on the keyboard.
+
+    Args:
+        event (VkEventType): The event object containing the user's data.
+        reply (VkReply): The reply to the event, collecting the messages.
+        request (UserRequest): The user's data with the score.
+
+    Returns:
+        None
+    """
+    reply.add(format_score(request.score))
+
+
+def handle_selection_command(
+    event: VkEventType,
+    reply: VkReply,
+    store: QuizStore,
+) -> None:
+    """
+    Handles a user's command choosing the questions they get: /tournament,
+    /year or /all.
+
+    Args:
+        event (VkEventType): The event object containing the user's data.
+        reply (VkReply): The reply to the event, collecting the messages.
+        store (QuizStore): The data access of the handlers.
+
+    Returns:
+        None
+    """
+    selection, text = choose_selection(store.facets, event.text)
+    if selection is not None:
+        request = store.load("handle_event", event.user_id)
+        request.new_selection = selection
+        store.save("handle_event", request)
+    reply.add(text)
+
+
+def handle_event(
+    event: VkEventType,
+    replies: ReplySender,
+    questions: QuestionBank,
+    store: QuizStore,
+    keyboard: VkKeyboard,
+) -> None:
+    """
+    Handles a message from the user to the bot.
+
+    Either shows the user's score, or chooses the questions the user gets,
+    or checks the user's answer to the current question and sends a new
+    question. Everything the handlers say goes into
+    one reply together with the keyboard, which costs a single messages.send.
+    The user's data is read from Redis in one round trip and the changes are
+    written in another.
+
+    Args:
+        event (VkEventType): The event object containing the user's data.
+        replies (ReplySender): The sender of the replies.
+        questions (QuestionBank): The bank of questions and their answers.
+        store (QuizStore): The data access of the handlers.
+        keyboard (VkKeyboard): The keyboard to be sent.
+
+    Returns:
+        None
+    """
+    reply = VkReply(event.user_id, keyboard=keyboard)
+    if event.text == SCORE_TEXT:
+        request = store.load("handle_event", event.user_id, score=True)
+        handle_score_request(event, reply, request)
+    elif get_selection_command(event.text) is not None:
+        handle_selection_command(event, reply, store)
     else:
-        vk_api.messages.send(
-            message="Неправильно",
-            user_id=event.user_id,
-            random_id=random.randint(1, 1000),
+        is_attempt = event.text != NEW_QUESTION_TEXT
+        request = store.load(
+            "handle_event",
+            event.user_id,
+            question=is_attempt,
+            new_question=True,
         )
-        print(correct_answer)
+        if is_attempt:
+            handle_solution_attempt(event, reply, questions, request)
+        handle_new_question_request(event, reply, questions, request)
+        store.save("handle_event", request)
+    replies.send(reply)
 
 
 def set_keyboard() -> VkKeyboard:
@@ -123,21 +201,72 @@ def set_keyboard() -> VkKeyboard:
         VkKeyboard: A VkKeyboard object with the keyboard layout.
     """
     keyboard: VkKeyboard = VkKeyboard(one_time=True)
-    keyboard.add_button("Новый вопрос", color=VkKeyboardColor.POSITIVE)
-    keyboard.add_button("Сдаться", color=VkKeyboardColor.NEGATIVE)
+    keyboard.add_button(NEW_QUESTION_TEXT, color=VkKeyboardColor.POSITIVE)
+    keyboard.add_button(GIVE_UP_TEXT, color=VkKeyboardColor.NEGATIVE)
     keyboard.add_line()
-    keyboard.add_button("Мой счёт", color=VkKeyboardColor.PRIMARY)
+    keyboard.add_button(SCORE_TEXT, color=VkKeyboardColor.PRIMARY)
     return keyboard
 
 
+def serve_events(
+    events: Iterable[Event],
+    vk_api: vk.vk_api.VkApiMethod,
+    questions: QuestionBank,
+    store: QuizStore,
+    workers: int,
+    bot_metrics: BotMetrics,
+    reply_rate: float = VK_RATE,
+) -> None:
+    """
+    Handles the messages of a long poll until it ends.
+
+    Messages from users to the bot are handled by handle_event on a pool of
+    worker threads: messages of different users are handled concurrently,
+    messages of one user in the order they arrived. Replies are sent by a
+    ReplySender, which batches them under load. The queued messages are
+    handled and the replies sent before returning.
+
+    Args:
+        events (Iterable[Event]): The events of the long poll.
+        vk_api (VkApiMethod): The VK API object.
+        questions (QuestionBank): The bank of questions and their answers.
+        store (QuizStore): The data access of the handlers.
+        workers (int): The number of worker threads.
+        bot_metrics (BotMetrics): The metrics of the bot.
+        reply_rate (float): API requests per second allowed for the token.
+
+    Returns:
+        None
+    """
+    keyboard: VkKeyboard = set_keyboard()
+    timed_handle_event = bot_metrics.instrument("handle_event", handle_event)
+    with ReplySender(
+        vk_api, reply_rate, bot_metrics
+    ) as replies, OrderedWorkerPool(workers) as pool:
+        bot_metrics.watch_queue("events", pool.queued)
+        bot_metrics.watch_queue("replies", replies.replies.qsize)
+        for event in events:
+            if event.type != VkEventType.MESSAGE_NEW or not event.to_me:
+                continue
+            bot_metrics.updates.inc()
+            pool.submit(
+                event.user_id,
+                timed_handle_event,
+                event,
+                replies,
+                questions,
+                store,
+                keyboard,
+            )
+
+
 def main() -> None:
     """
     Main function for the VK bot.
 
     This function runs an infinite loop listening for MESSAGE_NEW events in the
-    VK bot's chat. If the event is a message from the user to the bot, it checks
-    the message text and either sends a new question or checks the user's answer
-    to the current question.
+    VK bot's chat and handling them with serve_events. The metrics of the bot
+    are served over HTTP if METRICS_PORT is set.
 
     Logs any errors that occur during the loop.
 
@@ -149,10 +278,37 @@ def main() -> None:
     """
 
     settings = setup_settings()
-    redis_db: redis.Redis = redis.from_url(settings["redis_url"])
+    # The workers, the cache invalidator and the session compactor.
+    redis_db: redis.Redis = connect(
+        settings["redis_url"], settings["vk_workers"] + 2
+    )
     logger: logging.Logger = setup_logging(settings)
-    questions: dict[str, str] = load_questions(settings)
-    keyboard: VkKeyboard = set_keyboard()
+    questions: QuestionBank = load_questions(settings)
+    bot_metrics = BotMetrics()
+    cache = start_session_cache(
+        redis_db,
+        VK_PLATFORM,
+        settings["session_cache_size"],
+        settings["session_cache_ttl"],
+    )
+    store = QuizStore(
+        redis_db,
+        questions,
+        VK_PLATFORM,
+        cache=cache,
+        session_ttl=settings["session_ttl"],
+        bot_metrics=bot_metrics,
+        facets=load_facets(settings, questions),
+    )
+    SessionCompactor(redis_db, questions, settings["session_ttl"])
+    bot_metrics.watch_corpus(lambda: len(questions))
+    if cache is not None:
+        bot_metrics.watch_cache(cache.metrics)
+    start_metrics_server(
+        bot_metrics.registry,
+        settings["metrics_listen"],
+        settings["metrics_port"],
+    )
 
     vk_bot_start_log_message: str = "vk_bot started"
     while True:
@@ -162,13 +318,14 @@ def main() -> None:
             longpoll: VkLongPoll = VkLongPoll(vk_session)
             logging.info(vk_bot_start_log_message)
             logger.info(vk_bot_start_log_message)
-            for event in longpoll.listen():
-                if event.type != VkEventType.MESSAGE_NEW or not event.to_me:
-                    continue
-                make_keyboard(event, vk_api, keyboard)
-                if event.text != "Новый вопрос":
-                    handle_solution_attempt(event, vk_api, questions, redis_db)
-                handle_new_question_request(event, vk_api, questions, redis_db)
+            serve_events(
+                longpoll.listen(),
+                vk_api,
+                questions,
+                store,
+                settings["vk_workers"],
+                bot_metrics,
+            )
         except TimeoutError as timeout_error:
             logging.error(
                 f"Превышено время ожидания {timeout_error.with_traceback}"
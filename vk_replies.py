@@ -0,0 +1,203 @@
+from dataclasses import dataclass, field
+import logging
+import queue
+import threading
+import time
+
+import vk_api as vk
+from vk_api.execute import VkFunction
+from vk_api.keyboard import VkKeyboard
+from vk_api.utils import get_random_id
+
+from metrics import BotMetrics
+from outbound import VK_RATE, TokenBucket, get_vk_retry_after
+
+
+MAX_EXECUTE_CALLS = 25
+# How many times a batch is sent before it is dropped, so a batch VK keeps
+# rejecting doesn't hold up the replies queued after it.
+MAX_SEND_ATTEMPTS = 5
+SEND_REPLIES = VkFunction(
+    args=("replies",),
+    code="""
+    var replies = %(replies)s;
+    var results = [];
+    var i = 0;
+    while (i < replies.length) {
+        results.push(API.messages.send(replies[i]));
+        i = i + 1;
+    }
+    return results;
+    """,
+)
+_STOP = object()
+
+
+@dataclass
+class VkReply:
+    """
+    Collects everything the bot answers to one VK event, so the answer is
+    sent with a single messages.send call.
+    """
+
+    user_id: int
+    texts: list[str] = field(default_factory=list)
+    keyboard: VkKeyboard | None = None
+
+    def add(self, text: str) -> None:
+        self.texts.append(text)
+
+    def to_params(self) -> dict:
+        """
+        Returns the parameters of messages.send for the reply.
+
+        The texts are joined with blank lines. The random id is unique,
+        so VK does not mistake the reply for a resent earlier one.
+
+        Returns:
+            dict: The parameters of messages.send.
+        """
+        params = {
+            "user_id": self.user_id,
+            "message": "\n\n".join(self.texts),
+            "random_id": get_random_id(),
+        }
+        if self.keyboard is not None:
+            params["keyboard"] = self.keyboard.get_keyboard()
+        return params
+
+
+def send_replies(
+    vk_api: vk.vk_api.VkApiMethod, replies: list[VkReply]
+) -> None:
+    """
+    Sends replies to several users with as few API calls as possible.
+
+    A single reply is sent with messages.send, more replies are sent with
+    the execute method, which runs up to MAX_EXECUTE_CALLS of them in one
+    request.
+
+    Args:
+        vk_api (VkApiMethod): The VK API object.
+        replies (list[VkReply]): The replies, sent in this order.
+
+    Returns:
+        None
+    """
+    if len(replies) == 1:
+        vk_api.messages.send(**replies[0].to_params())
+        return
+    for start in range(0, len(replies), MAX_EXECUTE_CALLS):
+        batch = replies[start : start + MAX_EXECUTE_CALLS]
+        code = SEND_REPLIES.compile(
+            {"replies": [reply.to_params() for reply in batch]}
+        )
+        vk_api.execute(code=code)
+
+
+class ReplySender:
+    """
+    Sends replies from a background thread, batching them under load.
+
+    The sender takes every reply that is waiting in the queue when it is
+    free and sends them together with send_replies. When the bot is idle a
+    reply is sent alone right away; when replies pile up while a request is
+    in flight, they go out in a single execute call. Replies are sent in
+    the order they were queued, so the order within a conversation holds.
+
+    Requests are limited by a token bucket to the rate VK allows, and a
+    batch rejected by flood control is retried after a pause, up to
+    max_attempts times in total. Meanwhile new replies join the next batch
+    instead of costing more requests.
+    """
+
+    def __init__(
+        self,
+        vk_api: vk.vk_api.VkApiMethod,
+        rate: float = VK_RATE,
+        bot_metrics: BotMetrics | None = None,
+        max_attempts: int = MAX_SEND_ATTEMPTS,
+    ) -> None:
+        """
+        Initializes a ReplySender instance and starts its thread.
+
+        Args:
+            vk_api (VkApiMethod): The VK API object.
+            rate (float): API requests per second allowed for the token.
+            bot_metrics (BotMetrics | None): The metrics of the bot, the
+                duration and the errors of the API calls are observed.
+            max_attempts (int): How many times a batch rejected by flood
+                control is sent before it is dropped.
+
+        Returns:
+            None
+        """
+        self.vk_api = vk_api
+        self.bot_metrics = bot_metrics
+        self.max_attempts = max_attempts
+        self.bucket = TokenBucket(rate, rate)
+        self.replies: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._send_forever, daemon=True)
+        self._thread.start()
+
+    def send(self, reply: VkReply) -> None:
+        """Queues a reply to be sent."""
+        self.replies.put(reply)
+
+    def close(self) -> None:
+        """Sends the queued replies and stops the thread."""
+        self.replies.put(_STOP)
+        self._thread.join()
+
+    def __enter__(self) -> "ReplySender":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _send_forever(self) -> None:
+        stopping = False
+        while not stopping:
+            batch = [self.replies.get()]
+            while len(batch) < MAX_EXECUTE_CALLS:
+                try:
+                    batch.append(self.replies.get_nowait())
+                except queue.Empty:
+                    break
+            if _STOP in batch:
+                stopping = True
+                batch.remove(_STOP)
+            if batch:
+                self._send_batch(batch)
+
+    def _send_batch(self, batch: list[VkReply]) -> None:
+        for attempt in range(1, self.max_attempts + 1):
+            time.sleep(self.bucket.reserve())
+            started_at = time.perf_counter()
+            try:
+                send_replies(self.vk_api, batch)
+            except Exception as error:
+                retry_after = get_vk_retry_after(error)
+                retried = retry_after is not None and (
+                    attempt < self.max_attempts
+                )
+                self._observe(started_at, error, retried)
+                if not retried:
+                    logging.exception(
+                        f"Не удалось отправить {len(batch)} ответов, "
+                        f"попыток: {attempt}"
+                    )
+                    return
+                logging.warning(f"Отправка приостановлена: {error}")
+                time.sleep(retry_after)
+            else:
+                self._observe(started_at, None, False)
+                return
+
+    def _observe(
+        self, started_at: float, error: Exception | None, retried: bool
+    ) -> None:
+        if self.bot_metrics is not None:
+            self.bot_metrics.observe_request(
+                time.perf_counter() - started_at, error, retried
+            )
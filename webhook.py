@@ -0,0 +1,103 @@
+from collections.abc import Callable
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import hmac
+import json
+import logging
+
+
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+MAX_UPDATE_SIZE = 1024 * 1024
+# Seconds an idle connection is kept open, which also bounds how long
+# a shutdown waits for it.
+CONNECTION_TIMEOUT = 5
+
+
+class WebhookRequestHandler(BaseHTTPRequestHandler):
+    # Telegram reuses connections to the webhook.
+    protocol_version = "HTTP/1.1"
+    timeout = CONNECTION_TIMEOUT
+    server: "WebhookServer"
+
+    def do_POST(self) -> None:
+        """
+        Accepts an update from Telegram.
+
+        Requests to another path get 404, requests without the secret token
+        get 403. The update is passed on and answered right away, so
+        Telegram does not wait while the bot handles it. Once the server is
+        shutting down, updates get 503 and Telegram sends them again later.
+        """
+        if self.server.closing:
+            self.close_connection = True
+            self.send_error(HTTPStatus.SERVICE_UNAVAILABLE)
+            return
+        if self.path != self.server.path:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        secret_token = self.headers.get(SECRET_TOKEN_HEADER, "")
+        if not hmac.compare_digest(
+            secret_token.encode(), self.server.secret_token.encode()
+        ):
+            self.send_error(HTTPStatus.FORBIDDEN)
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        if length > MAX_UPDATE_SIZE:
+            self.send_error(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+            return
+        try:
+            update = json.loads(self.rfile.read(length))
+        except ValueError:
+            self.send_error(HTTPStatus.BAD_REQUEST)
+            return
+        self.server.on_update(update)
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format: str, *args) -> None:
+        logging.debug(f"{self.address_string()} {format % args}")
+
+
+class WebhookServer(ThreadingHTTPServer):
+    """
+    HTTP server receiving Telegram updates sent to a webhook.
+
+    Each request is served in its own thread. The server only checks and
+    decodes the update; what happens to it is decided by on_update.
+    server_close waits for the requests being served, so every update
+    Telegram got 200 for has been passed to on_update when it returns.
+    """
+
+    daemon_threads = False
+    block_on_close = True
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        path: str,
+        secret_token: str,
+        on_update: Callable[[dict], None],
+    ) -> None:
+        """
+        Initializes a WebhookServer instance and binds it to the address.
+
+        Args:
+            address (tuple[str, int]): The host and port to listen on.
+            path (str): The URL path Telegram sends updates to.
+            secret_token (str): The secret token given to setWebhook.
+            on_update (Callable[[dict], None]): Called with every update.
+
+        Returns:
+            None
+        """
+        super().__init__(address, WebhookRequestHandler)
+        self.path = path
+        self.secret_token = secret_token
+        self.on_update = on_update
+        self.closing = False
+
+    def shutdown(self) -> None:
+        """Stops accepting connections and refuses further updates."""
+        self.closing = True
+        super().shutdown()